@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+ann_index.py
+🔹 بحث تقريبي عن أقرب الجيران (IVF) فوق فهرس التضمينات
+- تدريب مراكز k-means كروية على التضمينات المطبّعة
+- قوائم مقلوبة (inverted lists) مخزّنة بصيغة CSR بجانب ملفات ./index
+- عند السؤال تُفحص أقرب nprobe قائمة فقط بدل كل المقاطع
+- الصفوف المضافة بالمزامنة بعد التدريب (delta) تُفحص كاملة دائمًا
+
+الاستخدام:
+  python ann_index.py build [./index]    # تدريب وحفظ ivf.npz
+  python ann_index.py report [./index]   # تقرير recall@k والزمن مقابل البحث الدقيق
+"""
+
+import os
+import sys
+import time
+import numpy as np
+
+from vector_index import DTYPE, to_query_vector
+
+# ===================== الإعدادات =====================
+IVF_FILE = "ivf.npz"
+NPROBE = 8                 # عدد القوائم المفحوصة لكل سؤال (دقة ↑ زمن ↑)
+KMEANS_ITERS = 20
+KMEANS_SAMPLE = 50_000     # أقصى عدد صفوف لتدريب المراكز
+ASSIGN_BATCH = 8192
+REPORT_QUERIES = 200
+REPORT_K = 5
+REPORT_NPROBES = (1, 2, 4, 8, 16, 32)
+
+
+# ===================== k-means =====================
+def default_nlist(n):
+    """عدد القوائم ≈ √N (قاعدة شائعة لـ IVF)"""
+    return max(1, min(int(np.sqrt(n)), 4096))
+
+
+def _assign(matrix, centroids):
+    """أقرب مركز لكل صف (على دفعات لتحديد استهلاك الذاكرة)"""
+    labels = np.empty(len(matrix), dtype=np.int32)
+    for start in range(0, len(matrix), ASSIGN_BATCH):
+        block = np.asarray(matrix[start:start + ASSIGN_BATCH], dtype=DTYPE)
+        labels[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+def train_centroids(matrix, nlist, iters=KMEANS_ITERS, seed=0):
+    """k-means كروي: المراكز مطبّعة والمسافة هي التشابه الكوني"""
+    rng = np.random.default_rng(seed)
+    n = len(matrix)
+    sample_idx = np.sort(rng.choice(n, size=min(n, KMEANS_SAMPLE), replace=False))
+    sample = np.asarray(matrix[sample_idx], dtype=DTYPE)
+    centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+
+    for _ in range(iters):
+        labels = _assign(sample, centroids)
+        counts = np.bincount(labels, minlength=nlist)
+        order = np.argsort(labels, kind="stable")
+        sums = np.zeros_like(centroids)
+        filled = counts > 0
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[filled]
+        sums[filled] = np.add.reduceat(sample[order], starts, axis=0)
+        empty = ~filled
+        # القوائم الفارغة تُعاد تهيئتها بصفوف عشوائية
+        sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = sums / norms
+    return centroids
+
+
+# ===================== الفهرس التقريبي =====================
+class IVFIndex:
+    """غلاف IVF حول VectorIndex بنفس واجهة scores/top_k/search"""
+
+    def __init__(self, index, centroids, order, offsets, nprobe=NPROBE):
+        self.index = index
+        self.centroids = centroids
+        self.order = order        # مواقع الصفوف مرتبة حسب القائمة
+        self.offsets = offsets    # بداية كل قائمة داخل order (CSR)
+        self.nprobe = nprobe
+
+    @classmethod
+    def build(cls, index, nlist=None, nprobe=NPROBE):
+        """تدريب المراكز على صفوف المصفوفة الأساسية وبناء القوائم"""
+        matrix = index.matrix
+        centroids = train_centroids(matrix, nlist or default_nlist(len(matrix)))
+        labels = _assign(matrix, centroids)
+        order = np.argsort(labels, kind="stable").astype(np.int64)
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=len(centroids)))])
+        return cls(index, centroids, order, offsets, nprobe)
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @property
+    def info(self):
+        return self.index.info
+
+    def __len__(self):
+        return len(self.index)
+
+    def candidates(self, q, nprobe):
+        """مواقع صفوف أقرب nprobe قائمة"""
+        nprobe = min(nprobe, self.nlist)
+        probe = np.argpartition(-(self.centroids @ q), nprobe - 1)[:nprobe]
+        return np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in probe])
+
+    def scores(self, q_vec, nprobe=None):
+        """درجات بطول الفهرس كاملًا: الصفوف غير المفحوصة = ‎-inf"""
+        q = to_query_vector(q_vec, self.index.dim)
+        if q is None or len(self) == 0:
+            return self.index.scores(q_vec)
+
+        n_base = self.index.matrix.shape[0]
+        scores = np.full(len(self), -np.inf, dtype=DTYPE)
+        cand = np.sort(self.candidates(q, nprobe or self.nprobe))
+        scores[cand] = self.index.matrix[cand] @ q
+        offset = n_base
+        for m in self.index.segments:
+            scores[offset:offset + len(m)] = m @ q
+            offset += len(m)
+        if self.index.deleted.size:
+            scores[self.index.deleted] = -np.inf
+        return scores
+
+    def top_k(self, scores, k, min_score=None):
+        return self.index.top_k(scores, k, min_score)
+
+    def search(self, q_vec, k, min_score=None, nprobe=None):
+        return self.top_k(self.scores(q_vec, nprobe), k, min_score)
+
+    # ---------- الحفظ والتحميل ----------
+    def save(self, path):
+        """حفظ القوائم مع بصمة embeddings.npy التي دُرّبت عليها (وقت التعديل والحجم)"""
+        tmp = os.path.join(path, IVF_FILE + ".tmp")
+        mtime, size = _source_stamp(path)
+        with open(tmp, "wb") as f:
+            np.savez(f, centroids=self.centroids, order=self.order, offsets=self.offsets,
+                     n_trained=self.index.matrix.shape[0], source_mtime=mtime, source_size=size)
+        os.replace(tmp, os.path.join(path, IVF_FILE))
+
+
+def _source_stamp(path):
+    """(وقت التعديل، الحجم) لملف embeddings.npy"""
+    from index_store import EMBEDDINGS_FILE
+    st = os.stat(os.path.join(path, EMBEDDINGS_FILE))
+    return st.st_mtime, st.st_size
+
+
+def load_ivf(index, path, nprobe=NPROBE):
+    """تحميل ivf.npz لفهرس محمّل، أو None إذا لم يوجد أو صار قديمًا
+
+    يصبح الملف قديمًا عند إعادة بناء المصفوفة الأساسية أو ضغطها (تتغير
+    مواقع الصفوف حتى لو بقي عددها كما هو)؛ يُكشف ذلك ببصمة embeddings.npy
+    المحفوظة، وعندها يُعاد البحث الدقيق حتى يُعاد التدريب.
+    """
+    file = os.path.join(path, IVF_FILE)
+    if not os.path.exists(file):
+        return None
+    data = np.load(file)
+    stamp = (float(data["source_mtime"]), int(data["source_size"])) if "source_mtime" in data else None
+    if int(data["n_trained"]) != index.matrix.shape[0] or stamp != _source_stamp(path):
+        print("⚠️ ملف IVF لا يطابق الفهرس الحالي؛ أعد تشغيل: python ann_index.py build")
+        return None
+    return IVFIndex(index, data["centroids"], data["order"], data["offsets"], nprobe)
+
+
+# ===================== تقرير الدقة =====================
+def recall_report(ivf, n_queries=REPORT_QUERIES, k=REPORT_K, nprobes=REPORT_NPROBES, seed=0):
+    """recall@k ومتوسط الزمن لكل nprobe مقارنةً بالبحث الدقيق
+
+    الأسئلة عيّنة من تضمينات المقاطع نفسها مع ضجيج خفيف.
+    """
+    index = ivf.index
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(index.matrix.shape[0], size=min(n_queries, index.matrix.shape[0]), replace=False)
+    queries = np.asarray(index.matrix[np.sort(picks)], dtype=DTYPE)
+    queries += rng.normal(scale=0.02, size=queries.shape).astype(DTYPE)
+
+    t0 = time.perf_counter()
+    truth = [{r["id"] for r in index.search(q, k)} for q in queries]
+    exact_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+
+    rows = [("exact", 1.0, exact_ms)]
+    for nprobe in nprobes:
+        if nprobe > ivf.nlist:
+            break
+        t0 = time.perf_counter()
+        found = [{r["id"] for r in ivf.search(q, k, nprobe=nprobe)} for q in queries]
+        ms = (time.perf_counter() - t0) * 1000 / len(queries)
+        recall = np.mean([len(f & t) / max(len(t), 1) for f, t in zip(found, truth)])
+        rows.append((f"nprobe={nprobe}", float(recall), ms))
+    return rows
+
+
+# ===================== تنفيذ مباشر =====================
+if __name__ == "__main__":
+    from index_store import INDEX_DIR, load_index
+
+    args = sys.argv[1:]
+    cmd = args.pop(0) if args and args[0] in ("build", "report") else "build"
+    path = args[0] if args else INDEX_DIR
+
+    index = load_index(path)
+    if index is None:
+        print(f"❌ لا يوجد فهرس في {path}؛ شغّل أولًا: python index_store.py")
+        sys.exit(1)
+
+    if cmd == "build":
+        t0 = time.time()
+        ivf = IVFIndex.build(index)
+        ivf.save(path)
+        print(f"✅ تم بناء IVF: {ivf.nlist} قائمة لـ {len(index)} مقطعًا خلال {time.time() - t0:.1f} ث.")
+    else:
+        ivf = load_ivf(index, path)
+        if ivf is None:
+            print("❌ لا يوجد ملف IVF صالح؛ شغّل: python ann_index.py build")
+            sys.exit(1)
+        print(f"📊 recall@{REPORT_K} مقابل البحث الدقيق ({len(index)} مقطعًا، {ivf.nlist} قائمة):")
+        for name, recall, ms in recall_report(ivf):
+            print(f"  {name:<12} recall={recall*100:5.1f}%  زمن={ms:7.2f} ms")
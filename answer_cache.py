@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+answer_cache.py
+🔹 ذاكرة دلالية للإجابات: السؤال المُعاد صياغته لا يكلف استدعاء نموذج جديدًا
+- جدول answer_cache: تضمين السؤال، الإجابة، أرقام المقاطع المرجعية وبصماتها،
+  النموذج، وقت الإنشاء وآخر استعمال
+- البحث بالتشابه الكوني (NumPy) على تضمينات الإجابات المحفوظة في الذاكرة
+- الإجابة تُبطَل إذا تغيّر أو حُذف أحد المقاطع التي بُنيت عليها (md5 للمحتوى)؛
+  الإبطال يحدث عند البحث فقط (lookup)، فحذف الكتب أو إعادة إدخالها لا يلمس
+  الجدول، والإجابة القديمة تُحذف عند أول سؤال يصيبها
+- الإخلاء: انتهاء الصلاحية (TTL) ثم الأقدم استعمالًا عند تجاوز الحد (LRU)
+"""
+
+import threading
+import numpy as np
+
+from vector_index import DTYPE, normalize_rows, to_query_vector
+
+# ===================== الإعدادات =====================
+ANSWER_CACHE_THRESHOLD = 0.95      # أدنى تشابه بين السؤالين لاعتبارهما السؤال نفسه
+ANSWER_CACHE_TTL_DAYS = 30
+ANSWER_CACHE_MAX_ENTRIES = 5000
+ANSWER_CACHE_MODE = "answer"       # "answer": إعادة الإجابة مباشرة، "draft": تمريرها مسودة للنموذج
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS answer_cache (
+    id              SERIAL PRIMARY KEY,
+    query           TEXT NOT NULL,
+    query_embedding DOUBLE PRECISION[] NOT NULL,
+    answer          TEXT NOT NULL,
+    chunk_ids       INT[] NOT NULL,
+    chunk_md5       TEXT[] NOT NULL,
+    model           TEXT NOT NULL,
+    hit_count       INT DEFAULT 0,
+    created_at      TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_used_at    TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_answer_cache_model ON answer_cache(model);
+"""
+
+
+def ensure_answer_cache_schema(conn):
+    cur = conn.cursor()
+    cur.execute(SCHEMA_SQL)
+    cur.close()
+    conn.commit()
+
+
+class SemanticAnswerCache:
+    """answer_cache مع نسخة من تضميناته في الذاكرة تُحدَّث عند تغيّر الجدول"""
+
+    def __init__(self, connect, model, threshold=ANSWER_CACHE_THRESHOLD,
+                 ttl_days=ANSWER_CACHE_TTL_DAYS, max_entries=ANSWER_CACHE_MAX_ENTRIES):
+        self.connect = connect
+        self.model = model
+        self.threshold = threshold
+        self.ttl_days = ttl_days
+        self.max_entries = max_entries
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.matrix = np.zeros((0, 0), dtype=DTYPE)
+        self.version = None      # (count, max_id) للجدول عند آخر تحميل
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        conn = connect()
+        try:
+            ensure_answer_cache_schema(conn)
+        finally:
+            conn.close()
+
+    # ---------- تحميل التضمينات ----------
+    def _refresh(self, cur):
+        """إعادة تحميل التضمينات إذا أضافت/حذفت عملية أخرى إجابات"""
+        cur.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM answer_cache WHERE model = %s;",
+                    (self.model,))
+        version = cur.fetchone()
+        if version == self.version:
+            return
+        cur.execute("SELECT id, query_embedding FROM answer_cache WHERE model = %s ORDER BY id;",
+                    (self.model,))
+        rows = cur.fetchall()
+        dim = len(rows[0][1]) if rows else 0
+        rows = [(i, v) for i, v in rows if len(v) == dim]
+        self.ids = np.array([i for i, _ in rows], dtype=np.int64)
+        self.matrix = normalize_rows(np.array([v for _, v in rows], dtype=DTYPE).reshape(len(rows), dim))
+        self.version = version
+
+    # ---------- البحث ----------
+    def lookup(self, q_vec):
+        """أقرب إجابة محفوظة صالحة: dict(id, query, answer, chunk_ids, score) أو None"""
+        conn = self.connect()
+        cur = conn.cursor()
+        try:
+            with self.lock:
+                self._refresh(cur)
+                q = to_query_vector(q_vec, self.matrix.shape[1]) if len(self.ids) else None
+                if q is None:
+                    self.misses += 1
+                    return None
+                # نسخة من المرجع: جلسة أخرى قد تستبدل self.ids بعد تحرير القفل
+                ids = self.ids
+                scores = self.matrix @ q
+                order = np.argsort(-scores, kind="stable")
+            for pos in order:
+                if scores[pos] < self.threshold:
+                    break
+                hit = self._validate(cur, int(ids[pos]))
+                if hit is not None:
+                    conn.commit()
+                    hit["score"] = float(scores[pos])
+                    self.hits += 1
+                    return hit
+            conn.commit()
+            self.misses += 1
+            return None
+        finally:
+            cur.close(); conn.close()
+
+    def _validate(self, cur, entry_id):
+        """التحقق من أن المقاطع المرجعية لم تتغير؛ الإجابة القديمة تُحذف
+
+        هذا هو موضع الإبطال الوحيد: لا شيء يحذف الإجابات عند حذف المقاطع.
+        """
+        cur.execute("""
+            SELECT query, answer, chunk_ids, chunk_md5 FROM answer_cache
+            WHERE id = %s AND created_at > NOW() - make_interval(days => %s);
+        """, (entry_id, self.ttl_days))
+        row = cur.fetchone()
+        if row is None:
+            cur.execute("DELETE FROM answer_cache WHERE id = %s;", (entry_id,))
+            return None
+        query, answer, chunk_ids, chunk_md5 = row
+        cur.execute("SELECT id, md5(content) FROM chunk WHERE id = ANY(%s);", (chunk_ids,))
+        current = dict(cur.fetchall())
+        if [current.get(i) for i in chunk_ids] != list(chunk_md5):
+            cur.execute("DELETE FROM answer_cache WHERE id = %s;", (entry_id,))
+            return None
+        cur.execute("""
+            UPDATE answer_cache SET last_used_at = NOW(), hit_count = hit_count + 1 WHERE id = %s;
+        """, (entry_id,))
+        return dict(id=entry_id, query=query, answer=answer, chunk_ids=list(chunk_ids))
+
+    # ---------- التخزين ----------
+    def put(self, query, q_vec, answer, chunk_ids):
+        """حفظ إجابة مبنية على المقاطع chunk_ids ثم تطبيق الإخلاء
+
+        إذا لم يُحذف شيء ولم تكتب عملية أخرى منذ آخر تحميل، يُضاف الصف
+        الجديد إلى المصفوفة في الذاكرة بدل إعادة تحميل الجدول كله.
+        """
+        chunk_ids = [int(i) for i in chunk_ids]
+        conn = self.connect()
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT id, md5(content) FROM chunk WHERE id = ANY(%s);", (chunk_ids,))
+            current = dict(cur.fetchall())
+            if any(i not in current for i in chunk_ids):
+                conn.rollback()
+                return
+            cur.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM answer_cache WHERE model = %s;",
+                        (self.model,))
+            before = cur.fetchone()
+            cur.execute("""
+                INSERT INTO answer_cache (query, query_embedding, answer, chunk_ids, chunk_md5, model)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                RETURNING id;
+            """, (query, [float(x) for x in q_vec], answer, chunk_ids,
+                  [current[i] for i in chunk_ids], self.model))
+            entry_id = cur.fetchone()[0]
+            evicted = self._evict(cur)
+            conn.commit()
+        finally:
+            cur.close(); conn.close()
+        if not evicted:
+            self._append(before, entry_id, q_vec)
+
+    def _append(self, before, entry_id, q_vec):
+        """إضافة الصف المحفوظ للتو إلى النسخة في الذاكرة إن كانت مطابقة لما قبله"""
+        with self.lock:
+            if self.version != before:
+                return    # تغيّر الجدول من مكان آخر: lookup التالي يعيد التحميل
+            dim = self.matrix.shape[1] if len(self.ids) else len(q_vec)
+            vec = to_query_vector(q_vec, dim)
+            if vec is None:
+                return
+            # مصفوفات جديدة ثم استبدال المراجع، فالبحث الجاري على النسخة القديمة لا يتأثر
+            self.ids = np.append(self.ids, np.int64(entry_id))
+            self.matrix = np.vstack([self.matrix, vec[None, :]]) if len(self.ids) > 1 else vec[None, :].copy()
+            self.version = (before[0] + 1, entry_id)
+
+    def _evict(self, cur):
+        """حذف المنتهية صلاحيتها ثم الأقدم استعمالًا؛ يعيد عدد المحذوف"""
+        cur.execute("DELETE FROM answer_cache WHERE created_at <= NOW() - make_interval(days => %s);",
+                    (self.ttl_days,))
+        removed = cur.rowcount
+        cur.execute("""
+            DELETE FROM answer_cache WHERE id IN (
+                SELECT id FROM answer_cache ORDER BY last_used_at DESC OFFSET %s
+            );
+        """, (self.max_entries,))
+        return removed + cur.rowcount
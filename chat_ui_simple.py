@@ -11,11 +11,13 @@ chat_ui.py
 """
 
 import streamlit as st
-import psycopg2
-import requests
 import json
-import math
-from llm_client import generate_from_llm
+from llm_client import stream_from_llm
+from index_store import SharedIndex, attach_contents, embedding_columns
+from query_cache import cached_embed
+from db_pool import DBPool
+from http_client import post_json
+from citation_verifier import verify_answer, references_payload, format_report
 from dotenv import load_dotenv
 import os
 
@@ -35,36 +37,51 @@ DB = dict(
 EMBED_MODEL = "text-embedding-intfloat-multilingual-e5-large-instruct"
 LANGUAGE_HINT = "اللغة العربية الفصحى الأكاديمية"
 TOP_K = 5
+SEARCH_BACKEND = "exact"  # "exact" أو "ivf" أو "int8"/"float16" أو "pgvector"
 TEMPERATURE = 0.2
 MAX_TOKENS = 1024
 
 # ===================== أدوات مساعدة =====================
-def connect_db():
-    return psycopg2.connect(**DB)
+@st.cache_resource
+def get_db_pool():
+    """مجمّع اتصالات واحد لكل خادم Streamlit تتشاركه كل الجلسات وإعادات التشغيل"""
+    return DBPool(**DB)
 
-def cosine(a, b):
-    if not a or not b or len(a) != len(b):
-        return 0.0
-    dot = sum(x * y for x, y in zip(a, b))
-    na = math.sqrt(sum(x * x for x in a))
-    nb = math.sqrt(sum(y * y for y in b))
-    return 0.0 if (na == 0 or nb == 0) else dot / (na * nb)
+def connect_db():
+    """اتصال مستعار من المجمّع؛ conn.close() تعيده إليه"""
+    return get_db_pool().connect()
+
+@st.cache_resource
+def get_shared_index():
+    """فهرس الاسترجاع: يُحمَّل مرة لكل خادم ويتشاركه الجميع، ويُحدَّث عند تغيّر جدول chunk"""
+    return SharedIndex(fetch_chunks, connect_db, backend=SEARCH_BACKEND)
+
+def show_index_info():
+    """مؤشر في الشريط الجانبي: إصدار الفهرس وحجمه وزمن تحميله"""
+    info = get_shared_index().info
+    if info:
+        st.sidebar.caption(
+            f"🗂️ الفهرس: الإصدار {info['max_id']} · {info['count']} مقطعًا · "
+            f"{info['backend']} ({info['source']}) · تحميل {info['load_seconds']:.2f} ث"
+        )
 
 def embed(text):
-    """توليد تضمين محلي (يمكن لاحقًا تحويله لـ OpenAI embeddings)"""
-    r = requests.post(
-        "http://127.0.0.1:1234/v1/embeddings",
-        json={"model": EMBED_MODEL, "input": text},
-    )
-    r.raise_for_status()
-    return r.json()["data"][0]["embedding"]
+    """توليد تضمين محلي (يمكن لاحقًا تحويله لـ OpenAI embeddings)
+
+    الذاكرة مشتركة بين إعادات التشغيل والجلسات، فإعادة السؤال نفسه لا تكلف طلبًا.
+    """
+    return cached_embed(EMBED_MODEL, text, _embed_remote)
+
+def _embed_remote(text):
+    data = post_json("http://127.0.0.1:1234/v1/embeddings", {"model": EMBED_MODEL, "input": text}, op="embed")
+    return data["data"][0]["embedding"]
 
 def fetch_chunks():
     """جلب المقاطع من قاعدة البيانات"""
     conn = connect_db()
     cur = conn.cursor()
-    cur.execute("""
-        SELECT id, book_id, book_name, content, start_line, end_line, embedding_vector
+    cur.execute(f"""
+        SELECT id, book_id, book_name, content, start_line, end_line, {embedding_columns(conn)}
         FROM chunk
         ORDER BY id ASC;
     """)
@@ -72,8 +89,8 @@ def fetch_chunks():
     cur.close(); conn.close()
     return [
         dict(id=c, book_id=b, book_name=n, content=t,
-             start_line=s, end_line=e, embedding=v)
-        for c, b, n, t, s, e, v in rows
+             start_line=s, end_line=e, embedding=p if p is not None else v)
+        for c, b, n, t, s, e, p, v in rows
     ]
 
 def short_extract(text, max_words=20):
@@ -106,17 +123,14 @@ def ensure_conversation():
 # ===================== البحث في المقاطع (عتبة تكيفية) =====================
 def search_chunks(query):
     q_vec = embed(query)
-    chunks = fetch_chunks()
+    index = get_shared_index().get()
     thresholds = [0.80, 0.70, 0.60]
+    # بحث واحد بأدنى عتبة: أفضل k فوق عتبة أعلى هي بادئة هذه النتائج نفسها
+    candidates = index.search(q_vec, TOP_K, thresholds[-1])
     for threshold in thresholds:
-        results = []
-        for c in chunks:
-            s = cosine(q_vec, c["embedding"])
-            if s >= threshold:
-                results.append({**c, "score": s})
+        results = [r for r in candidates if r["score"] >= threshold]
         if results:
-           
-            return sorted(results, key=lambda x: x["score"], reverse=True)[:TOP_K]
+            return attach_contents(connect_db, results)
     st.warning("⚠️ لم يتم العثور على مقاطع كافية حتى بأدنى عتبة (0.60).")
     return []
 
@@ -125,6 +139,7 @@ def generate_answer(query, ranked):
     """
     توليد إجابة معتمدة على المقاطع الفعلية
     + دعم الذاكرة الحوارية (سياق الجلسة)
+    تُعاد الإجابة رمزًا رمزًا (مولّد) لتُعرض أثناء وصولها
     """
     # دالة لتقصير النصوص الطويلة
     def _clip(text, max_chars=900):
@@ -173,11 +188,9 @@ def generate_answer(query, ranked):
 """.strip()
 
     try:
-        answer = generate_from_llm(prompt)
+        yield from stream_from_llm(prompt)
     except Exception as e:
-        answer = f"⚠️ حدث خطأ أثناء الاتصال بـ OpenAI: {e}"
-
-    return answer
+        yield f"⚠️ حدث خطأ أثناء الاتصال بـ OpenAI: {e}"
 
 # ===================== واجهة Streamlit =====================
 st.set_page_config(page_title="دردشة نبراس", layout="centered")
@@ -191,6 +204,9 @@ st.markdown(
     unsafe_allow_html=True,
 )
 
+get_shared_index().get()
+show_index_info()
+
 st.title("🤖 واجهة الدردشة العربية – مشروع نبراس (مدعوم بـ OpenAI GPT-4o-mini)")
 st.write("اكتب سؤالك بالعربية وسيجيبك النظام بناءً على كتبك المحفوظة مع الحفاظ على سياق الحوار.")
 
@@ -220,37 +236,39 @@ if prompt:
         ranked = []
         st.error(f"⚠️ خطأ أثناء البحث في المقاطع: {e}")
 
-    # توليد الإجابة
-    try:
-        answer = generate_answer(prompt, ranked)
-    except Exception as e:
-        answer = f"⚠️ حدث خطأ أثناء توليد الإجابة: {e}"
-
-    # المراجع
-    refs_text = ""
-    if ranked and len(ranked) > 0:
-        refs_text = "\n\n---\n\n📖 **المراجع المستعملة:**\n"
-        for i, r in enumerate(ranked, 1):
-            refs_text += (
-                f"- (مرجع {i}) **{r['book_name']}**  \n"
-                f"  • الأسطر: {r['start_line']}–{r['end_line']}  \n"
-                f"  • نسبة التشابه: {r['score']*100:.1f}%  \n"
-                f"  • مقتطف: “{short_extract(r['content'], 20)}”\n\n"
-            )
+    # توليد الإجابة وعرضها أثناء وصولها، ثم المراجع
+    with st.chat_message("assistant", avatar="🤖"):
+        try:
+            answer = st.write_stream(generate_answer(prompt, ranked))
+        except Exception as e:
+            answer = f"⚠️ حدث خطأ أثناء توليد الإجابة: {e}"
+            st.markdown(answer)
+
+        # التحقق من الاقتباسات الفعلية في الإجابة مقابل المقاطع المسترجعة
+        report = verify_answer(answer, [r["content"] for r in ranked])
+
+        # المراجع
+        refs_text = ""
+        if ranked and len(ranked) > 0:
+            refs_text = "\n\n---\n\n📖 **المراجع المستعملة:**\n"
+            for i, r in enumerate(ranked, 1):
+                refs_text += (
+                    f"- (مرجع {i}) **{r['book_name']}**  \n"
+                    f"  • الأسطر: {r['start_line']}–{r['end_line']}  \n"
+                    f"  • نسبة التشابه: {r['score']*100:.1f}%  \n"
+                    f"  • مقتطف: “{short_extract(r['content'], 20)}”\n\n"
+                )
+            st.markdown(refs_text)
+            checks = format_report(report)
+            if checks:
+                st.caption("🔎 تحقق الاقتباسات:  \n" + "  \n".join(checks))
 
     full_answer = answer + refs_text
-
-    # عرض المساعد
     st.session_state.messages.append({"role": "assistant", "content": full_answer})
-    st.chat_message("assistant", avatar="🤖").markdown(full_answer)
 
     # حفظ في قاعدة البيانات
     try:
-        refs_payload = [
-            {"book_name": r["book_name"], "similarity": round(r["score"]*100, 2),
-             "excerpt": short_extract(r["content"]), "verified": True}
-            for r in ranked
-        ]
+        refs_payload = references_payload(ranked, report, short_extract)
         save_message(st.session_state.conversation_id, "user", prompt)
         save_message(st.session_state.conversation_id, "assistant", full_answer, refs_payload)
     except Exception as e:
@@ -4,14 +4,18 @@
 """
 
 import streamlit as st
-import psycopg2
 import os
 import json
-import math
-import requests
 import textwrap
 from dotenv import load_dotenv
 
+from index_store import SharedIndex, attach_contents, embedding_columns
+from query_cache import cached_embed
+from db_pool import DBPool
+from http_client import post_json
+from answer_cache import SemanticAnswerCache, ANSWER_CACHE_MODE
+from citation_verifier import verify_answer, references_payload, format_report
+
 # ==================== الإعداد ====================
 load_dotenv()
 
@@ -27,57 +31,91 @@ LM_STUDIO_BASE = "http://127.0.0.1:1234/v1"
 EMBED_MODEL = "text-embedding-intfloat-multilingual-e5-large-instruct"
 TOP_K = 5
 MIN_ACCEPT = 0.8
+SEARCH_BACKEND = "exact"  # "exact" أو "ivf" أو "int8"/"float16" أو "pgvector"
+ANSWER_MODEL = "gpt-4o-mini"  # مفتاح ذاكرة الإجابات (llm_client.generate_answer)
+CONV_PAGE_SIZE = 30   # عدد المحادثات في كل صفحة من الشريط الجانبي
+MSG_PAGE_SIZE = 20    # عدد الرسائل المحمّلة في كل مرة (الأحدث أولًا)
 
 # ==================== أدوات عامة ====================
-def connect_db():
-    return psycopg2.connect(**DB)
+@st.cache_resource
+def get_db_pool():
+    """مجمّع اتصالات واحد لكل خادم Streamlit تتشاركه كل الجلسات وإعادات التشغيل"""
+    return DBPool(**DB)
 
-def cosine(a, b):
-    if not a or not b or len(a) != len(b):
-        return 0.0
-    dot = sum(x * y for x, y in zip(a, b))
-    na = math.sqrt(sum(x * x for x in a))
-    nb = math.sqrt(sum(y * y for y in b))
-    return 0.0 if (na == 0 or nb == 0) else dot / (na * nb)
+def connect_db():
+    """اتصال مستعار من المجمّع؛ conn.close() تعيده إليه"""
+    return get_db_pool().connect()
+
+@st.cache_resource
+def get_shared_index():
+    """فهرس الاسترجاع: يُحمَّل مرة لكل خادم ويتشاركه الجميع، ويُحدَّث عند تغيّر جدول chunk"""
+    return SharedIndex(fetch_chunks, connect_db, backend=SEARCH_BACKEND)
+
+def show_index_info():
+    """مؤشر في الشريط الجانبي: إصدار الفهرس وحجمه وزمن تحميله"""
+    info = get_shared_index().info
+    if info:
+        st.sidebar.caption(
+            f"🗂️ الفهرس: الإصدار {info['max_id']} · {info['count']} مقطعًا · "
+            f"{info['backend']} ({info['source']}) · تحميل {info['load_seconds']:.2f} ث"
+        )
 
 def embed_text(text):
-    """توليد تضمين عبر LM Studio"""
-    r = requests.post(f"{LM_STUDIO_BASE}/embeddings",
-                      json={"model": EMBED_MODEL, "input": text})
-    r.raise_for_status()
-    return r.json()["data"][0]["embedding"]
+    """توليد تضمين عبر LM Studio (الأسئلة المكررة من query_cache)"""
+    return cached_embed(EMBED_MODEL, text, _embed_remote)
 
-def search_chunks(query):
-    """البحث في قاعدة البيانات عن المقاطع ذات الصلة"""
+def _embed_remote(text):
+    data = post_json(f"{LM_STUDIO_BASE}/embeddings", {"model": EMBED_MODEL, "input": text}, op="embed")
+    return data["data"][0]["embedding"]
+
+def fetch_chunks():
+    """جلب المقاطع من قاعدة البيانات (حين لا يوجد فهرس على القرص)"""
     conn = connect_db()
     cur = conn.cursor()
-    cur.execute("SELECT book_name, content, start_line, end_line, embedding_vector FROM chunk;")
+    cur.execute(f"SELECT id, book_name, content, start_line, end_line, {embedding_columns(conn)} FROM chunk ORDER BY id;")
     rows = cur.fetchall()
     cur.close(); conn.close()
+    return [{"id": cid, "book_name": book_name, "content": content, "start_line": s, "end_line": e,
+             "embedding": packed if packed is not None else emb}
+            for (cid, book_name, content, s, e, packed, emb) in rows]
+
+def search_chunks(query, q_vec=None):
+    """البحث في قاعدة البيانات عن المقاطع ذات الصلة"""
+    if q_vec is None:
+        q_vec = embed_text(query)
+    index = get_shared_index().get()
+    return attach_contents(connect_db, index.search(q_vec, TOP_K, MIN_ACCEPT))
 
-    q_vec = embed_text(query)
-    results = []
-    for (book_name, content, s, e, emb) in rows:
-        score = cosine(q_vec, emb)
-        if score >= MIN_ACCEPT:
-            results.append({
-                "book_name": book_name,
-                "content": content,
-                "start_line": s,
-                "end_line": e,
-                "score": score
-            })
-    results = sorted(results, key=lambda x: x["score"], reverse=True)[:TOP_K]
-    return results
+@st.cache_resource
+def get_answer_cache():
+    """ذاكرة الإجابات الدلالية (نسخة واحدة لكل جلسات Streamlit)"""
+    return SemanticAnswerCache(connect_db, ANSWER_MODEL)
 
 # ==================== قواعد البيانات: المحادثات ====================
-def fetch_conversations():
+def fetch_conversations(search="", after=None, limit=CONV_PAGE_SIZE):
+    """صفحة محادثات بترقيم المفاتيح (last_message_at, id) تنازليًا
+
+    after: مفتاح آخر محادثة في الصفحة السابقة. تعيد (المحادثات، مفتاح الصفحة
+    التالية أو None)؛ لا OFFSET ولا عدّ كامل للجدول.
+    """
+    where, params = [], []
+    if search:
+        where.append("title ILIKE %s")
+        params.append(f"%{search}%")
+    if after:
+        where.append("(last_message_at, id) < (%s, %s)")
+        params.extend(after)
+    sql = "SELECT id, title, last_message_at FROM conversation"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY last_message_at DESC, id DESC LIMIT %s;"
     conn = connect_db()
     cur = conn.cursor()
-    cur.execute("SELECT id, title FROM conversation ORDER BY id DESC;")
+    cur.execute(sql, (*params, limit + 1))
     rows = cur.fetchall()
     cur.close(); conn.close()
-    return [{"id": r[0], "title": r[1]} for r in rows]
+    next_key = (rows[limit - 1][2], rows[limit - 1][0]) if len(rows) > limit else None
+    return [{"id": r[0], "title": r[1]} for r in rows[:limit]], next_key
 
 def create_conversation(title="محادثة جديدة"):
     conn = connect_db()
@@ -96,63 +134,114 @@ def delete_conversation(conv_id):
     conn.commit(); cur.close(); conn.close()
     st.rerun()
 
-def fetch_messages(conv_id):
+def fetch_messages(conv_id, before_id=None, limit=MSG_PAGE_SIZE):
+    """أحدث limit رسالة قبل before_id (بترتيب زمني)، وهل توجد رسائل أقدم"""
     conn = connect_db()
     cur = conn.cursor()
-    cur.execute("SELECT role, content FROM message WHERE conversation_id = %s ORDER BY id ASC;", (conv_id,))
+    cur.execute("""
+        SELECT id, role, content FROM message
+        WHERE conversation_id = %s AND id < %s
+        ORDER BY id DESC LIMIT %s;
+    """, (conv_id, before_id if before_id is not None else 2**31 - 1, limit + 1))
     rows = cur.fetchall()
     cur.close(); conn.close()
-    return [{"role": r[0], "content": r[1]} for r in rows]
-
-def save_message(conv_id, role, content):
-    conn = connect_db()
-    cur = conn.cursor()
-    cur.execute("INSERT INTO message (conversation_id, role, content) VALUES (%s, %s, %s);",
-                (conv_id, role, content))
-    conn.commit(); cur.close(); conn.close()
-
-def update_conversation_title(conv_id, new_title):
-    """تحديث عنوان المحادثة"""
+    has_older = len(rows) > limit
+    return [{"id": r[0], "role": r[1], "content": r[2]} for r in reversed(rows[:limit])], has_older
+
+def open_conversation(conv_id):
+    """تحميل الصفحة الأخيرة فقط من رسائل المحادثة إلى الجلسة"""
+    msgs, has_older = fetch_messages(conv_id)
+    st.session_state["conversation_id"] = conv_id
+    st.session_state["messages"] = msgs
+    st.session_state["has_older"] = has_older
+
+def load_older_messages():
+    """إضافة الصفحة الأقدم التالية أمام الرسائل المعروضة"""
+    msgs = st.session_state["messages"]
+    oldest = next((m["id"] for m in msgs if "id" in m), None)
+    older, has_older = fetch_messages(st.session_state["conversation_id"], before_id=oldest)
+    st.session_state["messages"] = older + msgs
+    st.session_state["has_older"] = has_older
+
+def save_messages(conv_id, messages, title=None):
+    """حفظ رسائل دورة كاملة [(role, content, refs), ...] في جملة SQL واحدة ومعاملة واحدة
+
+    refs (اختياري) يُحفظ في references_json.
+
+    تُحدَّث message_count وlast_message_at في المحادثة، ويُضبط العنوان إن كانت
+    هذه أول رسائلها (message_count = 0)، دون أي COUNT على جدول message.
+    """
     conn = connect_db()
     cur = conn.cursor()
-    cur.execute("UPDATE conversation SET title = %s WHERE id = %s;", (new_title, conv_id))
+    cur.execute("""
+        WITH ins AS (
+            INSERT INTO message (conversation_id, role, content, references_json)
+            SELECT %s, r, c, j FROM unnest(%s::text[], %s::text[], %s::jsonb[]) AS t(r, c, j)
+            RETURNING 1
+        )
+        UPDATE conversation
+        SET message_count = COALESCE(message_count, 0) + (SELECT COUNT(*) FROM ins),
+            last_message_at = NOW(),
+            title = CASE WHEN COALESCE(message_count, 0) = 0 AND %s IS NOT NULL THEN %s ELSE title END
+        WHERE id = %s;
+    """, (conv_id, [m[0] for m in messages], [m[1] for m in messages],
+          [json.dumps(m[2]) if len(m) > 2 and m[2] else None for m in messages],
+          title, title, conv_id))
     conn.commit(); cur.close(); conn.close()
 
 # ==================== واجهة Streamlit ====================
 st.set_page_config(page_title="💬 نبراس Chat", layout="wide")
 
 st.sidebar.title("📚 المحادثات")
-convs = fetch_conversations()
-st.sidebar.write("عدد المحادثات:", len(convs))
+get_shared_index().get()
+show_index_info()
 
 # زر محادثة جديدة
 if st.sidebar.button("➕ محادثة جديدة"):
     cid = create_conversation()
     st.session_state["conversation_id"] = cid
     st.session_state["messages"] = []
+    st.session_state["has_older"] = False
     st.rerun()
 
-# عرض قائمة المحادثات مع زر الحذف 🗑️
+# 🔎 البحث في العناوين (يعيد الترقيم إلى الصفحة الأولى عند تغيّره)
+search = st.sidebar.text_input("🔎 بحث في المحادثات", key="conv_search").strip()
+if st.session_state.get("conv_search_last") != search:
+    st.session_state["conv_search_last"] = search
+    st.session_state["conv_pages"] = [None]   # مفاتيح بداية الصفحات المزارة
+pages = st.session_state.setdefault("conv_pages", [None])
+convs, next_key = fetch_conversations(search, after=pages[-1])
+
+# عرض صفحة المحادثات مع زر الحذف 🗑️
 for c in convs:
     col1, col2 = st.sidebar.columns([4, 1])
     with col1:
         if st.sidebar.button(c["title"], key=f"conv_{c['id']}"):
-            st.session_state["conversation_id"] = c["id"]
-            st.session_state["messages"] = fetch_messages(c["id"])
+            open_conversation(c["id"])
             st.rerun()
     with col2:
         if st.sidebar.button("🗑️", key=f"del_{c['id']}"):
             delete_conversation(c["id"])
 
+# التنقل بين الصفحات
+nav_prev, nav_next = st.sidebar.columns(2)
+if len(pages) > 1 and nav_prev.button("➡️ السابق", key="conv_prev"):
+    pages.pop()
+    st.rerun()
+if next_key and nav_next.button("التالي ⬅️", key="conv_next"):
+    pages.append(next_key)
+    st.rerun()
+st.sidebar.caption(f"الصفحة {len(pages)}")
+
 # تحميل المحادثة الحالية
 if "conversation_id" not in st.session_state:
     if convs:
-        st.session_state["conversation_id"] = convs[0]["id"]
-        st.session_state["messages"] = fetch_messages(convs[0]["id"])
+        open_conversation(convs[0]["id"])
     else:
         cid = create_conversation()
         st.session_state["conversation_id"] = cid
         st.session_state["messages"] = []
+        st.session_state["has_older"] = False
 
 conv_id = st.session_state["conversation_id"]
 messages = st.session_state["messages"]
@@ -160,7 +249,11 @@ messages = st.session_state["messages"]
 st.title("💬 واجهة الدردشة العربية – مشروع نبراس")
 st.write("اكتب سؤالك بالعربية وسيجيبك النظام بناءً على الكتب المحفوظة.")
 
-# عرض الرسائل السابقة
+# عرض الرسائل السابقة (الأقدم تُحمَّل عند الطلب)
+if st.session_state.get("has_older"):
+    if st.button("⬆️ تحميل رسائل أقدم"):
+        load_older_messages()
+        st.rerun()
 for msg in messages:
     role = "👤" if msg["role"] == "user" else "🤖"
     st.chat_message(msg["role"], avatar=role).markdown(msg["content"])
@@ -171,53 +264,71 @@ prompt = st.chat_input("اكتب سؤالك هنا...")
 if prompt:
     # عرض المستخدم فورًا
     st.chat_message("user", avatar="👤").markdown(prompt)
-    save_message(conv_id, "user", prompt)
     st.session_state["messages"].append({"role": "user", "content": prompt})
+    # عنوان المحادثة من السؤال؛ لا يُطبَّق إلا على أول رسائلها (داخل save_messages)
+    title = textwrap.shorten(prompt.strip().replace("\n", " "), width=40, placeholder="…")
+    response = None
+    refs = None
+
+    try:
+        # 🗃️ سؤال مشابه جدًا أُجيب عنه سابقًا؟ (الإجابة تبقى صالحة ما دامت مقاطعها لم تتغير)
+        q_vec = embed_text(prompt)
+        answer_cache = get_answer_cache()
+        cached = answer_cache.lookup(q_vec)
+
+        if cached and ANSWER_CACHE_MODE == "answer":
+            response = cached["answer"] + f"\n\n_🗃️ إجابة محفوظة لسؤال مشابه ({cached['score']*100:.1f}%): {cached['query']}_"
+            st.chat_message("assistant", avatar="🤖").markdown(response)
+        else:
+            # 🔍 جلب المقاطع القريبة
+            ranked = search_chunks(prompt, q_vec)
+
+            if ranked:
+                # 1️⃣ نصوص المقاطع الفعلية لتغذية النموذج
+                context_blocks = []
+                for i, r in enumerate(ranked, 1):
+                    context_blocks.append(
+                        f"🔹 (مرجع {i}) من كتاب {r['book_name']} – الأسطر {r['start_line']}–{r['end_line']}:\n{r['content']}\n"
+                    )
+                context = "\n".join(context_blocks)
+
+                # 2️⃣ تلخيص المراجع لعرضها بعد الإجابة
+                refs_text = []
+                for i, r in enumerate(ranked, 1):
+                    excerpt = " ".join(r["content"].split()[:25]) + "..."
+                    refs_text.append(
+                        f"(مرجع {i}) {r['book_name']} – الأسطر {r['start_line']}–{r['end_line']} – تشابه: {r['score']*100:.1f}%\n"
+                        f'مقتطف: "{excerpt}"\n'
+                    )
+                refs_summary = "\n".join(refs_text)
+            else:
+                context = "❌ لم يتم العثور على مقاطع مرتبطة كفاية."
+                refs_summary = ""
+
+            # 🔹 توليد الإجابة وعرضها رمزًا رمزًا أثناء وصولها
+            from llm_client import stream_answer
+            with st.chat_message("assistant", avatar="🤖"):
+                response = st.write_stream(stream_answer(prompt, context, draft=cached["answer"] if cached else None))
+
+                # 🔎 التحقق من الاقتباسات الفعلية في الإجابة مقابل المقاطع
+                if ranked:
+                    report = verify_answer(response, [r["content"] for r in ranked])
+                    refs = references_payload(ranked, report, lambda t: " ".join(t.split()[:25]) + "...")
+                    checks = format_report(report)
+                    if checks:
+                        st.caption("🔎 تحقق الاقتباسات:  \n" + "  \n".join(checks))
+
+                # 🔹 إلحاق المراجع بالرد
+                if refs_summary:
+                    refs_block = "\n\n---\n\n📖 **المراجع المستعملة:**\n" + refs_summary
+                    st.markdown(refs_block)
+                    response = response.strip() + refs_block
+                    answer_cache.put(prompt, q_vec, response, [r["id"] for r in ranked])
+
+    finally:
+        # سؤال المستخدم والإجابة كاملة (بعد اكتمال التدفق) في معاملة واحدة؛
+        # إذا فشل التوليد يُحفظ السؤال وحده
+        turn = [("user", prompt)] + ([("assistant", response, refs)] if response is not None else [])
+        save_messages(conv_id, turn, title)
 
-    # 🔹 تحديث اسم المحادثة من أول سؤال فقط
-    conn = connect_db()
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM message WHERE conversation_id = %s;", (conv_id,))
-    count = cur.fetchone()[0]
-    cur.close(); conn.close()
-    if count == 1:  # أول رسالة
-        title = textwrap.shorten(prompt.strip().replace("\n", " "), width=40, placeholder="…")
-        update_conversation_title(conv_id, title)
-
-    # 🔍 جلب المقاطع القريبة
-    ranked = search_chunks(prompt)
-
-    if ranked:
-        # 1️⃣ نصوص المقاطع الفعلية لتغذية النموذج
-        context_blocks = []
-        for i, r in enumerate(ranked, 1):
-            context_blocks.append(
-                f"🔹 (مرجع {i}) من كتاب {r['book_name']} – الأسطر {r['start_line']}–{r['end_line']}:\n{r['content']}\n"
-            )
-        context = "\n".join(context_blocks)
-
-        # 2️⃣ تلخيص المراجع لعرضها بعد الإجابة
-        refs_text = []
-        for i, r in enumerate(ranked, 1):
-            excerpt = " ".join(r["content"].split()[:25]) + "..."
-            refs_text.append(
-                f"(مرجع {i}) {r['book_name']} – الأسطر {r['start_line']}–{r['end_line']} – تشابه: {r['score']*100:.1f}%\n"
-                f'مقتطف: "{excerpt}"\n'
-            )
-        refs_summary = "\n".join(refs_text)
-    else:
-        context = "❌ لم يتم العثور على مقاطع مرتبطة كفاية."
-        refs_summary = ""
-
-    # 🔹 توليد الإجابة
-    from llm_client import generate_answer
-    response = generate_answer(prompt, context)
-
-    # 🔹 إلحاق المراجع بالرد
-    if refs_summary:
-        response += "\n\n---\n\n📖 **المراجع المستعملة:**\n" + refs_summary
-
-    # عرض الرد
-    st.chat_message("assistant", avatar="🤖").markdown(response)
-    save_message(conv_id, "assistant", response)
     st.session_state["messages"].append({"role": "assistant", "content": response})
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+citation_verifier.py
+🔹 التحقق من الاقتباسات الفعلية في إجابة النموذج مقابل المقاطع المسترجعة
+- استخراج كل نص بين علامات تنصيص (" " “ ” « ») وكل إشارة (مرجع n) من الإجابة
+- ربط كل اقتباس بإشارات المراجع الواقعة في جملته
+- مطابقة كل الاقتباسات مع كل المقاطع في مرور واحد بآلة Aho-Corasick
+  على النص المطبَّع (normalize_arabic + إزالة الحركات وعلامات الترقيم)،
+  فالزمن خطي في طول المقاطع مهما كثرت الاقتباسات
+- الاقتباس المختصر بـ "..." يُقسَّم إلى أجزاء يجب أن تقع كلها في المقطع نفسه
+- الحكم لكل اقتباس: verified (في مرجعه المذكور)، wrong_ref (في مقطع آخر)،
+  not_found (غير موجود حرفيًا في أي مقطع)
+"""
+
+import re
+from bisect import bisect_right
+from collections import deque
+
+from embedding_cache import normalize_arabic, TASHKEEL
+
+# ===================== الإعدادات =====================
+QUOTE_MIN_WORDS = 3        # أقصر من هذا يُعد إبرازًا لمصطلح لا اقتباسًا
+FRAGMENT_MIN_WORDS = 2     # أجزاء الاقتباس المختصر بـ "..." الأقصر من هذا تُهمل
+
+QUOTE = re.compile(r'"([^"\n]+)"|“([^”\n]+)”|«([^»\n]+)»')
+CITATION = re.compile(r"مرجع\s*(\d+)")
+SENTENCE_END = re.compile(r"[.!؟?\n]")
+ELLIPSIS = re.compile(r"\.{2,}|…")
+NON_WORD = re.compile(r"[^\w]+")
+SEPARATOR = "\x00"         # بين المقاطع في النص الموحّد؛ لا يظهر في أي نمط
+
+
+def normalize_for_match(text):
+    """نص للمطابقة الحرفية: كلمات مطبّعة بينها مسافة واحدة"""
+    text = TASHKEEL.sub("", normalize_arabic(text))
+    return " ".join(NON_WORD.sub(" ", text).split())
+
+
+# ===================== آلة Aho-Corasick =====================
+class AhoCorasick:
+    """آلة مطابقة متعددة الأنماط: search() تعيد كل (موضع النهاية، رقم النمط)"""
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        for pid, pattern in enumerate(patterns):
+            node = 0
+            for ch in pattern:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                node = nxt
+            self.out[node].append(pid)
+
+        # روابط الفشل بالعرض (BFS)، ومخرجات كل عقدة تشمل مخرجات رابط فشلها
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def search(self, text):
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        for pos, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for pid in out[node]:
+                yield pos, pid
+
+
+# ===================== الاستخراج =====================
+def extract_citations(answer):
+    """[(رقم المرجع، الموضع)] لكل إشارة (مرجع n) في الإجابة"""
+    return [(int(m.group(1)), m.start()) for m in CITATION.finditer(answer)]
+
+
+def extract_quotes(answer):
+    """الاقتباسات مع إشارات المراجع في الجملة نفسها
+
+    المرجع المذكور بعد الاقتباس في جملته مقدَّم؛ وإلا فالمذكور قبله.
+    """
+    citations = extract_citations(answer)
+    quotes = []
+    for m in QUOTE.finditer(answer):
+        text = next(g for g in m.groups() if g is not None).strip()
+        fragments = [normalize_for_match(f) for f in ELLIPSIS.split(text)]
+        fragments = [f for f in fragments if len(f.split()) >= FRAGMENT_MIN_WORDS]
+        if sum(len(f.split()) for f in fragments) < QUOTE_MIN_WORDS:
+            continue
+        end = SENTENCE_END.search(answer, m.end())
+        end = end.start() if end else len(answer)
+        start = max((s.end() for s in SENTENCE_END.finditer(answer, 0, m.start())), default=0)
+        after = [n for n, pos in citations if m.end() <= pos < end]
+        before = [n for n, pos in citations if start <= pos < m.start()]
+        quotes.append(dict(quote=text, fragments=fragments, cited=after or before))
+    return quotes
+
+
+# ===================== التحقق =====================
+def verify_answer(answer, chunks):
+    """التحقق من اقتباسات answer وإشاراته مقابل نصوص المقاطع chunks (مرجع n = chunks[n-1])
+
+    تعيد dict:
+      quotes:    [{quote, cited, found_in, status}] — found_in أرقام المراجع الحاوية للاقتباس
+      citations: {n: عدد مرات ذكره} للمراجع الصحيحة
+      invalid:   أرقام مراجع مذكورة لا تقابل أي مقطع
+    """
+    quotes = extract_quotes(answer)
+
+    # كل أجزاء كل الاقتباسات أنماطٌ في آلة واحدة
+    patterns = {}
+    for q in quotes:
+        for fragment in q["fragments"]:
+            patterns.setdefault(f" {fragment} ", len(patterns))
+
+    # المقاطع في نص واحد مفصول بـ SEPARATOR؛ الموضع يُرد إلى مقطعه بـ bisect
+    found = [set() for _ in patterns]
+    if patterns and chunks:
+        starts, parts, offset = [], [], 0
+        for content in chunks:
+            part = f" {normalize_for_match(content)} "
+            starts.append(offset)
+            parts.append(part)
+            offset += len(part) + len(SEPARATOR)
+        automaton = AhoCorasick(list(patterns))
+        for end, pid in automaton.search(SEPARATOR.join(parts)):
+            found[pid].add(bisect_right(starts, end) - 1)
+
+    for q in quotes:
+        fragment_ids = [patterns[f" {f} "] for f in q.pop("fragments")]
+        hits = set.intersection(*(found[pid] for pid in fragment_ids)) if fragment_ids else set()
+        q["found_in"] = sorted(i + 1 for i in hits)
+        if not hits:
+            q["status"] = "not_found"
+        elif not q["cited"] or set(q["cited"]) & set(q["found_in"]):
+            q["status"] = "verified"
+        else:
+            q["status"] = "wrong_ref"
+
+    citations, invalid = {}, []
+    for n, _ in extract_citations(answer):
+        if 1 <= n <= len(chunks):
+            citations[n] = citations.get(n, 0) + 1
+        elif n not in invalid:
+            invalid.append(n)
+    return dict(quotes=quotes, citations=citations, invalid=invalid)
+
+
+def references_payload(ranked, report, excerpt):
+    """محتوى references_json: المراجع مع حكم كل منها، والأحكام لكل اقتباس
+
+    المرجع verified إذا ذُكر في الإجابة ولم يُنسب إليه اقتباس غير موجود فيه.
+    excerpt: دالة المقتطف المختصر المعروض لكل مرجع.
+    """
+    refs = []
+    for i, r in enumerate(ranked, 1):
+        attributed = [q for q in report["quotes"] if i in q["cited"]]
+        refs.append({
+            "ref": i,
+            "book_name": r["book_name"],
+            "similarity": round(r["score"] * 100, 2),
+            "excerpt": excerpt(r["content"]),
+            "cited": report["citations"].get(i, 0),
+            "verified": bool(report["citations"].get(i)) and all(i in q["found_in"] for q in attributed),
+        })
+    return {"references": refs, "quotes": report["quotes"], "invalid_citations": report["invalid"]}
+
+
+STATUS_ICONS = {"verified": "✓", "wrong_ref": "⚠️", "not_found": "✗"}
+
+
+def format_report(report):
+    """أسطر نصية لعرض أحكام الاقتباسات في الطرفية أو الواجهة"""
+    lines = []
+    for q in report["quotes"]:
+        cited = "، ".join(f"مرجع {n}" for n in q["cited"]) or "بلا مرجع"
+        where = f" — موجود في: {'، '.join(f'مرجع {n}' for n in q['found_in'])}" if q["status"] == "wrong_ref" else ""
+        lines.append(f"{STATUS_ICONS[q['status']]} “{q['quote']}” ({cited}){where}")
+    if report["invalid"]:
+        lines.append("✗ إشارات لمراجع غير موجودة: " + "، ".join(f"مرجع {n}" for n in report["invalid"]))
+    return lines
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+db_pool.py
+🔹 مجمّع اتصالات PostgreSQL واحد لكل عملية (بدل اتصال جديد لكل عملية قاعدة بيانات)
+- ThreadedConnectionPool مع انتظار اتصال حر بدل الخطأ عند امتلاء المجمّع
+- pool.connect() يعيد اتصالًا تعيده close() إلى المجمّع بدل إغلاقه، فكل
+  الدوال القائمة بنمط conn = connect_db() ... conn.close() تعمل دون تعديل
+- with pool.connection() as conn: استعارة وإرجاع تلقائي (commit أو rollback)
+- فحص صحة الاتصال الخامل قبل إعادته (Supabase يغلق الاتصالات الخاملة)
+- الاتصال يُعاد إلى حالته الافتراضية قبل رجوعه (معاملة مفتوحة، set_session)
+"""
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import ThreadedConnectionPool
+
+# ===================== الإعدادات =====================
+DB_POOL_MIN = 1
+DB_POOL_MAX = 8
+DB_POOL_HEALTH_IDLE = 30.0    # ثوانٍ؛ الاتصال الخامل أطول من هذا يُفحص بـ SELECT 1 قبل إعادته
+DB_POOL_WAIT = 30.0           # ثوانٍ انتظار اتصال حر قبل الخطأ
+
+
+class PooledConnection:
+    """اتصال مستعار: كل شيء يُمرَّر إلى اتصال psycopg2 عدا close() التي تعيده للمجمّع"""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise psycopg2.InterfaceError("connection already returned to pool")
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        # conn.autocommit = ... وأمثالها تُضبط على الاتصال الحقيقي
+        if name.startswith("_"):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._conn, name, value)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def close(self):
+        if self._conn is not None:
+            self._pool.putconn(self._conn)
+            self._conn = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class DBPool:
+    """مجمّع اتصالات آمن للخيوط مع فحص صحة وإعادة ضبط عند الإرجاع"""
+
+    def __init__(self, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX, **db):
+        self.pid = os.getpid()
+        self.maxconn = maxconn
+        self.pool = ThreadedConnectionPool(minconn, maxconn, **db)
+        self.slots = threading.BoundedSemaphore(maxconn)
+        self.last_used = {}    # id(conn) → وقت آخر إرجاع
+
+    def _healthy(self, conn):
+        if conn.closed:
+            return False
+        if time.time() - self.last_used.get(id(conn), 0) < DB_POOL_HEALTH_IDLE:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1;")
+            cur.fetchone()
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        """اتصال psycopg2 سليم من المجمّع (ينتظر إن كانت كل الاتصالات مستعارة)"""
+        if not self.slots.acquire(timeout=DB_POOL_WAIT):
+            raise psycopg2.pool.PoolError(f"no free connection after {DB_POOL_WAIT:.0f}s")
+        try:
+            for _ in range(self.maxconn + 1):
+                conn = self.pool.getconn()
+                if self._healthy(conn):
+                    return conn
+                self.last_used.pop(id(conn), None)
+                self.pool.putconn(conn, close=True)
+            raise psycopg2.OperationalError("could not get a healthy connection from the pool")
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def putconn(self, conn):
+        """إرجاع الاتصال بعد إنهاء معاملته المفتوحة وإلغاء إعدادات set_session"""
+        try:
+            if conn.closed:
+                self.last_used.pop(id(conn), None)
+                self.pool.putconn(conn, close=True)
+                return
+            try:
+                if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit or conn.readonly or conn.deferrable or conn.isolation_level is not None:
+                    conn.reset()
+            except psycopg2.Error:
+                self.last_used.pop(id(conn), None)
+                self.pool.putconn(conn, close=True)
+                return
+            self.last_used[id(conn)] = time.time()
+            self.pool.putconn(conn)
+        finally:
+            self.slots.release()
+
+    def connect(self):
+        """بديل psycopg2.connect(): اتصال مستعار تعيده close() إلى المجمّع"""
+        return PooledConnection(self, self.getconn())
+
+    @contextmanager
+    def connection(self):
+        """with pool.connection() as conn: — commit عند النجاح، rollback عند الخطأ"""
+        conn = self.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+        self.pool.closeall()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_inherited = []    # مجمّعات الأب في العملية الابنة: تبقى مرجعًا حتى لا تُغلق اتصالاته
+
+
+def get_pool(db, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX):
+    """المجمّع المشترك لإعدادات القاعدة db في هذه العملية
+
+    يُنشأ مجمّع جديد في العملية الابنة بعد fork (اتصالات الأب لا تُشارَك).
+    مجمّع الأب الموروث لا يُحرَّر في الابنة: تحرير اتصالاته يرسل Terminate
+    على المقبس المشترك فيقطع اتصالات الأب نفسه.
+    """
+    key = tuple(sorted(db.items()))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is not None and pool.pid != os.getpid():
+            _inherited.append(pool)
+            pool = None
+        if pool is None:
+            pool = _pools[key] = DBPool(minconn, maxconn, **db)
+        return pool
+
+
+def close_pools():
+    """إغلاق كل مجمّعات هذه العملية (قبل fork مثلًا)؛ get_pool ينشئ مجمّعًا جديدًا بعدها"""
+    with _pools_lock:
+        for pool in _pools.values():
+            if pool.pid == os.getpid():
+                pool.closeall()
+        _pools.clear()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+embed_client.py
+🔹 عميل تضمين على دفعات لواجهة /v1/embeddings المتوافقة مع OpenAI (LM Studio)
+- يرسل قائمة نصوص في طلب واحد (input = [...]) بدل طلب لكل مقطع
+- حجم الدفعة محدود بعدد النصوص وبتقدير عدد الرموز (tokens) في الطلب
+- عند فشل دفعة تُقسم إلى نصفين تكراريًا حتى تنجح أو يبقى نص واحد؛ رفض
+  الدفعة لحجمها لا يمر بتأخيرات إعادة المحاولة في http_client فيُقسم فورًا
+- تُعاد النتائج مرتبة حسب حقل index في الاستجابة، لا حسب ترتيب وصولها
+"""
+
+import threading
+
+from http_client import post_json
+
+# ===================== الإعدادات =====================
+LM_STUDIO_BASE = "http://127.0.0.1:1234/v1"
+EMBED_MODEL = "text-embedding-intfloat-multilingual-e5-large-instruct"
+
+EMBED_BATCH_SIZE = 64        # أقصى عدد نصوص في الطلب الواحد
+EMBED_MAX_TOKENS = 16384     # أقصى عدد رموز تقديري في الطلب الواحد
+TOKENS_PER_WORD = 2.0        # تقدير محافظ للعربية مع مُرمِّز XLM-R
+TIMEOUT = 180
+
+# عدّادات تراكمية لتقرير نهاية الإدخال
+stats = {"requests": 0, "texts": 0, "splits": 0, "failed": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name, n=1):
+    with _stats_lock:
+        stats[name] += n
+
+
+# ===================== التقسيم إلى دفعات =====================
+def estimate_tokens(text):
+    return int(len(text.split()) * TOKENS_PER_WORD) + 2
+
+
+def make_batches(items, batch_size=EMBED_BATCH_SIZE, max_tokens=EMBED_MAX_TOKENS, key=None):
+    """تقسيم النصوص إلى دفعات متتالية تحترم الحدّين (نص كبير وحده دفعة مستقلة)
+
+    items قد تكون نصوصًا أو قواميس مقاطع مع key لاستخراج النص منها.
+    """
+    batch, tokens = [], 0
+    for item in items:
+        t = estimate_tokens(key(item) if key else item)
+        if batch and (len(batch) >= batch_size or tokens + t > max_tokens):
+            yield batch
+            batch, tokens = [], 0
+        batch.append(item)
+        tokens += t
+    if batch:
+        yield batch
+
+
+# ===================== الطلبات =====================
+def _post_embeddings(texts, model, base, timeout):
+    _count("requests")
+    data = post_json(f"{base}/embeddings", {"model": model, "input": texts}, op="embed", timeout=timeout)["data"]
+    if len(data) != len(texts):
+        raise ValueError(f"عدد التضمينات ({len(data)}) لا يطابق عدد النصوص ({len(texts)})")
+    out = [None] * len(texts)
+    for pos, item in enumerate(data):
+        out[item.get("index", pos)] = item["embedding"]
+    return out
+
+
+def embed_batch(texts, model=EMBED_MODEL, base=LM_STUDIO_BASE, timeout=TIMEOUT):
+    """تضمين دفعة واحدة مع تقسيم تكيفي عند الفشل
+
+    تعيد قائمة بنفس طول texts وترتيبها؛ النص الذي يفشل وحده يقابله None.
+    """
+    if not texts:
+        return []
+    try:
+        out = _post_embeddings(texts, model, base, timeout)
+        _count("texts", len(texts))
+        return out
+    except Exception as e:
+        if len(texts) == 1:
+            _count("failed")
+            print(f"⚠️ خطأ أثناء إنشاء التضمين: {e}")
+            return [None]
+        _count("splits")
+        mid = len(texts) // 2
+        return (embed_batch(texts[:mid], model, base, timeout)
+                + embed_batch(texts[mid:], model, base, timeout))
+
+
+def embed_texts(texts, model=EMBED_MODEL, base=LM_STUDIO_BASE,
+                batch_size=EMBED_BATCH_SIZE, max_tokens=EMBED_MAX_TOKENS):
+    """تضمين قائمة نصوص كاملة على دفعات، بنفس ترتيبها"""
+    out = []
+    for batch in make_batches(texts, batch_size, max_tokens):
+        out.extend(embed_batch(batch, model, base))
+    return out
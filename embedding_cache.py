@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+embedding_cache.py
+🔹 ذاكرة تضمينات دائمة معنونة بالمحتوى (SQLite)
+- المفتاح: (اسم نموذج التضمين، بصمة النص المطبّع norm_text_hash)
+- إعادة إدخال كتاب أو طبعة جديدة منه لا تعيد تضمين النصوص المتطابقة
+- حجم محدود: عند تجاوز الحد تُحذف المدخلات الأقدم استعمالًا (LRU)
+- عدّادات إصابة/إخفاق لحساب نسبة الإصابة
+"""
+
+import re
+import time
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+
+# ===================== الإعدادات =====================
+EMBED_CACHE_PATH = "./embedding_cache.sqlite"
+EMBED_CACHE_MAX_ENTRIES = 200_000   # ≈ 800MB لتضمينات 1024 بُعدًا بصيغة float32
+EVICT_TO_RATIO = 0.9                # عند التجاوز يُقلَّص الحجم إلى 90% من الحد
+SQLITE_TIMEOUT = 30                 # ثوانٍ انتظار قفل الكتابة قبل الخطأ
+EVICT_CHECK_ROWS = 1000             # عدّ الجدول (مسح كامل) مرة كل هذا العدد من الصفوف المكتوبة
+
+
+# ===================== بصمة النص =====================
+def normalize_arabic(text):
+    """تطبيع النص العربي"""
+    text = text.replace("أ", "ا").replace("إ", "ا").replace("آ", "ا")
+    text = text.replace("ى", "ي").replace("ة", "ه")
+    return " ".join(text.split())
+
+
+TASHKEEL = re.compile(r"[\u064B-\u0652\u0640]")  # الحركات والتطويل
+
+
+def text_hashes(text):
+    """(text_hash, norm_text_hash): بصمة النص كما هو، وبصمته بعد التطبيع وإزالة الحركات"""
+    norm = " ".join(TASHKEEL.sub("", normalize_arabic(text)).split())
+    return (hashlib.sha256(text.encode("utf-8")).hexdigest(),
+            hashlib.sha256(norm.encode("utf-8")).hexdigest())
+
+
+# ===================== الذاكرة الدائمة =====================
+class EmbeddingCache:
+    """ذاكرة (model, hash) → متجه float32، آمنة للاستعمال من عدة خيوط"""
+
+    def __init__(self, path=EMBED_CACHE_PATH, max_entries=EMBED_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.unchecked = EVICT_CHECK_ROWS   # صفوف كُتبت منذ آخر فحص للحجم (الأول عند أول كتابة)
+        self.lock = threading.Lock()
+        # timeout: عدة عمليات إدخال (--workers) قد تكتب في الملف نفسه
+        self.conn = sqlite3.connect(path, timeout=SQLITE_TIMEOUT, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS embedding (
+                model     TEXT NOT NULL,
+                hash      TEXT NOT NULL,
+                vector    BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, hash)
+            );
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_embedding_last_used ON embedding(last_used);")
+        self.conn.commit()
+
+    def get_many(self, model, hashes):
+        """قاموس hash → متجه للمفاتيح الموجودة فقط (ويحدّث وقت آخر استعمال)"""
+        keys = list(dict.fromkeys(hashes))
+        found = {}
+        with self.lock:
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                marks = ",".join("?" * len(part))
+                rows = self.conn.execute(
+                    f"SELECT hash, vector FROM embedding WHERE model = ? AND hash IN ({marks});",
+                    [model, *part]).fetchall()
+                found.update((h, np.frombuffer(v, dtype=np.float32).tolist()) for h, v in rows)
+            if found:
+                now = time.time()
+                self.conn.executemany("UPDATE embedding SET last_used = ? WHERE model = ? AND hash = ?;",
+                                      [(now, model, h) for h in found])
+                self.conn.commit()
+            self.hits += sum(1 for h in hashes if h in found)
+            self.misses += sum(1 for h in hashes if h not in found)
+        return found
+
+    def put_many(self, model, items):
+        """تخزين [(hash, vector), ...] ثم الإخلاء إن تجاوز الحجم الحد
+
+        الحجم يُفحص كل EVICT_CHECK_ROWS صفًا مكتوبًا لا في كل كتابة، فقد
+        يتجاوز الجدول الحد بهذا القدر مؤقتًا. العدّ من الجدول نفسه لا من
+        عدّاد في الذاكرة لأن عدة عمليات (--workers) تكتب في الملف نفسه.
+        """
+        now = time.time()
+        rows = [(model, h, np.asarray(v, dtype=np.float32).tobytes(), now) for h, v in items if v is not None]
+        if not rows:
+            return
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO embedding VALUES (?, ?, ?, ?);", rows)
+            self.unchecked += len(rows)
+            if self.unchecked < EVICT_CHECK_ROWS:
+                self.conn.commit()
+                return
+            self.unchecked = 0
+            count = self.conn.execute("SELECT COUNT(*) FROM embedding;").fetchone()[0]
+            if count > self.max_entries:
+                excess = count - int(self.max_entries * EVICT_TO_RATIO)
+                self.conn.execute("""
+                    DELETE FROM embedding WHERE rowid IN (
+                        SELECT rowid FROM embedding ORDER BY last_used ASC LIMIT ?
+                    );
+                """, (excess,))
+            self.conn.commit()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def close(self):
+        self.conn.close()
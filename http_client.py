@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+http_client.py
+🔹 عميل HTTP مشترك لكل طلبات LM Studio (والإعدادات الموحّدة لعميل OpenAI)
+- جلسة requests واحدة لكل عملية مع مجمّع اتصالات دائمة (keep-alive)،
+  فلا يُدفع إنشاء اتصال TCP في كل سؤال
+- مهلة لكل نوع عملية (تضمين، إكمال، تدفق) بدل طلبات بلا مهلة
+- إعادة المحاولة عند 429/5xx وأخطاء الاتصال بتأخير أسّي عشوائي (jitter)،
+  مع احترام ترويسة Retry-After؛ أخطاء حجم الطلب (413، تجاوز السياق) لا تُعاد
+- حد أقصى للطلبات المتزامنة لكل خادم (host:port)
+- نسخ asyncio (apost_json) تنفّذ الطلب نفسه في خيط دون حجب حلقة الأحداث
+"""
+
+import time
+import random
+import asyncio
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# ===================== الإعدادات =====================
+# (مهلة الاتصال، مهلة القراءة) بالثواني لكل نوع عملية
+TIMEOUTS = {
+    "embed": (5, 60),
+    "complete": (5, 180),
+    "stream": (5, 180),     # مهلة القراءة هنا بين رمزين متتاليين لا للإجابة كلها
+    "default": (5, 60),
+}
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5          # ثوانٍ؛ التأخير = عشوائي بين 0 و BACKOFF_BASE × 2^محاولة
+BACKOFF_MAX = 8.0
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# أخطاء حجم الطلب لا تزول بالإعادة (embed_batch يقسم الدفعة فورًا بدلها)؛
+# LM Studio يعيدها أحيانًا 500 مع رسالة تجاوز السياق بدل 413
+PAYLOAD_ERROR_STATUS = 413
+PAYLOAD_ERROR_HINTS = ("context", "too large", "too long", "exceeds")
+POOL_MAXSIZE = 16           # اتصالات دائمة لكل خادم
+ENDPOINT_CONCURRENCY = 8    # أقصى طلبات متزامنة لكل host:port (يرفعه set_endpoint_concurrency)
+
+_session = None
+_session_lock = threading.Lock()
+_slots = {}
+
+
+# ===================== الجلسة =====================
+def get_session():
+    """جلسة requests المشتركة في هذه العملية (تُنشأ عند أول استعمال)"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE)
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            _session = s
+        return _session
+
+
+def set_endpoint_concurrency(n):
+    """رفع حد الطلبات المتزامنة لكل خادم إلى n على الأقل (مثل --embed-workers)
+
+    بدون ذلك يحد ENDPOINT_CONCURRENCY عدد العمّال بصمت. الحد لا يُخفَّض،
+    ومجمّع الاتصالات الدائمة يُوسَّع إن لم تُنشأ الجلسة بعد.
+    """
+    global ENDPOINT_CONCURRENCY, POOL_MAXSIZE
+    with _session_lock:
+        if n > ENDPOINT_CONCURRENCY:
+            ENDPOINT_CONCURRENCY = n
+            _slots.clear()    # الطلبات الجارية تُرجع خاناتها إلى السيمافور القديم
+        if _session is None:
+            POOL_MAXSIZE = max(POOL_MAXSIZE, n)
+
+
+def _endpoint_slots(url):
+    host = urlsplit(url).netloc
+    with _session_lock:
+        if host not in _slots:
+            _slots[host] = threading.BoundedSemaphore(ENDPOINT_CONCURRENCY)
+        return _slots[host]
+
+
+def _backoff(attempt, response=None):
+    """مدة الانتظار قبل المحاولة التالية (Retry-After إن وُجدت، وإلا full jitter)"""
+    if response is not None:
+        try:
+            return min(float(response.headers.get("Retry-After", "")), BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def _payload_error(response):
+    """هل رُفض الطلب لحجمه (413 أو رسالة تجاوز السياق)؟"""
+    if response.status_code == PAYLOAD_ERROR_STATUS:
+        return True
+    try:
+        body = response.text.lower()
+    except Exception:
+        return False
+    return any(hint in body for hint in PAYLOAD_ERROR_HINTS)
+
+
+def _send(method, url, op, retries, **kwargs):
+    """إرسال الطلب مع إعادة المحاولة؛ تعيد الاستجابة الناجحة أو ترفع آخر خطأ"""
+    kwargs.setdefault("timeout", TIMEOUTS.get(op, TIMEOUTS["default"]))
+    session = get_session()
+    for attempt in range(retries + 1):
+        try:
+            r = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == retries:
+                raise
+            time.sleep(_backoff(attempt))
+            continue
+        if r.status_code in RETRY_STATUS and attempt < retries and not _payload_error(r):
+            wait = _backoff(attempt, r)
+            r.close()
+            time.sleep(wait)
+            continue
+        r.raise_for_status()
+        return r
+
+
+# ===================== الواجهة المتزامنة =====================
+def request(method, url, op="default", retries=MAX_RETRIES, **kwargs):
+    """طلب عام عبر الجلسة المشتركة ضمن حد التزامن للخادم"""
+    with _endpoint_slots(url):
+        return _send(method, url, op, retries, **kwargs)
+
+
+def post_json(url, payload, op="default", retries=MAX_RETRIES, timeout=None):
+    """POST بجسم JSON وإرجاع JSON الاستجابة"""
+    kwargs = {"json": payload}
+    if timeout is not None:
+        kwargs["timeout"] = timeout
+    r = request("POST", url, op, retries, **kwargs)
+    return r.json()
+
+
+@contextmanager
+def stream_post(url, payload, op="stream", retries=MAX_RETRIES):
+    """POST متدفق: إعادة المحاولة قبل بدء الاستجابة فقط، والخانة محجوزة حتى نهاية القراءة"""
+    with _endpoint_slots(url):
+        r = _send("POST", url, op, retries, json=payload, stream=True)
+        try:
+            yield r
+        finally:
+            r.close()
+
+
+# ===================== واجهة asyncio =====================
+async def arequest(method, url, op="default", retries=MAX_RETRIES, **kwargs):
+    return await asyncio.to_thread(request, method, url, op, retries, **kwargs)
+
+
+async def apost_json(url, payload, op="default", retries=MAX_RETRIES, timeout=None):
+    return await asyncio.to_thread(post_json, url, payload, op, retries, timeout)
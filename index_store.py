@@ -0,0 +1,539 @@
+# -*- coding: utf-8 -*-
+"""
+index_store.py
+🔹 فهرس تضمينات دائم على القرص يُبنى من جدول chunk
+- embeddings.npy : مصفوفة float32 مطبّعة (N × dim) تُفتح عبر memory-map
+- delta_*.npy    : مقاطع صفوف أضيفت بالمزامنة التزايدية بعد البناء
+- meta.json      : بيانات وصفية جانبية (id, book_id, book_name, الأسطر)
+                   + علامة الحد الأعلى max_id + المحذوفات (tombstones)
+- فتح الفهرس لا يقرأ المصفوفة إلى الذاكرة، فعمليات Streamlit المتعددة
+  تتشارك نفس الصفحات عبر ذاكرة التخزين المؤقت لنظام التشغيل
+
+الاستخدام:
+  python index_store.py [build] [./index]   # بناء كامل (التضمينات + BM25 في lexical.npz)
+  python index_store.py sync [./index]      # جلب الصفوف الجديدة والمحذوفات فقط
+  python index_store.py compact [./index]   # إزالة المحذوفات ودمج المقاطع
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import psycopg2
+import numpy as np
+from dotenv import load_dotenv
+
+from vector_index import DTYPE, PACKED_DTYPE, VectorIndex, normalize_rows
+
+# ===================== الإعدادات =====================
+load_dotenv()
+
+DB = dict(
+    host=os.getenv("host"),
+    port=os.getenv("port"),
+    user=os.getenv("user"),
+    password=os.getenv("password"),
+    dbname=os.getenv("dbname"),
+)
+
+INDEX_DIR = "./index"
+EMBEDDINGS_FILE = "embeddings.npy"
+META_FILE = "meta.json"
+FETCH_BATCH = 2000
+
+# الضغط التلقائي بعد المزامنة
+COMPACT_TOMBSTONE_RATIO = 0.10   # نسبة الصفوف المحذوفة
+COMPACT_MAX_SEGMENTS = 8         # عدد مقاطع delta
+SHARED_INDEX_CHECK_SECONDS = 5.0  # أقل فاصل بين فحصين لإصدار جدول chunk في SharedIndex
+
+
+# ===================== البيانات الوصفية =====================
+class ChunkMeta:
+    """بيانات وصفية عمودية؛ يُبنى قاموس الصف فقط عند طلبه (لأفضل k نتيجة)"""
+
+    def __init__(self, ids, book_ids, start_lines, end_lines, books):
+        self.ids = ids
+        self.book_ids = book_ids
+        self.start_lines = start_lines
+        self.end_lines = end_lines
+        self.books = books
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        book_id = self.book_ids[i]
+        return {
+            "id": self.ids[i],
+            "book_id": book_id,
+            "book_name": self.books.get(str(book_id)),
+            "start_line": self.start_lines[i],
+            "end_line": self.end_lines[i],
+        }
+
+    def append(self, row):
+        self.ids.append(row["id"])
+        self.book_ids.append(row["book_id"])
+        self.start_lines.append(row["start_line"])
+        self.end_lines.append(row["end_line"])
+        self.books.setdefault(str(row["book_id"]), row["book_name"])
+
+
+def _meta_ids(meta):
+    """معرّفات المقاطع بترتيب الصفوف لأي نوع من البيانات الوصفية"""
+    if isinstance(meta, ChunkMeta):
+        return meta.ids
+    return [m.get("id") for m in meta]
+
+
+def _read_meta(path):
+    with open(os.path.join(path, META_FILE), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_meta(path, meta):
+    """كتابة meta.json ذريًا (ملف مؤقت ثم استبدال)"""
+    tmp = os.path.join(path, META_FILE + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp, os.path.join(path, META_FILE))
+
+
+def _save_npy(path, name, matrix):
+    tmp = os.path.join(path, name + ".tmp")
+    with open(tmp, "wb") as f:
+        np.save(f, matrix)
+    os.replace(tmp, os.path.join(path, name))
+
+
+# ===================== القراءة من القاعدة =====================
+PACKED_COLUMNS = "embedding_f32, CASE WHEN embedding_f32 IS NULL THEN embedding_vector END"
+LEGACY_COLUMNS = "NULL::bytea, embedding_vector"
+
+
+def has_packed_embeddings(cur):
+    """هل أُضيف عمود chunk.embedding_f32 (setup_embedding_bytea.py أو ingest_books.py)؟"""
+    cur.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'chunk' AND column_name = 'embedding_f32';
+    """)
+    return cur.fetchone() is not None
+
+
+def embedding_columns(conn):
+    """عمودا (التضمين الثنائي، المصفوفة) للاستعلام
+
+    المصفوفة DOUBLE PRECISION[] لا تُنقل إلا للصفوف التي لم يُملأ لها
+    embedding_f32 بعد، فالقارئ يفكّ الثنائي بـ np.frombuffer ويعود إلى
+    المصفوفة عند غيابه.
+    """
+    cur = conn.cursor()
+    packed = has_packed_embeddings(cur)
+    cur.close()
+    return PACKED_COLUMNS if packed else LEGACY_COLUMNS
+
+
+def _index_dim(cur):
+    """البُعد الغالب للتضمينات المخزّنة"""
+    if has_packed_embeddings(cur):
+        dim_sql = "COALESCE(octet_length(embedding_f32) / 4, array_length(embedding_vector, 1))"
+    else:
+        dim_sql = "array_length(embedding_vector, 1)"
+    cur.execute(f"""
+        SELECT {dim_sql} AS d, COUNT(*)
+        FROM chunk
+        WHERE {dim_sql} IS NOT NULL
+        GROUP BY d
+        ORDER BY 2 DESC
+        LIMIT 1;
+    """)
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def _iter_chunk_blocks(conn, dim, after_id=0):
+    """كتل (مصفوفة مطبّعة، بيانات وصفية) للمقاطع ذات id > after_id
+
+    مؤشر على الخادم: لا يُحمَّل الجدول كاملًا في ذاكرة العميل. التضمين
+    الثنائي (embedding_f32) يُنسخ مباشرة إلى صف المصفوفة دون قوائم Python.
+    """
+    columns = embedding_columns(conn)
+    cur = conn.cursor(name="index_export")
+    cur.itersize = FETCH_BATCH
+    cur.execute(f"""
+        SELECT id, book_id, book_name, start_line, end_line, {columns}
+        FROM chunk
+        WHERE id > %s
+        ORDER BY id ASC;
+    """, (after_id,))
+    while True:
+        rows = cur.fetchmany(FETCH_BATCH)
+        if not rows:
+            break
+        block = np.zeros((len(rows), dim), dtype=DTYPE)
+        metas = []
+        for j, (cid, bid, bname, s, e, packed, emb) in enumerate(rows):
+            if packed is not None and len(packed) == dim * PACKED_DTYPE.itemsize:
+                block[j] = np.frombuffer(packed, dtype=PACKED_DTYPE)
+            elif emb is not None and len(emb) == dim:
+                block[j] = emb
+            metas.append(dict(id=cid, book_id=bid, book_name=bname, start_line=s, end_line=e))
+        yield normalize_rows(block), metas
+    cur.close()
+
+
+def _deleted_ids(conn, live_ids, max_id):
+    """معرّفات المقاطع الموجودة في الفهرس وحُذفت من القاعدة (ON DELETE CASCADE)
+
+    فحص العدد أولًا رخيص؛ لا تُجلب قائمة المعرّفات إلا إذا اختلف العدد.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM chunk WHERE id <= %s;", (max_id,))
+    if cur.fetchone()[0] == len(live_ids):
+        cur.close()
+        return set()
+    cur.execute("SELECT id FROM chunk WHERE id <= %s;", (max_id,))
+    existing = {r[0] for r in cur.fetchall()}
+    cur.close()
+    return set(live_ids) - existing
+
+
+# ===================== البناء =====================
+def build_index_file(conn, path=INDEX_DIR):
+    """تصدير تضمينات جدول chunk إلى ملف فهرس على القرص
+
+    يُقرأ الجدول داخل معاملة REPEATABLE READ حتى يتطابق العدد مع الصفوف،
+    وتُكتب الملفات بأسماء مؤقتة ثم تُستبدل ذريًا، فالعمليات التي فتحت
+    النسخة القديمة تستمر بها دون أن تتأثر.
+    """
+    os.makedirs(path, exist_ok=True)
+    old_segments = _read_meta(path).get("segments", []) if os.path.exists(os.path.join(path, META_FILE)) else []
+    conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM chunk;")
+    count, max_id = cur.fetchone()
+    dim = _index_dim(cur)
+    cur.execute("SELECT id, name FROM book;")
+    books = {str(b): n for b, n in cur.fetchall()}
+    cur.close()
+
+    emb_tmp = os.path.join(path, EMBEDDINGS_FILE + ".tmp")
+    matrix = np.lib.format.open_memmap(emb_tmp, mode="w+", dtype=DTYPE, shape=(count, dim))
+    chunk_meta = ChunkMeta([], [], [], [], books)
+    row = 0
+    for block, metas in _iter_chunk_blocks(conn, dim):
+        matrix[row:row + len(block)] = block
+        row += len(block)
+        for m in metas:
+            chunk_meta.append(m)
+    conn.commit()
+    conn.set_session(isolation_level="DEFAULT", readonly="DEFAULT")
+
+    matrix.flush()
+    del matrix
+    os.replace(emb_tmp, os.path.join(path, EMBEDDINGS_FILE))
+    _write_meta(path, {
+        "dim": dim,
+        "count": count,
+        "max_id": max_id,
+        "built_at": time.time(),
+        "ids": chunk_meta.ids,
+        "book_ids": chunk_meta.book_ids,
+        "start_lines": chunk_meta.start_lines,
+        "end_lines": chunk_meta.end_lines,
+        "books": chunk_meta.books,
+        "segments": [],
+        "tombstones": [],
+    })
+    for name in old_segments:
+        os.remove(os.path.join(path, name))
+    _refresh_quantized(path)
+    return count, dim
+
+
+# ===================== المزامنة التزايدية =====================
+def sync_index(conn, index):
+    """مزامنة فهرس محمّل في الذاكرة مع جدول chunk دون إعادة تحميله
+
+    تُضاف الصفوف ذات id > max_id كمقطع جديد، وتُعلَّم الصفوف المحذوفة
+    كـ tombstones. تعيد (عدد المضاف، عدد المحذوف).
+    """
+    max_id = index.info.get("max_id", 0)
+    added = 0
+    for block, metas in _iter_chunk_blocks(conn, index.dim, max_id):
+        index.append(block, metas)
+        added += len(block)
+        max_id = metas[-1]["id"]
+    conn.commit()
+
+    ids = _meta_ids(index.meta)
+    dead = set(index.deleted.tolist())
+    live_ids = [cid for pos, cid in enumerate(ids) if pos not in dead]
+    removed = _deleted_ids(conn, live_ids, max_id)
+    if removed:
+        index.delete([pos for pos, cid in enumerate(ids) if cid in removed])
+
+    index.info.update(max_id=max_id, count=index.live_count)
+    return added, len(removed)
+
+
+def sync_index_file(conn, path=INDEX_DIR):
+    """مزامنة الفهرس على القرص: مقطع delta جديد + تحديث tombstones في meta.json"""
+    meta = _read_meta(path)
+    tombstones = set(meta["tombstones"])
+    live_ids = [cid for cid in meta["ids"] if cid not in tombstones]
+    removed = _deleted_ids(conn, live_ids, meta["max_id"])
+
+    chunk_meta = ChunkMeta(meta["ids"], meta["book_ids"], meta["start_lines"],
+                           meta["end_lines"], meta["books"])
+    blocks = []
+    for block, metas in _iter_chunk_blocks(conn, meta["dim"], meta["max_id"]):
+        blocks.append(block)
+        for m in metas:
+            chunk_meta.append(m)
+    conn.commit()
+
+    added = sum(len(b) for b in blocks)
+    if added:
+        new_max = chunk_meta.ids[-1]
+        name = f"delta_{new_max}.npy"
+        _save_npy(path, name, np.concatenate(blocks))
+        meta["segments"].append(name)
+        meta["max_id"] = new_max
+    meta["tombstones"] = sorted(tombstones | removed)
+    meta["count"] = len(meta["ids"]) - len(meta["tombstones"])
+    meta["built_at"] = time.time()
+    _write_meta(path, meta)
+
+    if (len(meta["segments"]) > COMPACT_MAX_SEGMENTS
+            or len(meta["tombstones"]) > COMPACT_TOMBSTONE_RATIO * max(len(meta["ids"]), 1)):
+        compact_index_file(path)
+
+    # الفهرس المعجمي (إن بُني) يتبع فهرس التضمينات بنفس المزامنة التزايدية
+    from lexical_index import LEXICAL_FILE, sync_lexical_file
+    if os.path.exists(os.path.join(path, LEXICAL_FILE)):
+        sync_lexical_file(conn, path)
+    return added, len(removed)
+
+
+def compact_index_file(path=INDEX_DIR):
+    """إعادة كتابة المصفوفة الأساسية من الصفوف الحية فقط (دون الرجوع للقاعدة)"""
+    index = load_index(path)
+    meta = _read_meta(path)
+    live = np.setdiff1d(np.arange(len(index)), index.deleted)
+
+    emb_tmp = os.path.join(path, EMBEDDINGS_FILE + ".tmp")
+    matrix = np.lib.format.open_memmap(emb_tmp, mode="w+", dtype=DTYPE, shape=(live.size, index.dim))
+    offset = 0
+    for part in [index.matrix] + index.segments:
+        keep = live[(live >= offset) & (live < offset + len(part))] - offset
+        start = np.searchsorted(live, offset)
+        matrix[start:start + keep.size] = part[keep]
+        offset += len(part)
+    matrix.flush()
+    del matrix, index
+
+    for key in ("ids", "book_ids", "start_lines", "end_lines"):
+        meta[key] = [meta[key][i] for i in live]
+    old_segments = meta["segments"]
+    meta.update(segments=[], tombstones=[], count=int(live.size), built_at=time.time())
+    os.replace(emb_tmp, os.path.join(path, EMBEDDINGS_FILE))
+    _write_meta(path, meta)
+    for name in old_segments:
+        os.remove(os.path.join(path, name))
+    _refresh_quantized(path)
+    return int(live.size)
+
+
+def _refresh_quantized(path):
+    """النسخ المضغوطة (quant_index.py) تتبع المصفوفة الأساسية بعد إعادة كتابتها"""
+    from quant_index import refresh_quantized_files
+    refresh_quantized_files(path)
+
+
+# ===================== التحميل =====================
+def load_index(path=INDEX_DIR):
+    """فتح الفهرس عبر memory-map، أو None إذا لم يُبنَ بعد"""
+    emb_path = os.path.join(path, EMBEDDINGS_FILE)
+    meta_path = os.path.join(path, META_FILE)
+    if not (os.path.exists(emb_path) and os.path.exists(meta_path)):
+        return None
+
+    meta = _read_meta(path)
+    matrix = np.load(emb_path, mmap_mode="r")
+    chunk_meta = ChunkMeta(meta["ids"], meta["book_ids"], meta["start_lines"],
+                           meta["end_lines"], meta["books"])
+    info = {k: meta[k] for k in ("dim", "count", "max_id", "built_at")}
+    index = VectorIndex(matrix, chunk_meta, info)
+    for name in meta.get("segments", []):
+        index.segments.append(np.load(os.path.join(path, name), mmap_mode="r"))
+    if meta.get("tombstones"):
+        dead = set(meta["tombstones"])
+        index.delete([pos for pos, cid in enumerate(meta["ids"]) if cid in dead])
+    return index
+
+
+def open_index(fetch_chunks, path=INDEX_DIR, connect=None, backend="exact"):
+    """الفهرس على القرص إن وُجد، وإلا بناء فهرس في الذاكرة من fetch_chunks()
+
+    إذا مُرّرت connect يُزامَن الفهرس المحمّل مع جدول chunk، فتظهر الكتب
+    المُدخلة حديثًا دون إعادة بناء الملف. backend="ivf" يستعمل البحث
+    التقريبي من ann_index.py إذا كان ivf.npz مبنيًا، و"float16"/"int8"
+    النسخة المضغوطة من quant_index.py مع ترتيب دقيق لأفضل المرشحين،
+    وbackend="pgvector" يرتّب داخل SQL (pg_search.py)؛ وعند تعذّرها
+    يُستعمل البحث الدقيق.
+    """
+    if backend == "pgvector" and connect is not None:
+        from pg_search import open_pgvector
+        pg = open_pgvector(connect)
+        if pg is not None:
+            return pg
+
+    index = load_index(path)
+    if index is None:
+        # فهرس في الذاكرة بعلامة max_id؛ المزامنة تلتقط ما أُدخل أثناء الجلب
+        index = VectorIndex.from_chunks(fetch_chunks())
+        if connect is not None and index.dim:
+            conn = connect()
+            sync_index(conn, index)
+            conn.close()
+        return index
+    if connect is not None:
+        conn = connect()
+        sync_index(conn, index)
+        conn.close()
+    return select_backend(index, path, backend)
+
+
+def select_backend(index, path=INDEX_DIR, backend="exact"):
+    """تغليف الفهرس بالخلفية المطلوبة ("exact" أو "ivf" أو "float16"/"int8")"""
+    if backend == "ivf":
+        from ann_index import load_ivf
+        ivf = load_ivf(index, path)
+        if ivf is not None:
+            return ivf
+    if backend in ("float16", "int8"):
+        from quant_index import load_quantized
+        quant = load_quantized(index, path, backend)
+        if quant is not None:
+            return quant
+    return index
+
+
+def chunk_table_version(conn):
+    """(عدد الصفوف، أكبر id) لجدول chunk — يتغير مع كل إدخال أو حذف"""
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM chunk;")
+    version = tuple(cur.fetchone())
+    cur.close()
+    conn.rollback()
+    return version
+
+
+class SharedIndex:
+    """فهرس واحد لكل عملية تتشاركه كل الجلسات للقراءة فقط
+
+    get() تعيد الفهرس الحالي؛ كل SHARED_INDEX_CHECK_SECONDS على الأكثر
+    يُقرأ إصدار جدول chunk، وإذا تغيّر يُبنى فهرس جديد (فتح الملف
+    والمزامنة التزايدية، أو fetch_chunks() عند غياب الملف) ثم يُستبدل
+    المرجع دفعة واحدة، فالبحث الجاري على النسخة القديمة لا يتأثر.
+    الفهرس المبني من fetch_chunks() لا يُعاد جلبه: تُزامَن نسخة منه.
+    """
+
+    def __init__(self, fetch_chunks, connect, path=INDEX_DIR, backend="exact"):
+        self.fetch_chunks = fetch_chunks
+        self.connect = connect
+        self.path = path
+        self.backend = backend
+        self.index = None
+        self.version = None
+        self.checked_at = 0.0
+        self.info = {}
+        self.lock = threading.Lock()
+
+    def _load(self, version):
+        t0 = time.time()
+        on_disk = os.path.exists(os.path.join(self.path, META_FILE))
+        if not on_disk and self.info.get("source") == "db" and type(self.index) is VectorIndex and self.index.dim:
+            index = self.index.copy()
+            conn = self.connect()
+            try:
+                sync_index(conn, index)
+            finally:
+                conn.close()
+        else:
+            index = open_index(self.fetch_chunks, self.path, self.connect, self.backend)
+        self.index, self.version = index, version
+        self.info = {
+            "backend": getattr(index, "info", {}).get("backend", self.backend),
+            "source": "disk" if on_disk else "db",
+            "count": version[0],
+            "max_id": version[1],
+            "load_seconds": time.time() - t0,
+            "loaded_at": time.time(),
+        }
+
+    def get(self):
+        if self.index is not None and time.time() - self.checked_at < SHARED_INDEX_CHECK_SECONDS:
+            return self.index
+        # جلسة واحدة تفحص/تعيد التحميل؛ البقية تستعمل النسخة الحالية دون انتظار
+        if not self.lock.acquire(blocking=self.index is None):
+            return self.index
+        try:
+            if self.index is not None and time.time() - self.checked_at < SHARED_INDEX_CHECK_SECONDS:
+                return self.index
+            conn = self.connect()
+            try:
+                version = chunk_table_version(conn)
+            finally:
+                conn.close()
+            if version != self.version:
+                self._load(version)
+            self.checked_at = time.time()
+            return self.index
+        finally:
+            self.lock.release()
+
+
+def attach_contents(connect, results):
+    """جلب نصوص أفضل k مقطع فقط (الفهرس على القرص لا يحمل المحتوى)"""
+    missing = [r["id"] for r in results if "content" not in r]
+    if not missing:
+        return results
+    conn = connect()
+    cur = conn.cursor()
+    cur.execute("SELECT id, content FROM chunk WHERE id = ANY(%s);", (missing,))
+    texts = dict(cur.fetchall())
+    cur.close(); conn.close()
+    for r in results:
+        r.setdefault("content", texts.get(r["id"], ""))
+    return results
+
+
+# ===================== تنفيذ مباشر =====================
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    cmd = args.pop(0) if args and args[0] in ("build", "sync", "compact") else "build"
+    out = args[0] if args else INDEX_DIR
+    t0 = time.time()
+
+    if cmd == "compact":
+        n = compact_index_file(out)
+        print(f"✅ تم ضغط الفهرس: {n} مقطعًا حيًا خلال {time.time() - t0:.1f} ث.")
+        sys.exit(0)
+
+    conn = psycopg2.connect(**DB)
+    if cmd == "sync" and os.path.exists(os.path.join(out, META_FILE)):
+        print(f"🔄 مزامنة فهرس التضمينات في {out} …")
+        added, removed = sync_index_file(conn, out)
+        print(f"✅ أضيف {added} مقطعًا وحُذف {removed} خلال {time.time() - t0:.1f} ث.")
+    else:
+        print(f"🔗 بناء فهرس التضمينات في {out} …")
+        n, d = build_index_file(conn, out)
+        print(f"✅ تم تصدير {n} مقطعًا (dim={d}) خلال {time.time() - t0:.1f} ث.")
+        from lexical_index import build_lexical_file
+        n, v = build_lexical_file(conn, out)
+        print(f"✅ الفهرس المعجمي BM25: {n} مقطعًا و{v} كلمة خلال {time.time() - t0:.1f} ث.")
+    conn.close()
@@ -7,11 +7,25 @@ ingest_books_supabase.py
 import os
 import json
 import math
+import time
+import hashlib
+import argparse
+import tempfile
+import multiprocessing as mp
+from itertools import islice
 import psycopg2
-import requests
+from psycopg2.extras import execute_values
 from tqdm import tqdm
 from dotenv import load_dotenv
 
+from index_store import INDEX_DIR, META_FILE, sync_index_file
+from embed_client import make_batches, embed_batch, stats as embed_stats
+from http_client import set_endpoint_concurrency
+from ingest_pipeline import run_pipeline, EMBED_WORKERS
+from db_pool import get_pool, close_pools
+from embedding_cache import EmbeddingCache, normalize_arabic, text_hashes
+from vector_index import pack_embedding
+
 # ===================== إعدادات النظام =====================
 load_dotenv()
 
@@ -30,117 +44,508 @@ LM_STUDIO_BASE = "http://127.0.0.1:1234/v1"  # إذا لم تستخدم LM Studi
 CHUNK_SIZE = 400
 OVERLAP = 40  # تداخل 10%
 BOOKS_DIR = "./books"  # تأكد من وجود كتب .txt داخله
+EMBED_BATCH_SIZE = 64      # عدد المقاطع في طلب التضمين الواحد
+EMBED_MAX_TOKENS = 16384   # حد تقديري لعدد الرموز في الطلب الواحد
+CHUNK_FLUSH_SIZE = 500     # عدد المقاطع في كل إدخال جماعي (execute_values)
+READ_BLOCK = 1 << 16       # أقصى عدد أحرف يُقرأ في المرة (حتى مع الأسطر الطويلة جدًا)
+BOOK_CONTENT_MAX_MB = 900  # حد book.content (حقل TEXT في PostgreSQL لا يتجاوز 1 GB)؛ الأكبر يبقى NULL
+CONTENT_SPOOL_MEMORY = 8 << 20   # ما يتجاوز هذا من book.content يُحفظ مؤقتًا على القرص لا في الذاكرة
+CONTENT_SPOOL_WORDS = 4096       # عدد الكلمات في كل كتابة إلى الملف المؤقت
 
 # ===================== أدوات مساعدة =====================
 def connect_db():
-    """اتصال بقاعدة Supabase"""
-    return psycopg2.connect(**DB)
-
-
-def normalize_arabic(text):
-    """تطبيع النص العربي"""
-    text = text.replace("أ", "ا").replace("إ", "ا").replace("آ", "ا")
-    text = text.replace("ى", "ي").replace("ة", "ه")
-    return " ".join(text.split())
+    """اتصال بقاعدة Supabase (مستعار من مجمّع العملية؛ close() تعيده إليه)"""
+    return get_pool(DB).connect()
+
+
+_embed_cache = None
+_embed_slots = None   # سيمافور مشترك بين العمليات في وضع --workers (ميزانية تضمين واحدة)
+
+
+def get_embed_cache():
+    """ذاكرة التضمينات المحلية (تُفتح مرة واحدة لكل عملية)"""
+    global _embed_cache
+    if _embed_cache is None:
+        _embed_cache = EmbeddingCache()
+    return _embed_cache
+
+
+def embed_cached(texts):
+    """تضمين مجموعة مقاطع: من الذاكرة المحلية أولًا ثم LM Studio للبقية فقط
+
+    المفتاح (EMBED_MODEL, norm_text_hash)؛ النص الفاشل يقابله None.
+    """
+    cache = get_embed_cache()
+    hashes = [text_hashes(t)[1] for t in texts]
+    found = cache.get_many(EMBED_MODEL, hashes)
+    todo = {}
+    for t, h in zip(texts, hashes):
+        if h not in found:
+            todo.setdefault(h, t)
+    if todo:
+        if _embed_slots is not None:
+            with _embed_slots:
+                new = embed_batch(list(todo.values()), EMBED_MODEL, LM_STUDIO_BASE)
+        else:
+            new = embed_batch(list(todo.values()), EMBED_MODEL, LM_STUDIO_BASE)
+        items = list(zip(todo.keys(), new))
+        cache.put_many(EMBED_MODEL, items)
+        found.update((h, emb) for h, emb in items if emb is not None)
+    return [found.get(h) for h in hashes]
+
+
+def iter_words(f, stats=None):
+    """(كلمة مطبّعة، رقم السطر، إزاحتها) من ملف مفتوح، بقراءة متدرجة
+
+    يُقرأ على الأكثر READ_BLOCK حرفًا في المرة؛ الكلمة المقطوعة عند حد
+    القراءة تُرحَّل إلى القراءة التالية. الإزاحة محسوبة داخل النص المطبّع
+    كاملًا (الكلمات بمسافة واحدة بينها)، أي داخل book.content.
+    """
+    line_no, carry, ends_line, pos = 1, "", True, 0
+    while True:
+        piece = f.readline(READ_BLOCK)
+        if not piece:
+            break
+        text = carry + piece
+        ends_line = text.endswith("\n")
+        carry = ""
+        if not ends_line:
+            cut = max(text.rfind(" "), text.rfind("\t"))
+            if cut > 0:
+                text, carry = text[:cut], text[cut:]
+        for w in normalize_arabic(text).split():
+            yield w, line_no, pos
+            pos += len(w) + 1
+        if ends_line:
+            line_no += 1
+    for w in normalize_arabic(carry).split():
+        yield w, line_no, pos
+        pos += len(w) + 1
+    if stats is not None:
+        stats["lines"] = line_no - 1 if ends_line else line_no
+
+
+def chunk_words(words, stats=None):
+    """تجزئة تدفق (كلمة، سطر، إزاحة) إلى مقاطع متداخلة بذاكرة محدودة بحجم المقطع
+
+    مقطع يبدأ كل CHUNK_SIZE - OVERLAP كلمة، ورقم السطر لكل مقطع هو السطر
+    الفعلي لأول وآخر كلمة فيه، وchar_range = [بداية، نهاية) داخل book.content.
+    """
+    step = CHUNK_SIZE - OVERLAP
+    buf, buf_lines, buf_pos = [], [], []
+    total = 0
+
+    def make(lo, hi):
+        return {
+            "content": " ".join(buf[lo:hi]),
+            "start_line": buf_lines[lo],
+            "end_line": buf_lines[hi - 1],
+            "char_range": [buf_pos[lo], buf_pos[hi - 1] + len(buf[hi - 1])],
+        }
+
+    for w, line_no, pos in words:
+        buf.append(w)
+        buf_lines.append(line_no)
+        buf_pos.append(pos)
+        total += 1
+        if len(buf) == CHUNK_SIZE:
+            yield make(0, CHUNK_SIZE)
+            del buf[:step], buf_lines[:step], buf_pos[:step]
+
+    # الذيل: بقية المقاطع التي تبدأ قبل نهاية النص
+    for lo in range(0, len(buf), step):
+        yield make(lo, min(lo + CHUNK_SIZE, len(buf)))
+
+    if stats is not None:
+        stats["words"] = total
+
+
+def iter_chunks(file_path, stats=None, spool=None):
+    """مقاطع كتاب من ملفه مباشرة دون تحميله كاملًا في الذاكرة
+
+    spool (ContentSpool) يجمع book.content من نفس الكلمات أثناء القراءة.
+    """
+    with open(file_path, "r", encoding="utf-8") as f:
+        words = iter_words(f, stats)
+        if spool is not None:
+            words = spool.tee(words)
+        yield from chunk_words(words, stats)
+
+
+class ContentSpool:
+    """book.content يُبنى من الكلمات المقروءة تدفقًا بدل f.read() للملف كاملًا
+
+    النص هو الكلمات المطبّعة بمسافة واحدة بينها (نفس النص الذي تشير إليه
+    إزاحات char_range). يُكتب بصيغة COPY النصية إلى ملف مؤقت يبقى في
+    الذاكرة حتى CONTENT_SPOOL_MEMORY ثم ينتقل إلى القرص، ويُرسل إلى
+    القاعدة بـ COPY دون تحميله في ذاكرة العملية. إذا تجاوز BOOK_CONTENT_MAX_MB
+    يُهمل ويبقى book.content = NULL، ويمكن إعادة بناء النص المطبّع من الملف
+    بنفس iter_words عند الحاجة إلى char_range.
+    """
+
+    def __init__(self, max_bytes=BOOK_CONTENT_MAX_MB * 1024 * 1024):
+        self.file = tempfile.SpooledTemporaryFile(max_size=CONTENT_SPOOL_MEMORY, mode="w+", encoding="utf-8")
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.pending = []
+        self.overflow = False
+
+    def tee(self, words):
+        for item in words:
+            self.pending.append(item[0])
+            if len(self.pending) >= CONTENT_SPOOL_WORDS:
+                self._flush()
+            yield item
+        self._flush()
+
+    def _flush(self):
+        if not self.pending or self.overflow:
+            self.pending = []
+            return
+        # صيغة COPY النصية: الشرطة المائلة تُضاعف (لا أسطر ولا مسافات جدولة بعد التطبيع)
+        text = (" " if self.size else "") + " ".join(self.pending).replace("\\", "\\\\")
+        self.pending = []
+        self.size += len(text.encode("utf-8"))
+        if self.size > self.max_bytes:
+            self.overflow = True
+            self.file.close()
+            return
+        self.file.write(text)
+
+    def store(self, cur, book_id):
+        """كتابة النص المجمّع في book.content (داخل معاملة cur) عبر جدول مؤقت وCOPY"""
+        if self.overflow:
+            return False
+        self.file.write("\n")
+        self.file.seek(0)
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS book_content_upload (content TEXT) ON COMMIT DELETE ROWS;")
+        cur.copy_expert("COPY book_content_upload (content) FROM STDIN", self.file)
+        cur.execute("UPDATE book SET content = (SELECT content FROM book_content_upload) WHERE id = %s;",
+                    (book_id,))
+        return True
+
+    def close(self):
+        self.file.close()
+
+
+INGEST_SCHEMA_SQL = """
+ALTER TABLE book ADD COLUMN IF NOT EXISTS file_hash TEXT;
+ALTER TABLE book ADD COLUMN IF NOT EXISTS last_chunk_index INT DEFAULT -1;
+ALTER TABLE chunk ADD COLUMN IF NOT EXISTS embedding_f32 BYTEA;
+CREATE INDEX IF NOT EXISTS idx_book_name ON book(name);
+"""
 
 
-def embed_text(text):
-    """توليد تضمين — حاليًا عبر LM Studio (يمكن استبداله لاحقًا بـ OpenAI)"""
-    try:
-        r = requests.post(f"{LM_STUDIO_BASE}/embeddings",
-                          json={"model": EMBED_MODEL, "input": text})
-        r.raise_for_status()
-        return r.json()["data"][0]["embedding"]
-    except Exception as e:
-        print(f"⚠️ خطأ أثناء إنشاء التضمين: {e}")
-        # إذا لم يتوفر LM Studio، يمكنك إرجاع قائمة فارغة مؤقتًا
-        return [0.0] * 768
+def ensure_ingest_schema(conn):
+    """أعمدة التتبع اللازمة للاستئناف وعمود التضمين الثنائي (للقواعد المنشأة قبل إضافتها)"""
+    cur = conn.cursor()
+    cur.execute(INGEST_SCHEMA_SQL)
+    cur.close()
+    conn.commit()
 
 
-def chunk_text(content):
-    """تجزئة النص إلى مقاطع مع تحديد الأسطر"""
-    lines = [l.strip() for l in content.split("\n") if l.strip()]
-    line_count = len(lines)
-    words = content.split()
-    total_words = len(words)
+def file_fingerprint(file_path, block_size=1 << 20):
+    """بصمة sha256 لمحتوى الملف (قراءة متدرجة دون تحميله كاملًا)"""
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
 
-    chunks = []
-    step = CHUNK_SIZE - OVERLAP
 
-    for i in range(0, total_words, step):
-        chunk_words = words[i:i + CHUNK_SIZE]
-        chunk_text = " ".join(chunk_words)
-
-        # تحديد نطاق الأسطر التقريبي بناءً على النسبة
-        start_ratio = i / total_words
-        end_ratio = min((i + CHUNK_SIZE) / total_words, 1)
-        start_line = int(start_ratio * line_count) + 1
-        end_line = int(end_ratio * line_count)
+def find_book(conn, name):
+    """آخر سجل للكتاب: (id, file_hash, processing_status, last_chunk_index, has_content) أو None"""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT id, file_hash, processing_status, COALESCE(last_chunk_index, -1), content IS NOT NULL
+        FROM book WHERE name = %s
+        ORDER BY id DESC LIMIT 1;
+    """, (name,))
+    row = cur.fetchone()
+    cur.close()
+    return row
 
-        chunks.append({
-            "content": chunk_text,
-            "start_line": start_line,
-            "end_line": end_line,
-        })
 
-    return chunks
+def delete_books(conn, name):
+    """حذف النسخ السابقة من كتاب تغيّر ملفه (المقاطع تُحذف بـ ON DELETE CASCADE)"""
+    cur = conn.cursor()
+    cur.execute("DELETE FROM book WHERE name = %s;", (name,))
+    cur.close()
+    conn.commit()
 
 
-def insert_book(conn, name, content, chunk_count, line_count):
+def insert_book(conn, name, content, chunk_count, line_count, file_hash=None):
+    """إدخال سجل الكتاب بحالة pending"""
     cur = conn.cursor()
     cur.execute("""
-        INSERT INTO book (name, type, file_url, line_count, chunk_count, size_mb, content, processing_status)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        INSERT INTO book (name, type, file_url, line_count, chunk_count, size_mb, content,
+                          processing_status, file_hash, last_chunk_index)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
         RETURNING id;
-    """, (name, 'text/plain', '', line_count, chunk_count, 0.0, content, 'completed'))
+    """, (name, 'text/plain', '', line_count, chunk_count, 0.0, content, 'pending', file_hash, -1))
     book_id = cur.fetchone()[0]
-    conn.commit()
     cur.close()
+    conn.commit()
     return book_id
 
 
-def insert_chunk(conn, book_id, book_name, content, start_line, end_line, embedding):
+def set_book_status(conn, book_id, status):
+    """انتقال الحالة: pending → embedding → completed / failed"""
+    cur = conn.cursor()
+    cur.execute("UPDATE book SET processing_status = %s WHERE id = %s;", (status, book_id))
+    cur.close()
+    conn.commit()
+
+
+def finish_book(conn, book_id, chunk_count, line_count, spool=None):
+    """تحديث عدد المقاطع والأسطر (ونص الكتاب من spool) والحالة completed في معاملة واحدة
+
+    لا تصل الحالة إلى completed إلا بعد تثبيت آخر دفعة من المقاطع، فانقطاع
+    العملية لا يترك كتابًا نصف مكتوب بحالة completed.
+    """
     cur = conn.cursor()
+    if spool is not None and not spool.store(cur, book_id):
+        print(f"⚠️ نص الكتاب أكبر من {BOOK_CONTENT_MAX_MB} MB؛ لن يُخزَّن في book.content.")
     cur.execute("""
-        INSERT INTO chunk (book_id, book_name, content, start_line, end_line, embedding_vector, embedding_model, embedding_dim)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s);
-    """, (book_id, book_name, content, start_line, end_line, embedding, EMBED_MODEL, len(embedding)))
+        UPDATE book SET chunk_count = %s, line_count = %s, processing_status = 'completed'
+        WHERE id = %s;
+    """, (chunk_count, line_count, book_id))
+    cur.close()
     conn.commit()
+
+
+def insert_chunks(conn, book_id, book_name, rows):
+    """إدخال جماعي لمقاطع [(content, start_line, end_line, char_range, embedding), ...] في جملة واحدة
+
+    التضمين يُكتب مصفوفةً (embedding_vector) ونسخةً ثنائية float32 (embedding_f32)
+    يقرؤها الفهرس بـ np.frombuffer.
+    """
+    cur = conn.cursor()
+    execute_values(cur, """
+        INSERT INTO chunk (book_id, book_name, content, start_line, end_line, char_range,
+                           embedding_vector, embedding_f32, embedding_model, embedding_dim,
+                           text_hash, norm_text_hash)
+        VALUES %s;
+    """, [(book_id, book_name, content, s, e, cr, emb, psycopg2.Binary(pack_embedding(emb)),
+           EMBED_MODEL, len(emb), *text_hashes(content))
+          for content, s, e, cr, emb in rows], page_size=CHUNK_FLUSH_SIZE)
     cur.close()
 
 
+class ChunkWriter:
+    """مخزن مؤقت للمقاطع يُفرَّغ بإدخالات جماعية مع نقطة استئناف لكل دفعة
+
+    كل تفريغ يُدخل المقاطع ويحدّث book.last_chunk_index في معاملة واحدة،
+    فإذا انقطعت العملية يُستأنف الكتاب من أول مقطع لم يُثبَّت.
+    """
+
+    def __init__(self, conn, book_id, book_name, start=0, flush_size=CHUNK_FLUSH_SIZE):
+        self.conn = conn
+        self.book_id = book_id
+        self.book_name = book_name
+        self.flush_size = flush_size
+        self.rows = []
+        self.count = start   # عدد المقاطع المثبّتة (= فهرس المقطع التالي)
+
+    def add(self, chunk, embedding):
+        if embedding is None:
+            embedding = [0.0] * 768
+        self.rows.append((chunk["content"], chunk["start_line"], chunk["end_line"],
+                          chunk.get("char_range"), embedding))
+        if len(self.rows) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        insert_chunks(self.conn, self.book_id, self.book_name, self.rows)
+        cur = self.conn.cursor()
+        cur.execute("UPDATE book SET last_chunk_index = %s WHERE id = %s;",
+                    (self.count + len(self.rows) - 1, self.book_id))
+        cur.close()
+        self.conn.commit()
+        self.count += len(self.rows)
+        self.rows = []
+
+
 # ===================== المعالجة =====================
-def ingest_book(file_path):
-    """معالجة كتاب واحد"""
+def ingest_book(file_path, pipeline=False, workers=EMBED_WORKERS, progress=True):
+    """معالجة كتاب واحد (pipeline=True: تضمين متوازٍ مع كاتب واحد للقاعدة)
+
+    الكتاب المكتمل بنفس بصمة الملف يُتخطى، والكتاب المنقطع يُستأنف من
+    آخر مقطع مثبّت، والكتاب الذي تغيّر ملفه يُحذف ويُعاد إدخاله.
+    تعيد قاموسًا: book, chunks (المُدخلة في هذا التشغيل), seconds, skipped.
+    """
+    t0 = time.time()
     book_name = os.path.basename(file_path)
     print(f"\n📘 معالجة الكتاب: {book_name}")
+    set_endpoint_concurrency(workers)
 
-    with open(file_path, "r", encoding="utf-8") as f:
-        content = f.read()
-
-    norm_content = normalize_arabic(content)
-    chunks = chunk_text(norm_content)
-
+    file_hash = file_fingerprint(file_path)
     conn = connect_db()
-    book_id = insert_book(conn, book_name, norm_content, len(chunks), len(content.split("\n")))
-
-    print(f"📘 الكتاب يحتوي على {len(chunks)} مقاطع.")
-    for c in tqdm(chunks, desc="🔹 معالجة المقاطع"):
-        emb = embed_text(c["content"])
-        insert_chunk(conn, book_id, book_name, c["content"], c["start_line"], c["end_line"], emb)
+    prev = find_book(conn, book_name)
+    if prev and prev[1] == file_hash and prev[2] == "completed":
+        conn.close()
+        print("⏭️ الكتاب لم يتغير منذ آخر إدخال — تم التخطي.")
+        return dict(book=book_name, chunks=0, seconds=time.time() - t0, skipped=True)
+
+    if prev and prev[1] == file_hash:
+        book_id, start = prev[0], prev[3] + 1
+        print(f"↩️ استئناف الكتاب من المقطع {start} (الحالة السابقة: {prev[2]}).")
+    else:
+        if prev:
+            delete_books(conn, book_name)
+        book_id = insert_book(conn, book_name, None, None, None, file_hash)
+        start = 0
+
+    # book.content يُجمع من نفس مرور القراءة ويُكتب عند الإكمال (لا f.read() للملف كاملًا)؛
+    # الكتاب المستأنف الذي خُزّن نصه سابقًا لا يُعاد جمع نصه
+    spool = None if prev and prev[1] == file_hash and prev[4] else ContentSpool()
 
-    conn.close()
-    print(f"✅ تم إدخال الكتاب '{book_name}' بنجاح إلى Supabase.")
+    try:
+        set_book_status(conn, book_id, "embedding")
+        writer = ChunkWriter(conn, book_id, book_name, start)
+        stats = {}
+        # المقاطع تُولَّد أثناء القراءة؛ المثبّتة سابقًا تُتخطى دون تضمين
+        remaining = islice(iter_chunks(file_path, stats, spool), start, None)
+
+        if pipeline:
+            def write(batch, embeddings):
+                for c, emb in zip(batch, embeddings):
+                    writer.add(c, emb)
+
+            res = run_pipeline(remaining, embed_cached, write, workers=workers,
+                               batch_size=EMBED_BATCH_SIZE, max_tokens=EMBED_MAX_TOKENS)
+        else:
+            batches = make_batches(remaining, EMBED_BATCH_SIZE, EMBED_MAX_TOKENS, key=lambda c: c["content"])
+            with tqdm(desc="🔹 معالجة المقاطع", unit=" مقطع", disable=not progress) as bar:
+                for batch in batches:
+                    for c, emb in zip(batch, embed_cached([c["content"] for c in batch])):
+                        writer.add(c, emb)
+                    bar.update(len(batch))
+
+        writer.flush()
+        finish_book(conn, book_id, writer.count, stats.get("lines", 0), spool)
+        print(f"📘 الكتاب يحتوي على {writer.count} مقاطع و{stats.get('lines', 0)} سطرًا.")
+    except BaseException:
+        try:
+            conn.rollback()
+            set_book_status(conn, book_id, "failed")
+        except psycopg2.Error:
+            pass  # الاتصال نفسه انقطع؛ تبقى الحالة embedding ويُستأنف لاحقًا
+        raise
+    finally:
+        conn.close()
+        if spool is not None:
+            spool.close()
+
+    if pipeline:
+        print(f"✅ تم إدخال الكتاب '{book_name}' بنجاح إلى Supabase — "
+              f"{res['chunks_per_s']:.1f} مقطع/ث (حد التزامن النهائي {res['final_limit']:.1f}).")
+    else:
+        print(f"✅ تم إدخال الكتاب '{book_name}' بنجاح إلى Supabase.")
+    return dict(book=book_name, chunks=writer.count - start, seconds=time.time() - t0, skipped=False)
+
+
+# ===================== الإدخال متعدد العمليات =====================
+def _init_worker(slots):
+    """تهيئة عملية عاملة: تشارك سيمافور التضمين مع بقية العمليات"""
+    global _embed_slots
+    _embed_slots = slots
+
+
+def _ingest_task(task):
+    """تنفيذ كتاب واحد داخل عملية عاملة (كل عملية تفتح اتصالاتها الخاصة بالقاعدة)
+
+    تعيد نتيجة ingest_book مع فروق عدّادات التضمين والذاكرة لهذا الكتاب،
+    لأن العدّادات محلية لكل عملية ولا يراها الأب.
+    """
+    file_path, pipeline, embed_workers = task
+    cache = get_embed_cache()
+    before = dict(embed_stats, hits=cache.hits, misses=cache.misses)
+    try:
+        res = ingest_book(file_path, pipeline=pipeline, workers=embed_workers, progress=False)
+        res["error"] = None
+    except Exception as e:
+        res = dict(book=os.path.basename(file_path), chunks=0, seconds=0.0, skipped=False, error=str(e))
+    after = dict(embed_stats, hits=cache.hits, misses=cache.misses)
+    res["counters"] = {k: after[k] - before[k] for k in after}
+    return res
+
+
+def ingest_parallel(paths, processes, pipeline=False, embed_workers=EMBED_WORKERS):
+    """توزيع الكتب على مجمّع عمليات؛ التقطيع والتطبيع يعملان على عدة أنوية
+
+    طلبات التضمين من كل العمليات تمر عبر سيمافور واحد بسعة embed_workers،
+    فلا يتجاوز مجموعها ما يحتمله LM Studio. تعيد نتائج الكتب والزمن الكلي.
+    اتصالات مجمّع الأب تُغلق قبل fork فلا تتشاركها العمليات الابنة.
+    """
+    close_pools()
+    slots = mp.BoundedSemaphore(embed_workers)
+    tasks = [(p, pipeline, embed_workers) for p in paths]
+    results = []
+    t0 = time.time()
+    with mp.Pool(processes, initializer=_init_worker, initargs=(slots,)) as pool:
+        for res in pool.imap_unordered(_ingest_task, tasks):
+            if res["error"]:
+                print(f"❌ فشل إدخال الكتاب '{res['book']}' (سيُستأنف في التشغيل القادم): {res['error']}")
+            elif not res["skipped"]:
+                rate = res["chunks"] / res["seconds"] if res["seconds"] > 0 else 0.0
+                print(f"✅ {res['book']}: {res['chunks']} مقطعًا خلال {res['seconds']:.1f} ث ({rate:.1f} مقطع/ث).")
+            results.append(res)
+    return results, time.time() - t0
 
 
 def main():
+    parser = argparse.ArgumentParser(description="إدخال الكتب إلى قاعدة البيانات")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="تضمين متوازٍ مع طابور محدود وكاتب واحد للقاعدة")
+    parser.add_argument("--embed-workers", type=int, default=EMBED_WORKERS,
+                        help="أقصى عدد طلبات تضمين متزامنة (لكل الكتب معًا في وضع --workers)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="عدد العمليات التي تعالج الكتب بالتوازي (1 = عملية واحدة)")
+    args = parser.parse_args()
+
     files = [f for f in os.listdir(BOOKS_DIR) if f.endswith(".txt")]
     if not files:
         print("❌ لم يتم العثور على كتب في المجلد ./books")
         return
 
-    for f in files:
-        ingest_book(os.path.join(BOOKS_DIR, f))
+    conn = connect_db()
+    ensure_ingest_schema(conn)
+    conn.close()
+
+    counters = None
+    if args.workers > 1:
+        paths = [os.path.join(BOOKS_DIR, f) for f in files]
+        results, seconds = ingest_parallel(paths, args.workers, args.pipeline, args.embed_workers)
+        counters = {k: sum(r["counters"][k] for r in results) for k in results[0]["counters"]}
+        total = sum(r["chunks"] for r in results)
+        done = sum(1 for r in results if not r["error"] and not r["skipped"])
+        print(f"\n⏱️ {done} كتابًا / {total} مقطعًا خلال {seconds:.1f} ث "
+              f"({total / seconds if seconds > 0 else 0.0:.1f} مقطع/ث، {args.workers} عمليات).")
+    else:
+        for f in files:
+            try:
+                ingest_book(os.path.join(BOOKS_DIR, f), pipeline=args.pipeline, workers=args.embed_workers)
+            except Exception as e:
+                print(f"❌ فشل إدخال الكتاب '{f}' (سيُستأنف في التشغيل القادم): {e}")
+
+    # تحديث فهرس التضمينات على القرص (إن وُجد) بالمقاطع الجديدة فقط
+    if os.path.exists(os.path.join(INDEX_DIR, META_FILE)):
+        conn = connect_db()
+        added, removed = sync_index_file(conn)
+        conn.close()
+        print(f"🔄 تمت مزامنة الفهرس: +{added} / -{removed} مقطعًا.")
+
+    if counters is None:
+        cache = get_embed_cache()
+        counters = dict(embed_stats, hits=cache.hits, misses=cache.misses)
+    print(f"📡 طلبات التضمين: {counters['requests']} لـ {counters['texts']} مقطعًا "
+          f"(تقسيمات: {counters['splits']}، فشل: {counters['failed']}).")
+    lookups = counters["hits"] + counters["misses"]
+    print(f"🗃️ ذاكرة التضمينات: إصابة {counters['hits']} / إخفاق {counters['misses']} "
+          f"(نسبة الإصابة {counters['hits'] / lookups * 100 if lookups else 0.0:.1f}%).")
 
 
 if __name__ == "__main__":
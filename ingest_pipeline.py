@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+ingest_pipeline.py
+🔹 خط إدخال متوازٍ (منتج/مستهلك) مع ضغط عكسي (backpressure)
+- المنتج: يقسّم المقاطع إلى دفعات ويضعها في طابور محدود الحجم
+- عمّال التضمين: N خيطًا ترسل الدفعات إلى LM Studio بالتوازي
+- الكاتب: خيط واحد (الخيط الرئيسي) يُدخل النتائج في القاعدة بالترتيب الأصلي
+- حد التزامن تكيفي (AIMD): يزيد تدريجيًا مع النجاح، وينخفض للنصف
+  عند الأخطاء أو تجاوز زمن الاستجابة المستهدف، فلا يُغرق LM Studio
+"""
+
+import time
+import queue
+import threading
+
+from embed_client import make_batches
+
+# ===================== الإعدادات =====================
+EMBED_WORKERS = 4          # أقصى عدد طلبات تضمين متزامنة
+QUEUE_SIZE = 8             # عدد الدفعات المنتظرة في كل طابور (ضغط عكسي)
+LATENCY_TARGET = 10.0      # ثوانٍ؛ تجاوزه لدفعة يُعامل كإشارة ازدحام
+
+_DONE = object()
+
+
+# ===================== حد التزامن التكيفي =====================
+class AIMDLimiter:
+    """حد تزامن بزيادة جمعية وخفض ضربي (مثل التحكم بالازدحام في TCP)"""
+
+    def __init__(self, max_limit, min_limit=1, initial=1):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(initial)
+        self.in_flight = 0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while self.in_flight >= int(self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+
+    def release(self, ok, latency):
+        with self.cond:
+            self.in_flight -= 1
+            if ok and latency <= LATENCY_TARGET:
+                # +1 تقريبًا لكل "جولة" كاملة من الطلبات
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            else:
+                self.limit = max(self.min_limit, self.limit / 2)
+            self.cond.notify_all()
+
+
+# ===================== خط الإدخال =====================
+def run_pipeline(items, embed_fn, write_fn, workers=EMBED_WORKERS,
+                 batch_size=None, max_tokens=None, key=lambda c: c["content"]):
+    """تشغيل التقطيع → التضمين → الكتابة بالتوازي
+
+    embed_fn(texts) تعيد قائمة تضمينات بنفس الطول (None للنص الفاشل)،
+    وwrite_fn(batch, embeddings) تُستدعى في الخيط الرئيسي بترتيب الدفعات.
+    تعيد قاموس إحصاءات: chunks, seconds, chunks_per_s, final_limit.
+    """
+    batch_kwargs = {k: v for k, v in (("batch_size", batch_size), ("max_tokens", max_tokens)) if v}
+    limiter = AIMDLimiter(workers)
+    in_q = queue.Queue(maxsize=QUEUE_SIZE)
+    out_q = queue.Queue(maxsize=QUEUE_SIZE)
+    stop = threading.Event()
+    errors = []
+
+    def _put(q, item):
+        # put قابل للإيقاف: لا يعلق الخيط إذا توقف الكاتب بسبب خطأ
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def producer():
+        try:
+            for seq, batch in enumerate(make_batches(items, key=key, **batch_kwargs)):
+                if not _put(in_q, (seq, batch)):
+                    return
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            for _ in range(workers):
+                _put(in_q, _DONE)
+
+    def worker():
+        try:
+            while not stop.is_set():
+                try:
+                    item = in_q.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                if item is _DONE:
+                    break
+                seq, batch = item
+                limiter.acquire()
+                t0 = time.time()
+                ok = False
+                try:
+                    embeddings = embed_fn([key(c) for c in batch])
+                    ok = all(e is not None for e in embeddings)
+                finally:
+                    limiter.release(ok, time.time() - t0)
+                if not _put(out_q, (seq, batch, embeddings)):
+                    return
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(out_q, _DONE)
+
+    threads = [threading.Thread(target=producer, daemon=True)]
+    threads += [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    t0 = time.time()
+    for t in threads:
+        t.start()
+
+    # الكاتب: يعيد ترتيب الدفعات حسب seq حتى تُدخل المقاطع بترتيبها في الكتاب
+    pending, next_seq, done, written = {}, 0, 0, 0
+    try:
+        while done < workers:
+            try:
+                item = out_q.get(timeout=0.5)
+            except queue.Empty:
+                if errors:
+                    break
+                continue
+            if item is _DONE:
+                done += 1
+                continue
+            seq, batch, embeddings = item
+            pending[seq] = (batch, embeddings)
+            while next_seq in pending:
+                batch, embeddings = pending.pop(next_seq)
+                write_fn(batch, embeddings)
+                written += len(batch)
+                next_seq += 1
+    finally:
+        stop.set()
+        for t in threads:
+            t.join(timeout=1)
+    if errors:
+        raise errors[0]
+
+    seconds = time.time() - t0
+    return {
+        "chunks": written,
+        "seconds": seconds,
+        "chunks_per_s": written / seconds if seconds > 0 else 0.0,
+        "final_limit": limiter.limit,
+    }
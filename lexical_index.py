@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""
+lexical_index.py
+🔹 فهرس معجمي BM25 داخل العملية + دمج مع الترتيب الدلالي (RRF)
+- الرموز: normalize_arabic + إزالة الحركات + تجريد خفيف للسوابق (ال، و، ب، ...)
+- قوائم الورود (postings) مصفوفات NumPy متصلة بصيغة CSR لكل مقطع (segment):
+  offsets[term] … offsets[term+1] داخل docs/tfs، فاستعلام الكلمة شريحة واحدة
+- تزايدي مثل فهرس التضمينات: المقاطع الجديدة (id > max_id) تُضاف كمقطع CSR
+  جديد، والمحذوفة تُعلَّم، ثم يُدمج الكل عند الحفظ
+- rrf_fuse / hybrid_search: دمج ترتيب BM25 مع ترتيب التشابه الكوني بـ
+  Reciprocal Rank Fusion بدل توسيع السؤال بكلمات ثابتة
+
+الاستخدام:
+  python lexical_index.py [build|sync] [./index]
+"""
+
+import os
+import re
+import sys
+import math
+import time
+import tempfile
+from collections import Counter
+
+import numpy as np
+
+from embedding_cache import normalize_arabic, TASHKEEL
+from index_store import INDEX_DIR, FETCH_BATCH, DB, _deleted_ids, embedding_columns
+from vector_index import as_vector
+
+# ===================== الإعدادات =====================
+LEXICAL_FILE = "lexical.npz"
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60                 # ثابت RRF: 1 / (RRF_K + الرتبة)
+HYBRID_CANDIDATES = 50     # عدد المرشحين من كل ترتيب قبل الدمج
+
+# السوابق الأطول أولًا؛ الحرف المفرد لا يُجرَّد إلا إذا بقي 3 أحرف على الأقل
+PREFIXES = ("وال", "فال", "بال", "كال", "لل", "ال", "و", "ف", "ب", "ك", "ل")
+WORD = re.compile(r"\w+")
+
+
+# ===================== الترميز =====================
+def stem(token):
+    for p in PREFIXES:
+        if token.startswith(p) and len(token) - len(p) >= (2 if len(p) > 1 else 3):
+            return token[len(p):]
+    return token
+
+
+def tokenize(text):
+    """رموز BM25 لنص (نفس المعالجة للمقاطع والأسئلة)"""
+    return [stem(t) for t in WORD.findall(TASHKEEL.sub("", normalize_arabic(text)))]
+
+
+# ===================== الفهرس =====================
+class LexicalIndex:
+    """فهرس BM25: مفردات → term id، ومقاطع CSR من (docs, tfs) مرتبة حسب الكلمة
+
+    المستندات مواقع 0..n-1؛ ids يحوّل الموقع إلى chunk.id.
+    """
+
+    def __init__(self):
+        self.vocab = {}
+        self.segments = []                       # [(offsets, docs, tfs), ...]
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.doc_len = np.zeros(0, dtype=np.float32)
+        self.deleted = np.zeros(0, dtype=bool)
+        self.total_len = 0.0
+        self.max_id = 0
+
+    def __len__(self):
+        return int(self.ids.size - self.deleted.sum())
+
+    # ---------- الإضافة والحذف ----------
+    def add_documents(self, ids, texts):
+        """إضافة مستندات جديدة كمقطع CSR واحد"""
+        base = int(self.ids.size)
+        term_ids, docs, tfs, lengths = [], [], [], []
+        for j, text in enumerate(texts):
+            tokens = tokenize(text or "")
+            lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                term_ids.append(self.vocab.setdefault(term, len(self.vocab)))
+                docs.append(base + j)
+                tfs.append(tf)
+        if lengths:
+            term_ids = np.asarray(term_ids, dtype=np.int64)
+            order = np.argsort(term_ids, kind="stable")
+            counts = np.bincount(term_ids, minlength=len(self.vocab))
+            offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+            self.segments.append((offsets,
+                                  np.asarray(docs, dtype=np.int32)[order],
+                                  np.asarray(tfs, dtype=np.uint16)[order]))
+            self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+            self.doc_len = np.concatenate([self.doc_len, np.asarray(lengths, dtype=np.float32)])
+            self.deleted = np.concatenate([self.deleted, np.zeros(len(lengths), dtype=bool)])
+            self.total_len += float(sum(lengths))
+            self.max_id = max(self.max_id, int(max(ids)))
+        return len(lengths)
+
+    def delete_ids(self, ids):
+        mask = np.isin(self.ids, np.fromiter(ids, dtype=np.int64)) & ~self.deleted
+        self.total_len -= float(self.doc_len[mask].sum())
+        self.deleted |= mask
+        return int(mask.sum())
+
+    def compact(self):
+        """دمج كل المقاطع في CSR واحد وإسقاط المستندات المحذوفة"""
+        live = np.flatnonzero(~self.deleted)
+        remap = np.full(self.ids.size, -1, dtype=np.int64)
+        remap[live] = np.arange(live.size)
+        term_ids, docs, tfs = [], [], []
+        for offsets, d, t in self.segments:
+            terms = np.repeat(np.arange(offsets.size - 1), np.diff(offsets))
+            keep = remap[d] >= 0
+            term_ids.append(terms[keep]); docs.append(remap[d][keep]); tfs.append(t[keep])
+        term_ids = np.concatenate(term_ids) if term_ids else np.zeros(0, dtype=np.int64)
+        order = np.argsort(term_ids, kind="stable")
+        counts = np.bincount(term_ids, minlength=len(self.vocab))
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        docs = np.concatenate(docs).astype(np.int32)[order] if docs else np.zeros(0, dtype=np.int32)
+        tfs = np.concatenate(tfs)[order] if tfs else np.zeros(0, dtype=np.uint16)
+        self.segments = [(offsets, docs, tfs)]
+        self.ids = self.ids[live]
+        self.doc_len = self.doc_len[live]
+        self.deleted = np.zeros(live.size, dtype=bool)
+
+    # ---------- البحث ----------
+    def _postings(self, tid):
+        parts = [(d[o[tid]:o[tid + 1]], t[o[tid]:o[tid + 1]])
+                 for o, d, t in self.segments if tid < o.size - 1]
+        if len(parts) == 1:
+            return parts[0]
+        return (np.concatenate([p[0] for p in parts]) if parts else np.zeros(0, dtype=np.int32),
+                np.concatenate([p[1] for p in parts]) if parts else np.zeros(0, dtype=np.uint16))
+
+    def search(self, query, k):
+        """أفضل k مستند لـ BM25: [(chunk_id, score), ...]"""
+        n = len(self)
+        if n == 0 or k <= 0:
+            return []
+        avgdl = self.total_len / n or 1.0
+        all_docs, all_scores = [], []
+        for tid in {self.vocab[t] for t in tokenize(query) if t in self.vocab}:
+            docs, tfs = self._postings(tid)
+            live = ~self.deleted[docs]
+            docs, tf = docs[live], tfs[live].astype(np.float32)
+            if not docs.size:
+                continue
+            idf = math.log(1.0 + (n - docs.size + 0.5) / (docs.size + 0.5))
+            norm = BM25_K1 * (1.0 - BM25_B + BM25_B * self.doc_len[docs] / avgdl)
+            all_docs.append(docs)
+            all_scores.append(idf * tf * (BM25_K1 + 1.0) / (tf + norm))
+        if not all_docs:
+            return []
+        docs, inverse = np.unique(np.concatenate(all_docs), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+        k = min(k, scores.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(self.ids[docs[i]]), float(scores[i])) for i in top]
+
+    # ---------- الحفظ ----------
+    def save(self, path=INDEX_DIR):
+        self.compact()
+        offsets, docs, tfs = self.segments[0] if self.segments else (np.zeros(1, np.int64), np.zeros(0, np.int32),
+                                                                     np.zeros(0, np.uint16))
+        terms = sorted(self.vocab, key=self.vocab.get)
+        os.makedirs(path, exist_ok=True)
+        # اسم مؤقت فريد: تشغيلان متزامنان (open_lexical من سطر الأوامر) لا يكتبان الملف نفسه
+        with tempfile.NamedTemporaryFile(dir=path, prefix=LEXICAL_FILE + ".", suffix=".tmp", delete=False) as f:
+            tmp = f.name
+            try:
+                np.savez(f, terms=np.array("\n".join(terms)), offsets=offsets, docs=docs, tfs=tfs,
+                         ids=self.ids, doc_len=self.doc_len, max_id=np.int64(self.max_id))
+            except BaseException:
+                f.close()
+                os.unlink(tmp)
+                raise
+        os.replace(tmp, os.path.join(path, LEXICAL_FILE))
+
+    @classmethod
+    def load(cls, path=INDEX_DIR):
+        """تحميل lexical.npz، أو None إذا لم يُبنَ بعد"""
+        file = os.path.join(path, LEXICAL_FILE)
+        if not os.path.exists(file):
+            return None
+        with np.load(file) as data:
+            lex = cls()
+            terms = str(data["terms"])
+            lex.vocab = {t: i for i, t in enumerate(terms.split("\n"))} if terms else {}
+            lex.segments = [(data["offsets"], data["docs"], data["tfs"])]
+            lex.ids = data["ids"]
+            lex.doc_len = data["doc_len"]
+            lex.max_id = int(data["max_id"])
+        lex.deleted = np.zeros(lex.ids.size, dtype=bool)
+        lex.total_len = float(lex.doc_len.sum())
+        return lex
+
+
+# ===================== المزامنة مع القاعدة =====================
+def sync_lexical(conn, lex):
+    """إضافة المقاطع ذات id > max_id وتعليم المحذوفة؛ تعيد (المضاف، المحذوف)"""
+    cur = conn.cursor(name="lexical_export")
+    cur.itersize = FETCH_BATCH
+    cur.execute("SELECT id, content FROM chunk WHERE id > %s ORDER BY id ASC;", (lex.max_id,))
+    added = 0
+    while True:
+        rows = cur.fetchmany(FETCH_BATCH)
+        if not rows:
+            break
+        added += lex.add_documents([r[0] for r in rows], [r[1] for r in rows])
+    cur.close()
+    conn.commit()
+    live_ids = lex.ids[~lex.deleted].tolist()
+    removed = _deleted_ids(conn, live_ids, lex.max_id)
+    if removed:
+        lex.delete_ids(removed)
+    return added, len(removed)
+
+
+def build_lexical_file(conn, path=INDEX_DIR):
+    lex = LexicalIndex()
+    sync_lexical(conn, lex)
+    lex.save(path)
+    return len(lex), len(lex.vocab)
+
+
+def sync_lexical_file(conn, path=INDEX_DIR):
+    lex = LexicalIndex.load(path)
+    if lex is None:
+        n, _ = build_lexical_file(conn, path)
+        return n, 0
+    added, removed = sync_lexical(conn, lex)
+    if added or removed:
+        lex.save(path)
+    return added, removed
+
+
+def open_lexical(connect, path=INDEX_DIR):
+    """الفهرس المعجمي من القرص مع مزامنته التزايدية
+
+    عند غيابه يُبنى من القاعدة ويُحفظ في path، فلا يُعاد بناؤه من جدول
+    chunk كاملًا في كل سؤال.
+    """
+    lex = LexicalIndex.load(path)
+    conn = connect()
+    try:
+        if lex is None:
+            lex = LexicalIndex()
+            sync_lexical(conn, lex)
+            lex.save(path)
+        elif any(sync_lexical(conn, lex)):
+            lex.save(path)
+    finally:
+        conn.close()
+    return lex
+
+
+# ===================== الدمج الهجين =====================
+def rrf_fuse(rankings, k=RRF_K):
+    """Reciprocal Rank Fusion لقوائم معرّفات مرتبة: [(id, rrf_score), ...] تنازليًا"""
+    fused = {}
+    for ranking in rankings:
+        for rank, cid in enumerate(ranking, 1):
+            fused[cid] = fused.get(cid, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda x: -x[1])
+
+
+def _score_chunks(connect, ids, q_vec):
+    """بيانات المقاطع ids وتشابهها الكوني مع q_vec من القاعدة: {id: {..., score}}"""
+    q = np.asarray(q_vec, dtype=np.float32)
+    qn = np.linalg.norm(q) or 1.0
+    conn = connect()
+    cur = conn.cursor()
+    try:
+        cur.execute(f"""
+            SELECT id, book_id, book_name, start_line, end_line, {embedding_columns(conn)}
+            FROM chunk WHERE id = ANY(%s);
+        """, (ids,))
+        rows = cur.fetchall()
+    finally:
+        cur.close(); conn.close()
+    scored = {}
+    for cid, bid, name, s, e, packed, emb in rows:
+        v = np.asarray(as_vector(packed if packed is not None else emb), dtype=np.float32)
+        score = float(v @ q / (np.linalg.norm(v) * qn)) if v.size == q.size and v.any() else 0.0
+        scored[cid] = dict(id=cid, book_id=bid, book_name=name, start_line=s, end_line=e, score=score)
+    return scored
+
+
+def hybrid_search(index, lex, q_vec, query, k, min_score=None, connect=None,
+                  candidates=HYBRID_CANDIDATES):
+    """أفضل k مقطع بدمج ترتيب التضمينات مع ترتيب BM25
+
+    المقاطع التي جاءت من BM25 وحده يُحسب تشابهها الكوني من القاعدة عبر
+    connect (مطلوبة عندها)، ثم يُطبَّق min_score على كل المرشحين قبل
+    الاقتصار على k، فلا يتجاوز العتبةَ مقطعٌ لمجرد تطابق كلماته.
+    المحتوى لا يُجلب هنا (attach_contents بعد الاختيار).
+    """
+    dense = index.search(q_vec, candidates, min_score)
+    lexical = lex.search(query, candidates) if lex is not None else []
+    by_id = {r["id"]: r for r in dense}
+    bm25 = dict(lexical)
+    fused = rrf_fuse([[r["id"] for r in dense], [cid for cid, _ in lexical]])
+
+    missing = [cid for cid, _ in fused if cid not in by_id]
+    if missing:
+        if connect is None:
+            raise ValueError("hybrid_search needs connect to score lexical-only hits")
+        by_id.update(_score_chunks(connect, missing, q_vec))
+
+    results = []
+    for cid, rrf in fused:
+        r = by_id.get(cid)    # None: حُذف من القاعدة بعد آخر مزامنة للفهرس المعجمي
+        if r is None or (min_score is not None and r["score"] < min_score):
+            continue
+        results.append({**r, "rrf": rrf, "bm25": bm25.get(cid, 0.0)})
+        if len(results) == k:
+            break
+    return results
+
+
+# ===================== تنفيذ مباشر =====================
+if __name__ == "__main__":
+    import psycopg2
+
+    args = sys.argv[1:]
+    cmd = args.pop(0) if args and args[0] in ("build", "sync") else "build"
+    out = args[0] if args else INDEX_DIR
+    t0 = time.time()
+    conn = psycopg2.connect(**DB)
+    if cmd == "sync":
+        added, removed = sync_lexical_file(conn, out)
+        print(f"✅ الفهرس المعجمي: +{added} / -{removed} مقطعًا خلال {time.time() - t0:.1f} ث.")
+    else:
+        n, v = build_lexical_file(conn, out)
+        print(f"✅ الفهرس المعجمي: {n} مقطعًا و{v} كلمة خلال {time.time() - t0:.1f} ث.")
+    conn.close()
@@ -4,9 +4,10 @@ list_and_view_conversations.py
 🔹 عرض المحادثات والرسائل المحفوظة في قاعدة البيانات
 """
 
-import psycopg2
 from datetime import datetime
 
+from db_pool import get_pool
+
 # ===================== إعدادات الاتصال =====================
 DB = dict(
     host="localhost",
@@ -19,7 +20,7 @@ DB = dict(
 
 # ===================== الدوال =====================
 def connect_db():
-    return psycopg2.connect(**DB)
+    return get_pool(DB).connect()
 
 
 def list_conversations():
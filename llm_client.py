@@ -1,19 +1,62 @@
 from openai import OpenAI
 import os
+import time
 from dotenv import load_dotenv
 
+from http_client import MAX_RETRIES, TIMEOUTS
+
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# عميل واحد لكل عملية يحتفظ بمجمّع اتصالاته؛ إعادة المحاولة والمهلة بنفس سياسة http_client
+client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=MAX_RETRIES, timeout=TIMEOUTS["complete"][1])
+
+CHAT_MODEL = "gpt-4o-mini"
 
-def generate_answer(prompt, context):
+def _answer_messages(prompt, context, draft=None):
     system_prompt = (
         "أنت باحث أكاديمي بالعربية، تجيب فقط اعتمادًا على المقاطع المعطاة. "
         "ضع إشارات (مرجع 1، مرجع 2...) عند الاستشهاد. "
         "إذا لم تجد إجابة كافية، قل: المقاطع لا تحتوي على إجابة واضحة."
     )
-    messages = [
+    user_content = f"السؤال:\n{prompt}\n\nالمقاطع:\n{context}"
+    if draft:
+        user_content += f"\n\nمسودة إجابة سابقة لسؤال مشابه (صحّحها وفق المقاطع):\n{draft}"
+    return [
         {"role": "system", "content": system_prompt},
-        {"role": "user", "content": f"السؤال:\n{prompt}\n\nالمقاطع:\n{context}"}
+        {"role": "user", "content": user_content}
     ]
-    res = client.chat.completions.create(model="gpt-4o-mini", messages=messages, temperature=0.3)
+
+def generate_answer(prompt, context, draft=None):
+    """draft: إجابة محفوظة لسؤال مشابه جدًا (answer_cache) يراجعها النموذج بدل البدء من الصفر"""
+    res = client.chat.completions.create(model=CHAT_MODEL, messages=_answer_messages(prompt, context, draft),
+                                         temperature=0.3)
+    return res.choices[0].message.content.strip()
+
+def stream_answer(prompt, context, draft=None):
+    """نفس generate_answer لكن تُعاد الرموز تباعًا فور وصولها (stream=True)"""
+    return _stream_chat(_answer_messages(prompt, context, draft), temperature=0.3)
+
+def generate_from_llm(prompt):
+    """إرسال prompt جاهز كرسالة مستخدم واحدة وإرجاع النص كاملًا"""
+    res = client.chat.completions.create(model=CHAT_MODEL, messages=[{"role": "user", "content": prompt}],
+                                         temperature=0.3)
     return res.choices[0].message.content.strip()
+
+def stream_from_llm(prompt):
+    """نسخة متدفقة من generate_from_llm"""
+    return _stream_chat([{"role": "user", "content": prompt}], temperature=0.3)
+
+def _stream_chat(messages, temperature):
+    t0 = time.time()
+    first = True
+    stream = client.chat.completions.create(model=CHAT_MODEL, messages=messages,
+                                            temperature=temperature, stream=True)
+    for event in stream:
+        if not event.choices:
+            continue
+        token = event.choices[0].delta.content
+        if token:
+            if first:
+                print(f"⏱️ أول رمز من {CHAT_MODEL} بعد {time.time() - t0:.2f} ث")
+                first = False
+            yield token
+    print(f"⏱️ اكتملت الإجابة من {CHAT_MODEL} خلال {time.time() - t0:.2f} ث")
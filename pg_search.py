@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+pg_search.py
+🔹 استرجاع عبر pgvector: ترتيب أفضل k داخل SQL بدل نقل الجدول كاملًا
+- يتطلب تشغيل setup_pgvector.py مرة واحدة (عمود embedding vector(1024) + فهرس)
+- تُطبّق عتبة MIN_ACCEPT على الخادم، فلا يعبر الشبكة سوى k صف على الأكثر
+- إذا لم يكن الامتداد أو العمود موجودًا تُعاد None ويُستعمل مسار المصفوفات
+"""
+
+# ===================== الإعدادات =====================
+VECTOR_DIM = 1024
+HNSW_EF_SEARCH = 64     # دقة بحث HNSW (أعلى = أدق وأبطأ)
+IVFFLAT_PROBES = 10     # عدد القوائم المفحوصة لفهرس IVFFlat
+
+
+# ===================== أدوات مساعدة =====================
+def vector_literal(vec):
+    """تحويل متجه إلى صيغة pgvector النصية '[x1,x2,...]'"""
+    return "[" + ",".join(repr(float(x)) for x in vec) + "]"
+
+
+def has_pgvector(conn):
+    """هل امتداد vector مثبّت وعمود chunk.embedding موجود؟"""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'vector')
+           AND EXISTS (SELECT 1 FROM information_schema.columns
+                       WHERE table_name = 'chunk' AND column_name = 'embedding');
+    """)
+    ok = cur.fetchone()[0]
+    cur.close()
+    conn.rollback()
+    return ok
+
+
+# ===================== الخلفية =====================
+class PgVectorIndex:
+    """خلفية بحث بنفس واجهة search() لبقية الفهارس، تنفّذ الترتيب في SQL"""
+
+    def __init__(self, connect):
+        self.connect = connect
+        self.info = {"backend": "pgvector"}
+
+    def search(self, q_vec, k, min_score=None):
+        """أفضل k مقطع (≥ min_score) بترتيب المسافة الكونية <=>"""
+        if len(q_vec) != VECTOR_DIM:
+            return []
+        vec = vector_literal(q_vec)
+        max_dist = 2.0 if min_score is None else 1.0 - min_score
+        conn = self.connect()
+        cur = conn.cursor()
+        cur.execute("SET LOCAL hnsw.ef_search = %s;", (max(HNSW_EF_SEARCH, k),))
+        cur.execute("SET LOCAL ivfflat.probes = %s;", (IVFFLAT_PROBES,))
+        cur.execute("""
+            SELECT id, book_id, book_name, content, start_line, end_line,
+                   1 - (embedding <=> %s::vector) AS score
+            FROM chunk
+            WHERE embedding IS NOT NULL
+              AND (embedding <=> %s::vector) <= %s
+            ORDER BY embedding <=> %s::vector
+            LIMIT %s;
+        """, (vec, vec, max_dist, vec, k))
+        rows = cur.fetchall()
+        cur.close(); conn.rollback(); conn.close()
+        return [dict(id=c, book_id=b, book_name=n, content=t,
+                     start_line=s, end_line=e, score=float(sc))
+                for c, b, n, t, s, e, sc in rows]
+
+
+def open_pgvector(connect):
+    """PgVectorIndex إذا كانت القاعدة مهيأة، وإلا None (الرجوع لمسار المصفوفات)"""
+    conn = connect()
+    try:
+        ok = has_pgvector(conn)
+    finally:
+        conn.close()
+    if not ok:
+        print("⚠️ pgvector غير مهيأ (شغّل setup_pgvector.py)؛ استعمال البحث بالمصفوفات.")
+        return None
+    return PgVectorIndex(connect)
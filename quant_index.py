@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+quant_index.py
+🔹 نسخ مضغوطة من مصفوفة التضمينات (float16 / int8) لتقليل الذاكرة
+- float16 : نصف حجم float32
+- int8    : ربع حجم float32 مع معامل قياس لكل متجه (max|x| / 127)
+- الدرجات التقريبية تُحسب على دفعات (تحويل الدفعة إلى float32 ثم ضرب)
+  فلا تُنشأ نسخة float32 كاملة من المصفوفة في كل سؤال
+- إعادة الترتيب الدقيقة: أفضل k × QUANT_RESCORE مرشحًا تُعاد درجاتهم من
+  embeddings.npy (memory-map، فلا تُقرأ إلا صفحات المرشحين)
+- الصفوف المضافة بالمزامنة (delta) تبقى float32 وتُفحص بدقة دائمًا
+
+الاستخدام:
+  python quant_index.py build [float16|int8|all] [./index]
+  python quant_index.py report [./index]   # الذاكرة وrecall@k والزمن مقابل float32
+"""
+
+import os
+import sys
+import json
+import time
+import numpy as np
+
+from vector_index import DTYPE, to_query_vector
+
+# ===================== الإعدادات =====================
+QUANT_FILES = {"float16": "embeddings.f16.npy", "int8": "embeddings.i8.npy"}
+SCALES_FILE = "scales.i8.npy"
+QUANT_META_FILE = "quant.json"
+QUANT_RESCORE = 4          # عدد المرشحين للترتيب الدقيق = k × QUANT_RESCORE (0 = بلا إعادة ترتيب)
+SCORE_BLOCK = 512          # صفوف كل دفعة (2 MB بعد التحويل) تبقى في ذاكرة المعالج المؤقتة
+REPORT_QUERIES = 200
+REPORT_K = 5
+REPORT_RESCORE = (0, 2, 4, 8)
+
+
+# ===================== التكميم =====================
+def quantize(matrix, mode):
+    """(المصفوفة المضغوطة، المعاملات) — المعاملات None لـ float16"""
+    matrix = np.asarray(matrix, dtype=DTYPE)
+    if mode == "float16":
+        return matrix.astype(np.float16), None
+    if mode == "int8":
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        q = np.rint(matrix / scales[:, None]).astype(np.int8)
+        return q, scales.astype(DTYPE)
+    raise ValueError(f"unknown quantization mode: {mode}")
+
+
+# ===================== الفهرس المضغوط =====================
+class QuantizedIndex:
+    """غلاف حول VectorIndex بنفس واجهة scores/top_k/search فوق نسخة مضغوطة"""
+
+    def __init__(self, index, codes, scales=None, mode="int8", rescore=QUANT_RESCORE):
+        self.index = index
+        self.codes = codes        # صفوف المصفوفة الأساسية مضغوطة
+        self.scales = scales      # معامل كل صف (int8 فقط)
+        self.mode = mode
+        self.rescore = rescore
+
+    @classmethod
+    def build(cls, index, mode="int8", rescore=QUANT_RESCORE):
+        """تكميم صفوف المصفوفة الأساسية (دفعة دفعة من memory-map)"""
+        n = index.matrix.shape[0]
+        codes = np.empty((n, index.dim), dtype=np.float16 if mode == "float16" else np.int8)
+        scales = np.empty(n, dtype=DTYPE) if mode == "int8" else None
+        for start in range(0, n, SCORE_BLOCK):
+            q, s = quantize(index.matrix[start:start + SCORE_BLOCK], mode)
+            codes[start:start + len(q)] = q
+            if scales is not None:
+                scales[start:start + len(q)] = s
+        return cls(index, codes, scales, mode, rescore)
+
+    @property
+    def info(self):
+        return self.index.info
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __len__(self):
+        return len(self.index)
+
+    def approx_scores(self, q):
+        """درجات تقريبية للمصفوفة الأساسية (q متجه float32 مطبّع)"""
+        n = self.codes.shape[0]
+        scores = np.empty(n, dtype=DTYPE)
+        for start in range(0, n, SCORE_BLOCK):
+            block = np.asarray(self.codes[start:start + SCORE_BLOCK], dtype=DTYPE)
+            scores[start:start + len(block)] = block @ q
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def scores(self, q_vec, k=None, rescore=None):
+        """درجات بطول الفهرس كاملًا
+
+        مع k وrescore > 0: أفضل k × rescore صفًا بالدرجة التقريبية تُعاد
+        درجاتهم الدقيقة من float32، وبقية الصفوف الأساسية = ‎-inf (حتى لا
+        تُقارن درجة تقريبية بدرجة دقيقة). دون ذلك تُعاد الدرجات التقريبية.
+        """
+        q = to_query_vector(q_vec, self.index.dim)
+        if q is None or len(self) == 0:
+            return self.index.scores(q_vec)
+
+        rescore = self.rescore if rescore is None else rescore
+        n_base = self.codes.shape[0]
+        approx = self.approx_scores(q)
+        if self.index.deleted.size:
+            base_dead = self.index.deleted[self.index.deleted < n_base]
+            approx[base_dead] = -np.inf
+
+        if k and rescore:
+            scores = np.full(len(self), -np.inf, dtype=DTYPE)
+            n_cand = min(k * rescore, n_base)
+            if n_cand:
+                cand = np.sort(np.argpartition(-approx, n_cand - 1)[:n_cand])
+                cand = cand[np.isfinite(approx[cand])]
+                scores[cand] = np.asarray(self.index.matrix[cand], dtype=DTYPE) @ q
+        else:
+            scores = np.empty(len(self), dtype=DTYPE)
+            scores[:n_base] = approx
+        offset = n_base
+        for m in self.index.segments:
+            scores[offset:offset + len(m)] = m @ q
+            offset += len(m)
+        if self.index.deleted.size:
+            scores[self.index.deleted] = -np.inf
+        return scores
+
+    def top_k(self, scores, k, min_score=None):
+        return self.index.top_k(scores, k, min_score)
+
+    def search(self, q_vec, k, min_score=None, rescore=None):
+        return self.top_k(self.scores(q_vec, k, rescore), k, min_score)
+
+    # ---------- الحفظ والتحميل ----------
+    def save(self, path, source_mtime):
+        """حفظ النسخة المضغوطة وتسجيل embeddings.npy التي بُنيت منها"""
+        name = QUANT_FILES[self.mode]
+        _save(path, name, self.codes)
+        if self.scales is not None:
+            _save(path, SCALES_FILE, self.scales)
+        meta = _read_quant_meta(path)
+        meta[self.mode] = {"rows": int(self.codes.shape[0]), "source_mtime": source_mtime}
+        tmp = os.path.join(path, QUANT_META_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(path, QUANT_META_FILE))
+
+
+def _save(path, name, array):
+    tmp = os.path.join(path, name + ".tmp")
+    with open(tmp, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp, os.path.join(path, name))
+
+
+def _read_quant_meta(path):
+    file = os.path.join(path, QUANT_META_FILE)
+    if not os.path.exists(file):
+        return {}
+    with open(file, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _source_mtime(path):
+    from index_store import EMBEDDINGS_FILE
+    return os.path.getmtime(os.path.join(path, EMBEDDINGS_FILE))
+
+
+def load_quantized(index, path, mode="int8", rescore=QUANT_RESCORE):
+    """فتح النسخة المضغوطة عبر memory-map، أو None إذا لم تُبنَ أو صارت قديمة
+
+    تصبح قديمة عند إعادة بناء embeddings.npy أو ضغطها (يتغير وقت تعديل
+    الملف)، وعندها يُعاد البحث الدقيق حتى يُعاد التكميم.
+    """
+    file = os.path.join(path, QUANT_FILES[mode])
+    entry = _read_quant_meta(path).get(mode)
+    if entry is None or not os.path.exists(file):
+        return None
+    if entry["rows"] != index.matrix.shape[0] or entry["source_mtime"] != _source_mtime(path):
+        print(f"⚠️ نسخة {mode} لا تطابق الفهرس الحالي؛ أعد تشغيل: python quant_index.py build {mode}")
+        return None
+    codes = np.load(file, mmap_mode="r")
+    scales = np.load(os.path.join(path, SCALES_FILE)) if mode == "int8" else None
+    return QuantizedIndex(index, codes, scales, mode, rescore)
+
+
+def build_quantized_files(path, modes=tuple(QUANT_FILES)):
+    """تكميم embeddings.npy الحالية وحفظ النسخ المطلوبة؛ يعيد [(mode, nbytes)]"""
+    from index_store import load_index
+    index = load_index(path)
+    source_mtime = _source_mtime(path)
+    built = []
+    for mode in modes:
+        qi = QuantizedIndex.build(index, mode)
+        qi.save(path, source_mtime)
+        built.append((mode, qi.nbytes))
+    return built
+
+
+def refresh_quantized_files(path):
+    """إعادة تكميم النسخ الموجودة بعد إعادة بناء embeddings.npy أو ضغطها"""
+    modes = [m for m in _read_quant_meta(path) if os.path.exists(os.path.join(path, QUANT_FILES[m]))]
+    return build_quantized_files(path, modes) if modes else []
+
+
+# ===================== تقرير المقارنة =====================
+def quant_report(index, n_queries=REPORT_QUERIES, k=REPORT_K, rescores=REPORT_RESCORE, seed=0):
+    """الذاكرة وrecall@k ومتوسط الزمن لكل (نمط، rescore) مقارنةً بـ float32
+
+    الأسئلة عيّنة من تضمينات المقاطع نفسها مع ضجيج خفيف (كما في ann_index).
+    """
+    rng = np.random.default_rng(seed)
+    n = index.matrix.shape[0]
+    picks = rng.choice(n, size=min(n_queries, n), replace=False)
+    queries = np.asarray(index.matrix[np.sort(picks)], dtype=DTYPE)
+    queries += rng.normal(scale=0.02, size=queries.shape).astype(DTYPE)
+
+    t0 = time.perf_counter()
+    truth = [[r["id"] for r in index.search(q, k)] for q in queries]
+    exact_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+    matrix_mb = index.matrix.shape[0] * index.dim * np.dtype(DTYPE).itemsize / 2**20
+
+    rows = [("float32", "-", matrix_mb, 1.0, exact_ms)]
+    for mode in QUANT_FILES:
+        qi = QuantizedIndex.build(index, mode)
+        for rescore in rescores:
+            t0 = time.perf_counter()
+            found = [[r["id"] for r in qi.search(q, k, rescore=rescore)] for q in queries]
+            ms = (time.perf_counter() - t0) * 1000 / len(queries)
+            recall = np.mean([len(set(f) & set(t)) / max(len(t), 1) for f, t in zip(found, truth)])
+            rows.append((mode, rescore, qi.nbytes / 2**20, float(recall), ms))
+    return rows
+
+
+# ===================== تنفيذ مباشر =====================
+if __name__ == "__main__":
+    from index_store import INDEX_DIR, load_index
+
+    args = sys.argv[1:]
+    cmd = args.pop(0) if args and args[0] in ("build", "report") else "build"
+    modes = tuple(QUANT_FILES)
+    if args and args[0] in ("float16", "int8", "all"):
+        arg = args.pop(0)
+        modes = modes if arg == "all" else (arg,)
+    path = args[0] if args else INDEX_DIR
+
+    index = load_index(path)
+    if index is None:
+        print(f"❌ لا يوجد فهرس في {path}؛ شغّل أولًا: python index_store.py")
+        sys.exit(1)
+
+    if cmd == "build":
+        t0 = time.time()
+        for mode, nbytes in build_quantized_files(path, modes):
+            print(f"✅ {mode}: {index.matrix.shape[0]} صفًا في {nbytes / 2**20:.1f} MB")
+        print(f"⏱️ خلال {time.time() - t0:.1f} ث.")
+    else:
+        print(f"📊 recall@{REPORT_K} مقابل float32 ({index.matrix.shape[0]} مقطعًا، dim={index.dim}):")
+        for mode, rescore, mb, recall, ms in quant_report(index):
+            print(f"  {mode:<8} rescore={rescore!s:<2} ذاكرة={mb:8.1f} MB  "
+                  f"recall={recall*100:5.1f}%  زمن={ms:7.2f} ms")
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+query_cache.py
+🔹 ذاكرة تضمينات الأسئلة أمام طلب /embeddings في LM Studio
+- المفتاح: (اسم النموذج، بصمة السؤال بعد التطبيع وإزالة الحركات)
+- طبقة أولى في الذاكرة (LRU بحجم محدود ومدة صلاحية TTL)
+- طبقة ثانية اختيارية على القرص: نفس ملف embedding_cache.sqlite الذي
+  يملؤه الإدخال، فالسؤال المطابق لنص مقطع مُدخل لا يحتاج طلبًا أصلًا
+- نسخة واحدة لكل عملية تتشاركها كل الواجهات (وكل جلسات Streamlit)
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+from embedding_cache import EmbeddingCache, EMBED_CACHE_PATH, text_hashes
+
+# ===================== الإعدادات =====================
+QUERY_CACHE_MAX_ENTRIES = 2048       # عدد الأسئلة في الذاكرة
+QUERY_CACHE_TTL = 24 * 3600          # ثوانٍ؛ None = بلا انتهاء
+QUERY_CACHE_DISK_PATH = EMBED_CACHE_PATH   # None لتعطيل الطبقة الثانية
+
+
+class QueryEmbeddingCache:
+    """LRU + TTL في الذاكرة، مع EmbeddingCache اختياري على القرص"""
+
+    def __init__(self, max_entries=QUERY_CACHE_MAX_ENTRIES, ttl=QUERY_CACHE_TTL,
+                 disk_path=QUERY_CACHE_DISK_PATH):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk = EmbeddingCache(disk_path) if disk_path else None
+        self.entries = OrderedDict()   # (model, hash) → (وقت الإضافة، المتجه)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _get_memory(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            if self.ttl is not None and time.time() - item[0] > self.ttl:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def _put_memory(self, key, vec):
+        with self.lock:
+            self.entries[key] = (time.time(), vec)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def embed(self, model, text, fetch):
+        """تضمين السؤال من الذاكرة إن وُجد، وإلا عبر fetch(text) ثم تخزينه"""
+        h = text_hashes(text)[1]
+        key = (model, h)
+        vec = self._get_memory(key)
+        if vec is not None:
+            return vec
+        if self.disk is not None:
+            vec = self.disk.get_many(model, [h]).get(h)
+            if vec is not None:
+                with self.lock:
+                    self.disk_hits += 1
+                self._put_memory(key, vec)
+                return vec
+        with self.lock:
+            self.misses += 1
+        vec = fetch(text)
+        self._put_memory(key, vec)
+        if self.disk is not None:
+            self.disk.put_many(model, [(h, vec)])
+        return vec
+
+    def stats(self):
+        with self.lock:
+            entries, hits, disk_hits, misses = len(self.entries), self.hits, self.disk_hits, self.misses
+        total = hits + disk_hits + misses
+        return {
+            "entries": entries,
+            "hits": hits,
+            "disk_hits": disk_hits,
+            "misses": misses,
+            "hit_rate": (hits + disk_hits) / total if total else 0.0,
+        }
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def get_query_cache():
+    """النسخة المشتركة في هذه العملية (تُنشأ عند أول استعمال)"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = QueryEmbeddingCache()
+        return _shared
+
+
+def cached_embed(model, text, fetch):
+    """واجهة مختصرة: get_query_cache().embed(...)"""
+    return get_query_cache().embed(model, text, fetch)
@@ -3,17 +3,23 @@
 search_and_ask.py  –  الإصدار 2 (النسخة المحسّنة)
 - يعمل مع LM Studio المحلي عبر /v1/completions
 - يستخدم نموذج multilingual E5 large للتضمين (يدعم العربية بدقة)
-- يتضمن تحسينات دلالية للبحث (Query Expansion + Lower Threshold)
+- بحث هجين: تشابه دلالي + BM25 معجمي مدموجان بـ RRF (بدل توسيع السؤال بكلمات ثابتة)
 - يستخرج نتائج أدق وأكثر ارتباطاً بالسؤال العربي
 """
 
 import os
 import sys
-import math
-import psycopg2
-import requests
+import json
+import time
 from textwrap import shorten
 
+from index_store import open_index, attach_contents, embedding_columns
+from lexical_index import open_lexical, hybrid_search
+from citation_verifier import verify_answer, format_report
+from query_cache import cached_embed
+from db_pool import get_pool
+from http_client import post_json, stream_post
+
 # ===================== إعدادات الاتصال =====================
 DB = dict(
     host="localhost",
@@ -32,47 +38,40 @@ EMBED_MODEL = "text-embedding-intfloat-multilingual-e5-large-instruct"  # ✅ ن
 # إعدادات البحث
 TOP_K = 5           # زيادة عدد النتائج
 MIN_ACCEPT = 0.55   # تخفيض حد القبول لتوسيع نطاق التشابه
+SEARCH_BACKEND = "exact"  # "exact" أو "ivf" (ann_index.py) أو "int8"/"float16" (quant_index.py) أو "pgvector" (pg_search.py)
+HYBRID_SEARCH = True      # دمج ترتيب BM25 (lexical_index.py) مع الترتيب الدلالي
 MAX_TOKENS = 512
 TEMPERATURE = 0.2
-TIMEOUT = 180
 
 
 # ===================== أدوات مساعدة =====================
-def cosine(a, b):
-    """حساب التشابه الكوني"""
-    if not a or not b or len(a) != len(b):
-        return 0.0
-    dot = sum(x*y for x, y in zip(a, b))
-    na = math.sqrt(sum(x*x for x in a))
-    nb = math.sqrt(sum(y*y for y in b))
-    if na == 0 or nb == 0:
-        return 0.0
-    return dot / (na * nb)
+def connect_db():
+    return get_pool(DB).connect()
 
 
 def embed(text, embed_model):
-    """توليد تضمين عبر LM Studio"""
-    r = requests.post(f"{LM_STUDIO_BASE}/embeddings",
-                      json={"model": embed_model, "input": text},
-                      timeout=TIMEOUT)
-    r.raise_for_status()
-    data = r.json()
+    """توليد تضمين عبر LM Studio (الأسئلة المكررة من query_cache)"""
+    return cached_embed(embed_model, text, lambda t: _embed_remote(t, embed_model))
+
+
+def _embed_remote(text, embed_model):
+    data = post_json(f"{LM_STUDIO_BASE}/embeddings", {"model": embed_model, "input": text}, op="embed")
     return data["data"][0]["embedding"]
 
 
 def fetch_chunks():
     """جلب المقاطع من قاعدة البيانات"""
-    conn = psycopg2.connect(**DB)
+    conn = connect_db()
     cur = conn.cursor()
-    cur.execute("""
-        SELECT id, book_id, book_name, content, embedding_vector
+    cur.execute(f"""
+        SELECT id, book_id, book_name, content, {embedding_columns(conn)}
         FROM Chunk
         ORDER BY id ASC
     """)
     rows = cur.fetchall()
     cur.close(); conn.close()
-    return [dict(id=c, book_id=b, book_name=n, content=t, embedding=v)
-            for c,b,n,t,v in rows]
+    return [dict(id=c, book_id=b, book_name=n, content=t, embedding=p if p is not None else v)
+            for c,b,n,t,p,v in rows]
 
 
 def short_extract(text, max_words=20):
@@ -81,12 +80,6 @@ def short_extract(text, max_words=20):
     return text if len(words) <= max_words else " ".join(words[:max_words]) + "..."
 
 
-def verify_quote_in_chunk(quote, chunk_text):
-    """تحقق حرفي"""
-    q = quote.strip().strip('"').rstrip("…").rstrip("...")
-    return q in chunk_text
-
-
 def build_prompt(query, ranked):
     """بناء prompt للإرسال إلى /v1/completions"""
     lines = []
@@ -108,18 +101,32 @@ def build_prompt(query, ranked):
     return prompt.replace("{", "(").replace("}", ")")
 
 
-def chat_with_completions(prompt, chat_model):
-    """استدعاء LM Studio عبر /v1/completions"""
+def stream_completions(prompt, chat_model):
+    """استدعاء LM Studio عبر /v1/completions مع stream=True: الرموز تُعاد فور وصولها (SSE)"""
     payload = {
         "model": chat_model,
         "prompt": prompt,
         "max_tokens": MAX_TOKENS,
         "temperature": TEMPERATURE,
+        "stream": True,
     }
-    r = requests.post(f"{LM_STUDIO_BASE}/completions", json=payload, timeout=TIMEOUT)
-    r.raise_for_status()
-    data = r.json()
-    return data["choices"][0].get("text", "").strip()
+    t0 = time.time()
+    first = True
+    with stream_post(f"{LM_STUDIO_BASE}/completions", payload) as r:
+        # text/event-stream بلا charset يُفك افتراضيًا ISO-8859-1 فتفسد الحروف العربية
+        r.encoding = "utf-8"
+        for line in r.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            token = json.loads(data)["choices"][0].get("text", "")
+            if token:
+                if first:
+                    print(f"⏱️ أول رمز بعد {time.time() - t0:.2f} ث", file=sys.stderr)
+                    first = False
+                yield token
 
 
 def ask(query):
@@ -128,22 +135,19 @@ def ask(query):
     print(f"🧩 Chat Model: {CHAT_MODEL}")
     print(f"🧩 Embed Model: {EMBED_MODEL}\n")
 
-    # 🌐 توسيع السؤال دلاليًا لتقوية التطابق داخل الكتب
-    query += " التعليم الإلكتروني التحول الرقمي المناهج التفاعلية التعلم عن بعد تكنولوجيا التعليم تطوير التعليم في الوطن العربي"
-
     # 1️⃣ توليد تضمين
     q_vec = embed(query, EMBED_MODEL)
 
-    # 2️⃣ جلب المقاطع وحساب التشابه
-    chunks = fetch_chunks()
-    scored = []
-    for c in chunks:
-        s = cosine(q_vec, c["embedding"])
-        if s >= MIN_ACCEPT:
-            scored.append({**c, "score": s})
+    # 2️⃣ فتح الفهرس (ملف ./index إن وُجد، وإلا جلب المقاطع من القاعدة)
+    index = open_index(fetch_chunks, connect=connect_db, backend=SEARCH_BACKEND)
 
-    # 3️⃣ ترتيب النتائج
-    ranked = sorted(scored, key=lambda x: x["score"], reverse=True)[:TOP_K]
+    # 3️⃣ ترتيب النتائج: دمج التشابه الدلالي مع BM25 المعجمي (RRF) بدل توسيع السؤال بكلمات ثابتة
+    if HYBRID_SEARCH:
+        lex = open_lexical(connect_db)
+        ranked = hybrid_search(index, lex, q_vec, query, TOP_K, MIN_ACCEPT, connect=connect_db)
+    else:
+        ranked = index.search(q_vec, TOP_K, MIN_ACCEPT)
+    attach_contents(connect_db, ranked)
 
     # 4️⃣ عرض المراجع
     if not ranked:
@@ -155,26 +159,31 @@ def ask(query):
             print("  مقتطف:", shorten(r["content"], width=120, placeholder="…"))
         print()
 
-    # 5️⃣ توليد الإجابة
+    # 5️⃣ توليد الإجابة وعرضها أثناء وصولها
+    print("\n🧠 الإجابة:\n", end=" ", flush=True)
+    parts = []
     try:
         prompt = build_prompt(query, ranked)
-        answer = chat_with_completions(prompt, CHAT_MODEL)
+        for token in stream_completions(prompt, CHAT_MODEL):
+            parts.append(token)
+            print(token, end="", flush=True)
     except Exception as e:
-        print("❌ خطأ أثناء استدعاء النموذج:", e)
+        print("\n❌ خطأ أثناء استدعاء النموذج:", e)
         return
+    answer = "".join(parts).strip()
+    print("\n")
 
-    # 6️⃣ عرض الإجابة
-    print("\n🧠 الإجابة:\n", answer, "\n")
-
-    # 7️⃣ التحقق من المراجع
-    print("📖 المراجع (تحقق حرفي):")
+    # 7️⃣ التحقق من الاقتباسات الفعلية في الإجابة مقابل المقاطع
+    print("📖 المراجع:")
     if not ranked:
         print("لا توجد مراجع كافية."); return
+    report = verify_answer(answer, [r["content"] for r in ranked])
     for i, r in enumerate(ranked, 1):
-        excerpt = short_extract(r["content"], 20)
-        verified = "✓" if verify_quote_in_chunk(excerpt, r["content"]) else "✗"
-        print(f"(مرجع {i}) كتاب: {r['book_name']} — تشابه: {r['score']*100:.1f}% — متحقق: {verified}")
-        print(f'مقتطف: "{excerpt}"\n')
+        cited = report["citations"].get(i, 0)
+        print(f"(مرجع {i}) كتاب: {r['book_name']} — تشابه: {r['score']*100:.1f}% — ذُكر {cited} مرة")
+        print(f'مقتطف: "{short_extract(r["content"], 20)}"\n')
+    print("🔎 الاقتباسات (تحقق حرفي):")
+    print("\n".join(format_report(report)) or "لا توجد اقتباسات في الإجابة.")
 
 
 # ===================== تنفيذ مباشر =====================
@@ -7,13 +7,18 @@ search_and_ask_with_memory.py
 
 import os
 import sys
-import math
+import time
 import json
-import psycopg2
-import requests
 from textwrap import shorten
 from datetime import datetime
 
+from index_store import open_index, attach_contents, embedding_columns
+from lexical_index import open_lexical, hybrid_search
+from query_cache import cached_embed
+from db_pool import get_pool
+from http_client import post_json, stream_post
+from citation_verifier import verify_answer, references_payload, format_report
+
 # ===================== إعدادات الاتصال =====================
 DB = dict(
     host="localhost",
@@ -29,46 +34,39 @@ EMBED_MODEL = "text-embedding-intfloat-multilingual-e5-large-instruct"
 
 TOP_K = 5
 MIN_ACCEPT = 0.55
+SEARCH_BACKEND = "exact"  # "exact" أو "ivf" أو "int8"/"float16" أو "pgvector"
+HYBRID_SEARCH = True      # دمج ترتيب BM25 (lexical_index.py) مع الترتيب الدلالي
 MAX_TOKENS = 512
 TEMPERATURE = 0.2
-TIMEOUT = 180
 
 
 # ===================== أدوات مساعدة =====================
-def cosine(a, b):
-    if not a or not b or len(a) != len(b):
-        return 0.0
-    dot = sum(x*y for x, y in zip(a, b))
-    na = math.sqrt(sum(x*x for x in a))
-    nb = math.sqrt(sum(y*y for y in b))
-    return 0.0 if (na == 0 or nb == 0) else dot / (na * nb)
+def embed(text):
+    """توليد تضمين عبر LM Studio (الأسئلة المكررة من query_cache)"""
+    return cached_embed(EMBED_MODEL, text, _embed_remote)
 
 
-def embed(text):
-    """توليد تضمين عبر LM Studio"""
-    r = requests.post(f"{LM_STUDIO_BASE}/embeddings",
-                      json={"model": EMBED_MODEL, "input": text},
-                      timeout=TIMEOUT)
-    r.raise_for_status()
-    return r.json()["data"][0]["embedding"]
+def _embed_remote(text):
+    data = post_json(f"{LM_STUDIO_BASE}/embeddings", {"model": EMBED_MODEL, "input": text}, op="embed")
+    return data["data"][0]["embedding"]
 
 
 def connect_db():
-    return psycopg2.connect(**DB)
+    return get_pool(DB).connect()
 
 
 def fetch_chunks():
     conn = connect_db()
     cur = conn.cursor()
-    cur.execute("""
-        SELECT id, book_id, book_name, content, embedding_vector
+    cur.execute(f"""
+        SELECT id, book_id, book_name, content, {embedding_columns(conn)}
         FROM chunk
         ORDER BY id ASC
     """)
     rows = cur.fetchall()
     cur.close(); conn.close()
-    return [dict(id=c, book_id=b, book_name=n, content=t, embedding=v)
-            for c,b,n,t,v in rows]
+    return [dict(id=c, book_id=b, book_name=n, content=t, embedding=p if p is not None else v)
+            for c,b,n,t,p,v in rows]
 
 
 def short_extract(text, max_words=20):
@@ -76,11 +74,6 @@ def short_extract(text, max_words=20):
     return text if len(words) <= max_words else " ".join(words[:max_words]) + "..."
 
 
-def verify_quote_in_chunk(quote, chunk_text):
-    q = quote.strip().strip('"').rstrip("…").rstrip("...")
-    return q in chunk_text
-
-
 def build_prompt(query, ranked):
     lines = []
     for i, r in enumerate(ranked, 1):
@@ -99,18 +92,32 @@ def build_prompt(query, ranked):
     return prompt.replace("{", "(").replace("}", ")")
 
 
-def chat_with_completions(prompt):
+def stream_completions(prompt):
+    """استدعاء LM Studio عبر /v1/completions مع stream=True: الرموز تُعاد فور وصولها (SSE)"""
     payload = {
         "model": CHAT_MODEL,
         "prompt": prompt,
         "max_tokens": MAX_TOKENS,
         "temperature": TEMPERATURE,
+        "stream": True,
     }
-    r = requests.post(f"{LM_STUDIO_BASE}/completions", json=payload, timeout=TIMEOUT)
-    r.raise_for_status()
-    data = r.json()
-    return data["choices"][0].get("text", "").strip()
-
+    t0 = time.time()
+    first = True
+    with stream_post(f"{LM_STUDIO_BASE}/completions", payload) as r:
+        # text/event-stream بلا charset يُفك افتراضيًا ISO-8859-1 فتفسد الحروف العربية
+        r.encoding = "utf-8"
+        for line in r.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            token = json.loads(data)["choices"][0].get("text", "")
+            if token:
+                if first:
+                    print(f"⏱️ أول رمز بعد {time.time() - t0:.2f} ث", file=sys.stderr)
+                    first = False
+                yield token
 
 # ===================== إدارة قاعدة البيانات للمحادثات =====================
 def ensure_conversation():
@@ -146,16 +153,15 @@ def ask(query):
     print(f"🧩 Chat Model: {CHAT_MODEL}")
     print(f"🧩 Embed Model: {EMBED_MODEL}\n")
 
-    query += " التعليم الإلكتروني التحول الرقمي المناهج التفاعلية التعلم عن بعد تكنولوجيا التعليم تطوير التعليم في الوطن العربي"
     q_vec = embed(query)
-    chunks = fetch_chunks()
-
-    scored = []
-    for c in chunks:
-        s = cosine(q_vec, c["embedding"])
-        if s >= MIN_ACCEPT:
-            scored.append({**c, "score": s})
-    ranked = sorted(scored, key=lambda x: x["score"], reverse=True)[:TOP_K]
+    index = open_index(fetch_chunks, connect=connect_db, backend=SEARCH_BACKEND)
+    # دمج التشابه الدلالي مع BM25 المعجمي (RRF) بدل توسيع السؤال بكلمات ثابتة
+    if HYBRID_SEARCH:
+        lex = open_lexical(connect_db)
+        ranked = hybrid_search(index, lex, q_vec, query, TOP_K, MIN_ACCEPT, connect=connect_db)
+    else:
+        ranked = index.search(q_vec, TOP_K, MIN_ACCEPT)
+    attach_contents(connect_db, ranked)
 
     if not ranked:
         print("⚠️ لم تُعثر مقاطع كافية ≥ 55%.\n")
@@ -167,23 +173,22 @@ def ask(query):
         print()
 
     prompt = build_prompt(query, ranked)
-    answer = chat_with_completions(prompt)
-
-    print("\n🧠 الإجابة:\n", answer, "\n")
-
-    print("📖 المراجع (تحقق حرفي):")
-    refs = []
-    for i, r in enumerate(ranked, 1):
-        excerpt = short_extract(r["content"], 20)
-        verified = verify_quote_in_chunk(excerpt, r["content"])
-        refs.append({
-            "book_name": r["book_name"],
-            "similarity": round(r["score"]*100, 2),
-            "excerpt": excerpt,
-            "verified": verified
-        })
-        print(f"(مرجع {i}) {r['book_name']} — تشابه: {r['score']*100:.1f}% — متحقق: {'✓' if verified else '✗'}")
-        print(f'مقتطف: "{excerpt}"\n')
+    print("\n🧠 الإجابة:\n", end=" ", flush=True)
+    parts = []
+    for token in stream_completions(prompt):
+        parts.append(token)
+        print(token, end="", flush=True)
+    answer = "".join(parts).strip()
+    print("\n")
+
+    print("📖 المراجع:")
+    report = verify_answer(answer, [r["content"] for r in ranked])
+    refs = references_payload(ranked, report, short_extract)
+    for i, ref in enumerate(refs["references"], 1):
+        print(f"(مرجع {i}) {ref['book_name']} — تشابه: {ref['similarity']:.1f}% — متحقق: {'✓' if ref['verified'] else '✗'}")
+        print(f'مقتطف: "{ref["excerpt"]}"\n')
+    print("🔎 الاقتباسات (تحقق حرفي):")
+    print("\n".join(format_report(report)) or "لا توجد اقتباسات في الإجابة.")
 
     # 💾 حفظ في قاعدة البيانات
     conv_id = ensure_conversation()
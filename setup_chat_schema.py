@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 import psycopg2
 
+from answer_cache import SCHEMA_SQL as ANSWER_CACHE_SQL
+
 DB = dict(
     host="localhost",
     port=5432,
@@ -30,6 +32,22 @@ CREATE TABLE IF NOT EXISTS message (
 -- فهارس مفيدة
 CREATE INDEX IF NOT EXISTS idx_message_conversation_id ON message(conversation_id);
 CREATE INDEX IF NOT EXISTS idx_message_created_at ON message(created_at);
+
+-- ترقيم المحادثات بالمفاتيح (last_message_at, id) وتحميل رسائل المحادثة صفحةً صفحة
+CREATE INDEX IF NOT EXISTS idx_conversation_last_message ON conversation(last_message_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_message_conversation_id_id ON message(conversation_id, id);
+
+-- مزامنة العدّادات للمحادثات القديمة (قبل أن يحدّثها save_messages)؛ آمنة للتكرار
+UPDATE conversation c
+SET message_count = m.n,
+    last_message_at = GREATEST(c.last_message_at, m.last_at)
+FROM (SELECT conversation_id, COUNT(*) AS n, MAX(created_at) AS last_at
+      FROM message GROUP BY conversation_id) m
+WHERE m.conversation_id = c.id AND c.message_count IS DISTINCT FROM m.n;
+
+-- البحث في العناوين (ILIKE '%...%') عبر فهرس trigram
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS idx_conversation_title_trgm ON conversation USING gin (title gin_trgm_ops);
 """
 
 def main():
@@ -37,8 +55,9 @@ def main():
     with psycopg2.connect(**DB) as conn:
         with conn.cursor() as cur:
             cur.execute(SQL)
+            cur.execute(ANSWER_CACHE_SQL)
         conn.commit()
-    print("✅ تم إنشاء/التحقق من الجداول conversation و message بنجاح.")
+    print("✅ تم إنشاء/التحقق من الجداول conversation و message و answer_cache بنجاح.")
 
 if __name__ == "__main__":
     main()
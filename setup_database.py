@@ -51,6 +51,8 @@ CREATE TABLE IF NOT EXISTS Book (
     size_mb FLOAT,
     content TEXT,
     processing_status TEXT DEFAULT 'pending',
+    file_hash TEXT,
+    last_chunk_index INT DEFAULT -1,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -65,6 +67,7 @@ CREATE TABLE IF NOT EXISTS Chunk (
     end_line INT,
     char_range INT[],
     embedding_vector DOUBLE PRECISION[],
+    embedding_f32 BYTEA,
     embedding_model TEXT,
     embedding_dim INT,
     similarity_score FLOAT DEFAULT 0,
@@ -90,6 +93,14 @@ CREATE TABLE IF NOT EXISTS Message (
     references_json JSONB,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+
+-- ترقيم المحادثات بالمفاتيح (last_message_at, id) وتحميل رسائل المحادثة صفحةً صفحة
+CREATE INDEX IF NOT EXISTS idx_conversation_last_message ON Conversation(last_message_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_message_conversation_id_id ON Message(conversation_id, id);
+
+-- البحث في العناوين (ILIKE '%...%') عبر فهرس trigram
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS idx_conversation_title_trgm ON Conversation USING gin (title gin_trgm_ops);
 """
 
 cur2.execute(create_tables_sql)
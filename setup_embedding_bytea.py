@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+setup_embedding_bytea.py
+🔹 ترحيل اختياري: عمود chunk.embedding_f32 من نوع BYTEA (float32 little-endian)
+- يُضاف العمود ويُملأ من embedding_vector (DOUBLE PRECISION[]) على دفعات
+- ingest_books.py يكتب العمودين لكل مقطع جديد
+- القرّاء (index_store.py و fetch_chunks) يفكّون العمود بـ np.frombuffer مباشرة
+  إلى صفوف المصفوفة بدل تحليل نص المصفوفة إلى قوائم float في Python
+- bench يقيس حجم النقل وزمن الجلب والفك لكل 10k مقطع بالطريقتين
+
+الاستخدام:
+  python setup_embedding_bytea.py [migrate]  # إضافة العمود وملؤه
+  python setup_embedding_bytea.py bench      # مقارنة DOUBLE PRECISION[] مع BYTEA
+"""
+
+import os
+import sys
+import time
+import psycopg2
+import numpy as np
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+
+from vector_index import DTYPE, PACKED_DTYPE, pack_embedding
+
+load_dotenv()
+
+DB_CONFIG = {
+    "host": os.getenv("host"),
+    "port": os.getenv("port"),
+    "user": os.getenv("user"),
+    "password": os.getenv("password"),
+    "dbname": os.getenv("dbname"),
+}
+
+BACKFILL_BATCH = 2000
+BENCH_ROWS = 10_000
+
+SCHEMA_SQL = "ALTER TABLE chunk ADD COLUMN IF NOT EXISTS embedding_f32 BYTEA;"
+
+BACKFILL_SELECT_SQL = """
+SELECT id, embedding_vector FROM chunk
+WHERE embedding_f32 IS NULL AND embedding_vector IS NOT NULL
+ORDER BY id
+LIMIT %s;
+"""
+
+BACKFILL_UPDATE_SQL = """
+UPDATE chunk AS c SET embedding_f32 = v.packed
+FROM (VALUES %s) AS v(id, packed)
+WHERE c.id = v.id;
+"""
+
+
+def backfill(conn):
+    """نسخ التضمينات الحالية على دفعات حتى لا تطول المعاملة الواحدة"""
+    cur = conn.cursor()
+    total = 0
+    while True:
+        cur.execute(BACKFILL_SELECT_SQL, (BACKFILL_BATCH,))
+        rows = cur.fetchall()
+        if not rows:
+            break
+        execute_values(cur, BACKFILL_UPDATE_SQL,
+                       [(cid, psycopg2.Binary(pack_embedding(emb))) for cid, emb in rows],
+                       template="(%s, %s::bytea)", page_size=BACKFILL_BATCH)
+        conn.commit()
+        total += len(rows)
+        print(f"  … تم تحويل {total} تضمينًا")
+    cur.close()
+    return total
+
+
+# ===================== القياس =====================
+# المقاطع التي خزّنت تضمينًا احتياطيًا بُعد آخر (مثل متجه أصفار 768) تُستبعد
+# حتى تتساوى صفوف المصفوفة؛ القياس على البُعد الأكثر شيوعًا فقط
+BENCH_WHERE = "embedding_f32 IS NOT NULL AND octet_length(embedding_f32) = %s"
+
+
+def _dominant_bytes(conn):
+    """طول embedding_f32 بالبايت الأكثر شيوعًا، أو None إذا كان العمود فارغًا"""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT octet_length(embedding_f32) FROM chunk
+        WHERE embedding_f32 IS NOT NULL
+        GROUP BY 1 ORDER BY COUNT(*) DESC LIMIT 1;
+    """)
+    row = cur.fetchone()
+    cur.close()
+    conn.rollback()
+    return row[0] if row else None
+
+
+def _fetch_matrix(conn, column, limit, nbytes):
+    """ثوانٍ لجلب أول limit تضمين (بطول nbytes) من column وفكّها إلى مصفوفة float32"""
+    t0 = time.perf_counter()
+    cur = conn.cursor(name=f"bench_{column}")
+    cur.itersize = BACKFILL_BATCH
+    cur.execute(f"""
+        SELECT {column} FROM chunk
+        WHERE {BENCH_WHERE}
+        ORDER BY id LIMIT %s;
+    """, (nbytes, limit))
+    rows = cur.fetchall()
+    cur.close()
+    conn.rollback()
+    if column == "embedding_f32":
+        np.frombuffer(b"".join(r[0] for r in rows), dtype=PACKED_DTYPE).reshape(len(rows), -1)
+    else:
+        np.array([r[0] for r in rows], dtype=DTYPE)
+    return time.perf_counter() - t0
+
+
+def bench(conn, limit=BENCH_ROWS):
+    """حجم النقل وزمن الجلب + الفك لكل 10k مقطع (DOUBLE PRECISION[] مقابل BYTEA)
+
+    الحجم هو حجم البيانات بصيغة النقل النصية لـ psycopg2: نص المصفوفة،
+    وترميز hex للـ BYTEA (بايتان لكل بايت).
+    """
+    nbytes = _dominant_bytes(conn)
+    if nbytes is None:
+        print("⚠️ لا توجد مقاطع بعمود embedding_f32 مملوء؛ شغّل أولًا: python setup_embedding_bytea.py")
+        return []
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT COUNT(*), COALESCE(SUM(octet_length(embedding_vector::text)), 0),
+               COALESCE(SUM(2 * octet_length(embedding_f32) + 2), 0)
+        FROM (SELECT embedding_vector, embedding_f32 FROM chunk
+              WHERE {BENCH_WHERE} ORDER BY id LIMIT %s) t;
+    """, (nbytes, limit))
+    n, array_bytes, bytea_bytes = cur.fetchone()
+    cur.close()
+    conn.rollback()
+
+    scale = BENCH_ROWS / n
+    rows = []
+    for label, column, size in (("DOUBLE PRECISION[]", "embedding_vector", array_bytes),
+                                ("BYTEA float32", "embedding_f32", bytea_bytes)):
+        seconds = _fetch_matrix(conn, column, limit, nbytes)
+        rows.append((label, size * scale / 2**20, seconds * scale))
+    return rows
+
+
+def main():
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "migrate"
+    if cmd not in ("migrate", "bench"):
+        print("استخدم:\n  python setup_embedding_bytea.py [migrate|bench]")
+        sys.exit(1)
+
+    print("🔗 الاتصال بقاعدة البيانات…")
+    conn = psycopg2.connect(**DB_CONFIG)
+
+    if cmd == "bench":
+        print(f"📊 جلب وفك التضمينات لكل {BENCH_ROWS} مقطع:")
+        for label, mb, seconds in bench(conn):
+            print(f"  {label:<20} نقل={mb:8.1f} MB  جلب+فك={seconds:6.2f} ث")
+        conn.close()
+        return
+
+    cur = conn.cursor()
+    cur.execute(SCHEMA_SQL)
+    conn.commit()
+    cur.close()
+    total = backfill(conn)
+    conn.close()
+    print(f"✅ عمود embedding_f32 جاهز: {total} تضمينًا محوّلًا.")
+
+
+if __name__ == "__main__":
+    main()
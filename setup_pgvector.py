@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+setup_pgvector.py
+🔹 ترحيل اختياري: عمود chunk.embedding من نوع vector(1024) مع فهرس HNSW أو IVFFlat
+- يُنسخ embedding_vector (DOUBLE PRECISION[]) إلى العمود الجديد على دفعات
+- محفّز (trigger) يملأ العمود تلقائيًا لكل مقطع يُدخَل لاحقًا عبر ingest_books.py
+- يبقى العمود القديم كما هو، فمسار المصفوفات يبقى يعمل كخيار احتياطي
+
+الاستخدام:
+  python setup_pgvector.py          # فهرس HNSW (الافتراضي)
+  python setup_pgvector.py ivfflat  # فهرس IVFFlat
+"""
+
+import os
+import sys
+import psycopg2
+from dotenv import load_dotenv
+
+from pg_search import VECTOR_DIM
+
+load_dotenv()
+
+DB_CONFIG = {
+    "host": os.getenv("host"),
+    "port": os.getenv("port"),
+    "user": os.getenv("user"),
+    "password": os.getenv("password"),
+    "dbname": os.getenv("dbname"),
+}
+
+BACKFILL_BATCH = 5000
+
+SCHEMA_SQL = f"""
+CREATE EXTENSION IF NOT EXISTS vector;
+
+ALTER TABLE chunk ADD COLUMN IF NOT EXISTS embedding vector({VECTOR_DIM});
+
+CREATE OR REPLACE FUNCTION chunk_sync_embedding() RETURNS trigger AS $$
+BEGIN
+    IF array_length(NEW.embedding_vector, 1) = {VECTOR_DIM} THEN
+        NEW.embedding := NEW.embedding_vector::vector({VECTOR_DIM});
+    ELSE
+        NEW.embedding := NULL;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_chunk_sync_embedding ON chunk;
+CREATE TRIGGER trg_chunk_sync_embedding
+    BEFORE INSERT OR UPDATE OF embedding_vector ON chunk
+    FOR EACH ROW EXECUTE FUNCTION chunk_sync_embedding();
+"""
+
+BACKFILL_SQL = f"""
+UPDATE chunk SET embedding = embedding_vector::vector({VECTOR_DIM})
+WHERE id IN (
+    SELECT id FROM chunk
+    WHERE embedding IS NULL AND array_length(embedding_vector, 1) = {VECTOR_DIM}
+    LIMIT %s
+);
+"""
+
+INDEX_SQL = {
+    "hnsw": """
+        CREATE INDEX IF NOT EXISTS idx_chunk_embedding_hnsw
+        ON chunk USING hnsw (embedding vector_cosine_ops);
+    """,
+    "ivfflat": """
+        CREATE INDEX IF NOT EXISTS idx_chunk_embedding_ivfflat
+        ON chunk USING ivfflat (embedding vector_cosine_ops) WITH (lists = 100);
+    """,
+}
+
+
+def main():
+    kind = sys.argv[1] if len(sys.argv) > 1 else "hnsw"
+    if kind not in INDEX_SQL:
+        print("استخدم:\n  python setup_pgvector.py [hnsw|ivfflat]")
+        sys.exit(1)
+
+    print("🔗 الاتصال بقاعدة البيانات…")
+    conn = psycopg2.connect(**DB_CONFIG)
+    cur = conn.cursor()
+    try:
+        cur.execute(SCHEMA_SQL)
+        conn.commit()
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"❌ تعذّر تفعيل pgvector (سيبقى البحث بالمصفوفات): {e}")
+        cur.close(); conn.close()
+        return
+
+    # نسخ التضمينات الحالية على دفعات حتى لا تطول المعاملة الواحدة
+    total = 0
+    while True:
+        cur.execute(BACKFILL_SQL, (BACKFILL_BATCH,))
+        conn.commit()
+        if cur.rowcount == 0:
+            break
+        total += cur.rowcount
+        print(f"  … تم نسخ {total} تضمينًا")
+
+    # الفهرس يُبنى بعد النسخ (أسرع بكثير من تحديثه صفًا صفًا)
+    cur.execute(INDEX_SQL[kind])
+    cur.execute("ANALYZE chunk;")
+    conn.commit()
+    cur.close(); conn.close()
+    print(f"✅ تم تفعيل pgvector: {total} تضمينًا منسوخًا وفهرس {kind} جاهز.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+test_db_pool.py
+🔹 فحص db_pool بعد fork (يحتاج قاعدة البيانات في .env)
+- عملية ابنة تستدعي get_pool وتستخدم اتصالًا من مجمّعها
+- اتصال الأب المستعار قبل fork يبقى صالحًا بعد خروج الابنة
+"""
+
+import os
+import multiprocessing as mp
+
+from dotenv import load_dotenv
+
+from db_pool import get_pool
+
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), ".env"))
+
+DB = {
+    "host": os.getenv("host"),
+    "port": os.getenv("port"),
+    "user": os.getenv("user"),
+    "password": os.getenv("password"),
+    "dbname": os.getenv("dbname"),
+}
+
+
+def _select_one(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT 1;")
+    value = cur.fetchone()[0]
+    cur.close()
+    conn.rollback()
+    return value
+
+
+def _child(queue):
+    import gc
+    pool = get_pool(DB)
+    conn = pool.connect()
+    queue.put(_select_one(conn))
+    conn.close()
+    gc.collect()
+
+
+def test_parent_connection_survives_child_pool():
+    pool = get_pool(DB)
+    conn = pool.getconn()
+    pool.putconn(conn)
+
+    ctx = mp.get_context("fork")
+    queue = ctx.Queue()
+    child = ctx.Process(target=_child, args=(queue,))
+    child.start()
+    assert queue.get(timeout=60) == 1
+    child.join(60)
+    assert child.exitcode == 0
+
+    # الاتصال نفسه يعود من المجمّع دون فحص صحة (آخر استخدام أقل من DB_POOL_HEALTH_IDLE)
+    conn = pool.connect()
+    assert _select_one(conn) == 1
+    conn.close()
+
+
+if __name__ == "__main__":
+    test_parent_connection_survives_child_pool()
+    print("✅ اتصالات الأب سليمة بعد get_pool في عملية ابنة")
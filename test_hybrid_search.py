@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+test_hybrid_search.py
+🔹 فحص hybrid_search دون قاعدة بيانات (اتصال وهمي يعيد تضمينات ثابتة)
+- مقطع لا يطابق السؤال إلا معجميًا وتشابهه الكوني سالب لا يتجاوز MIN_ACCEPT
+- النتائج تبقى k بعد إسقاط ما دون العتبة
+"""
+
+import numpy as np
+
+from lexical_index import LexicalIndex, hybrid_search
+from vector_index import VectorIndex
+
+MIN_ACCEPT = 0.55
+DIM = 8
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.ids = []
+
+    def execute(self, sql, params=None):
+        self.ids = params[0] if params and "ANY" in sql else []
+
+    def fetchone(self):
+        return None    # لا يوجد عمود embedding_f32
+
+    def fetchall(self):
+        return [r for r in self.rows if r[0] in self.ids]
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def cursor(self):
+        return FakeCursor(self.rows)
+
+    def close(self):
+        pass
+
+
+def make_fixture():
+    rng = np.random.default_rng(0)
+    q = rng.normal(size=DIM)
+    # مقاطع قريبة من السؤال في الفهرس الدلالي (id 1..4)
+    chunks = [dict(id=i, book_id=1, book_name="كتاب", start_line=0, end_line=0,
+                   embedding=(q + rng.normal(scale=0.2, size=DIM)).tolist()) for i in range(1, 5)]
+    index = VectorIndex.from_chunks(chunks)
+    # مقطع id=99 يحوي كلمات السؤال وتضمينه عكس السؤال (تشابه ≈ ‎-1)
+    lex = LexicalIndex()
+    lex.add_documents([1, 2, 3, 4, 99], ["نص أول", "نص ثان", "نص ثالث", "نص رابع",
+                                         "المناهج التفاعلية المناهج التفاعلية"])
+    rows = [(99, 1, "كتاب", 0, 0, None, (-q).tolist())]
+    return q, index, lex, (lambda: FakeConnection(rows))
+
+
+def test_lexical_hit_below_threshold_is_dropped():
+    q, index, lex, connect = make_fixture()
+    ranked = hybrid_search(index, lex, q, "المناهج التفاعلية", 3, MIN_ACCEPT, connect=connect)
+    assert 99 not in [r["id"] for r in ranked]
+    assert len(ranked) == 3
+    assert all(r["score"] >= MIN_ACCEPT for r in ranked)
+
+
+def test_lexical_hit_kept_without_threshold():
+    q, index, lex, connect = make_fixture()
+    ranked = hybrid_search(index, lex, q, "المناهج التفاعلية", 5, None, connect=connect)
+    hit = next(r for r in ranked if r["id"] == 99)
+    assert hit["score"] < -0.99 and hit["bm25"] > 0
+
+
+if __name__ == "__main__":
+    test_lexical_hit_below_threshold_is_dropped()
+    test_lexical_hit_kept_without_threshold()
+    print("✅ hybrid_search يطبّق MIN_ACCEPT على نتائج BM25 وحدها")
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+test_pgvector_search.py
+🔹 مقارنة خلفية pgvector بمسار المصفوفات على قاعدة Postgres محلية
+- يتطلب تشغيل setup_pgvector.py أولًا
+- يأخذ تضمينات مقاطع عشوائية كأسئلة ويقارن أفضل k من الخلفيتين والزمن
+"""
+
+import os
+import time
+import psycopg2
+from dotenv import load_dotenv
+
+from pg_search import open_pgvector
+from vector_index import VectorIndex
+
+load_dotenv()
+
+DB = dict(
+    host=os.getenv("host"),
+    port=os.getenv("port"),
+    user=os.getenv("user"),
+    password=os.getenv("password"),
+    dbname=os.getenv("dbname"),
+)
+
+TOP_K = 5
+MIN_ACCEPT = 0.55
+N_QUERIES = 10
+
+
+def connect_db():
+    return psycopg2.connect(**DB)
+
+
+def fetch_chunks():
+    conn = connect_db()
+    cur = conn.cursor()
+    cur.execute("SELECT id, book_id, book_name, content, embedding_vector FROM chunk ORDER BY id ASC;")
+    rows = cur.fetchall()
+    cur.close(); conn.close()
+    return [dict(id=c, book_id=b, book_name=n, content=t, embedding=v) for c, b, n, t, v in rows]
+
+
+def main():
+    pg = open_pgvector(connect_db)
+    if pg is None:
+        return
+
+    t0 = time.time()
+    array_index = VectorIndex.from_chunks(fetch_chunks())
+    print(f"📦 مسار المصفوفات: تحميل {len(array_index)} مقطعًا خلال {time.time() - t0:.2f} ث.")
+
+    conn = connect_db()
+    cur = conn.cursor()
+    cur.execute("SELECT embedding_vector FROM chunk WHERE embedding IS NOT NULL ORDER BY random() LIMIT %s;",
+                (N_QUERIES,))
+    queries = [r[0] for r in cur.fetchall()]
+    cur.close(); conn.close()
+
+    overlap, t_pg, t_arr = 0.0, 0.0, 0.0
+    for q in queries:
+        t0 = time.time()
+        a = [r["id"] for r in pg.search(q, TOP_K, MIN_ACCEPT)]
+        t_pg += time.time() - t0
+        t0 = time.time()
+        b = [r["id"] for r in array_index.search(q, TOP_K, MIN_ACCEPT)]
+        t_arr += time.time() - t0
+        overlap += len(set(a) & set(b)) / max(len(b), 1)
+        print(f"  pgvector={a}  arrays={b}")
+
+    n = max(len(queries), 1)
+    print(f"✅ تطابق أفضل {TOP_K}: {overlap / n * 100:.1f}% — "
+          f"pgvector {t_pg / n * 1000:.1f} ms / سؤال، المصفوفات {t_arr / n * 1000:.1f} ms / سؤال")
+
+
+if __name__ == "__main__":
+    main()
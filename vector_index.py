@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+vector_index.py
+🔹 محرك تشابه موحّد (NumPy) تستخدمه كل مسارات الاسترجاع
+- يحفظ التضمينات مطبّعة مسبقًا بصيغة float32 في مصفوفة متصلة واحدة
+- يحسب التشابه الكوني لكل المقاطع بعملية ضرب مصفوفة × متجه واحدة
+- يختار أفضل k نتيجة بفرز جزئي (argpartition) بدل فرز كل النتائج
+- يقرأ التضمينات الثنائية (عمود embedding_f32) بـ np.frombuffer دون قوائم Python
+"""
+
+from collections import Counter
+
+import numpy as np
+
+DTYPE = np.float32
+PACKED_DTYPE = np.dtype("<f4")   # صيغة عمود chunk.embedding_f32 (float32 little-endian)
+
+
+# ===================== أدوات مساعدة =====================
+def normalize_rows(matrix):
+    """تطبيع كل صف إلى طول 1 (الصفوف الصفرية تبقى صفرية فيكون تشابهها 0)"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+def pack_embedding(vec):
+    """تضمين → bytes بصيغة PACKED_DTYPE لعمود embedding_f32"""
+    return np.asarray(vec, dtype=PACKED_DTYPE).tobytes()
+
+
+def unpack_embedding(buf):
+    """bytes/memoryview من عمود embedding_f32 → متجه float32 (عرض على نفس الذاكرة دون نسخ)"""
+    return np.frombuffer(buf, dtype=PACKED_DTYPE)
+
+
+def as_vector(v):
+    """تضمين مخزّن بأي صيغة (قائمة أو bytes) → متجه، أو [] إذا كان فارغًا"""
+    if v is None:
+        return []
+    if isinstance(v, (bytes, bytearray, memoryview)):
+        return unpack_embedding(v)
+    return v
+
+
+def to_query_vector(q_vec, dim):
+    """تحويل متجه السؤال إلى float32 مطبّع، أو None إذا لم يطابق بُعد الفهرس"""
+    q = np.asarray(q_vec, dtype=DTYPE).ravel()
+    if q.size == 0 or q.size != dim:
+        return None
+    n = np.linalg.norm(q)
+    return None if n == 0 else q / n
+
+
+# ===================== الفهرس =====================
+class VectorIndex:
+    """مصفوفة تضمينات مطبّعة + بيانات وصفية لكل صف (بنفس ترتيب الصفوف)"""
+
+    def __init__(self, matrix, meta, info=None):
+        self.matrix = matrix
+        self.meta = meta
+        self.info = info or {}
+        self.segments = []                          # صفوف أضيفت بعد البناء (مزامنة تزايدية)
+        self.deleted = np.zeros(0, dtype=np.int64)  # مواقع الصفوف المحذوفة (tombstones)
+
+    @classmethod
+    def from_chunks(cls, chunks, key="embedding"):
+        """بناء الفهرس من قوائم المقاطع كما تعيدها fetch_chunks()
+
+        التضمين قائمة (DOUBLE PRECISION[]) أو bytes (embedding_f32). يُزال
+        مفتاحه من البيانات الوصفية حتى لا يبقى في الذاكرة بجانب المصفوفة.
+        المقاطع التي يختلف بُعد تضمينها عن البُعد الغالب تُخزَّن صفوفًا
+        صفرية (تشابه 0) كما كانت cosine() تفعل.
+        """
+        vectors = [as_vector(c.get(key)) for c in chunks]
+        lengths = Counter(len(v) for v in vectors if len(v))
+        dim = lengths.most_common(1)[0][0] if lengths else 0
+
+        matrix = np.zeros((len(chunks), dim), dtype=DTYPE)
+        for i, v in enumerate(vectors):
+            if len(v) == dim:
+                matrix[i] = v
+        normalize_rows(matrix)
+
+        meta = [{k: val for k, val in c.items() if k != key} for c in chunks]
+        # علامة max_id تسمح بمزامنة الفهرس تزايديًا (index_store.sync_index)
+        ids = [m["id"] for m in meta if m.get("id") is not None]
+        info = {"dim": dim, "count": len(meta), "max_id": max(ids, default=0)}
+        return cls(matrix, meta, info)
+
+    def copy(self):
+        """نسخة تتشارك المصفوفات نفسها؛ إضافة صفوف إليها أو حذفها لا يمس الأصل"""
+        index = type(self)(self.matrix, list(self.meta), dict(self.info))
+        index.segments = list(self.segments)
+        index.deleted = self.deleted
+        return index
+
+    def __len__(self):
+        return self.matrix.shape[0] + sum(m.shape[0] for m in self.segments)
+
+    @property
+    def dim(self):
+        return self.matrix.shape[1]
+
+    @property
+    def live_count(self):
+        return len(self) - self.deleted.size
+
+    def append(self, matrix, meta_rows):
+        """إضافة صفوف جديدة مطبّعة كمقطع مستقل دون نسخ المصفوفة الأساسية"""
+        if len(matrix) == 0:
+            return
+        self.segments.append(matrix)
+        for m in meta_rows:
+            self.meta.append(m)
+
+    def delete(self, positions):
+        """تعليم صفوف كمحذوفة؛ تُستبعد من النتائج حتى الضغط (compaction)"""
+        self.deleted = np.union1d(self.deleted, np.asarray(positions, dtype=np.int64))
+
+    def rows(self):
+        """كل الصفوف (الأساسية ثم المضافة) كمصفوفة واحدة"""
+        return np.concatenate([self.matrix] + self.segments) if self.segments else self.matrix
+
+    def scores(self, q_vec):
+        """درجات التشابه الكوني لكل المقاطع دفعة واحدة (المحذوفة = ‎-inf)"""
+        q = to_query_vector(q_vec, self.dim)
+        if q is None or len(self) == 0:
+            return np.zeros(len(self), dtype=DTYPE)
+        scores = self.matrix @ q
+        if self.segments:
+            scores = np.concatenate([scores] + [m @ q for m in self.segments])
+        if self.deleted.size:
+            scores[self.deleted] = -np.inf
+        return scores
+
+    def top_k(self, scores, k, min_score=None):
+        """أفضل k نتيجة (≥ min_score) مرتبة تنازليًا بصيغة {**meta, "score": s}"""
+        if k <= 0:
+            return []
+        if min_score is None:
+            idx = np.flatnonzero(np.isfinite(scores))
+        else:
+            idx = np.flatnonzero(scores >= min_score)
+        if idx.size > k:
+            part = np.argpartition(-scores[idx], k - 1)[:k]
+            idx = np.sort(idx[part])
+        # ترتيب تنازلي ثابت: عند التعادل يبقى ترتيب المقاطع الأصلي (id ASC)
+        idx = idx[np.argsort(-scores[idx], kind="stable")]
+        return [{**self.meta[i], "score": float(scores[i])} for i in idx]
+
+    def search(self, q_vec, k, min_score=None):
+        """حساب التشابه واختيار أفضل k في خطوة واحدة"""
+        return self.top_k(self.scores(q_vec), k, min_score)